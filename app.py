@@ -15,18 +15,38 @@ try:
     from attendance_checker import (
         danh_gia_di_muon_vang,
         loai_bo_nguoi_nghi_phep,
-        tao_noi_dung_email,
+        ngay_kiem_tra_gan_nhat,
+        tao_noi_dung_email_dong,
+        vi_pham_ngay_dong,
         gui_email,
+        gui_qua_hop_thu_di,
+        tao_ma_lo,
+        xu_ly_hop_thu_di,
+        thong_ke_hop_thu_di,
+        HOP_THU_CHO_GUI,
+        HOP_THU_KHONG_RO,
         luu_log,  # Add this import
+        tao_ma_tran_diem_danh,
+        loc_ma_tran_nghi_phep,
+        vi_pham_tu_ma_tran,
+        tao_email_tong_hop,
+        doc_log_nguoc,
+        DEFAULT_EVENT_LOG_FILE,
+        bien_dich_mau_email,
+        PLACEHOLDER_NAME,
+        xoa_cache_diem_danh,
         DEFAULT_ATTENDANCE_FILE,
         DEFAULT_LEAVE_REQUESTS_FILE,
         DEFAULT_EMAILS_FILE,
         DEFAULT_EMAIL_TEMPLATE_FILE,
+        DEFAULT_LEDGER_FILE,
         VIOLATION_LATE,
         VIOLATION_ABSENT,
         FINE_LATE,
         FINE_ABSENT,
-        EMAIL_SUBJECT
+        EMAIL_SUBJECT,
+        TRANG_THAI_THANH_CONG,
+        TRANG_THAI_DA_GUI_TRUOC
     )
     functions_loaded = True
 except ImportError as e:
@@ -45,6 +65,9 @@ def save_uploaded_file(uploaded_file, destination):
         try:
             with open(destination, "wb") as f:
                 f.write(uploaded_file.getvalue())
+            # File điểm danh vừa bị ghi đè: bỏ dữ liệu đã phân tích của bản cũ
+            if destination == DEFAULT_ATTENDANCE_FILE:
+                xoa_cache_diem_danh(destination)
             return True
         except Exception as e:
             st.sidebar.error(f"Lỗi khi lưu file: {str(e)}")
@@ -102,6 +125,20 @@ def display_results_table(data, title):
         st.info(f"Không có {title.lower()}")
         return 0
 
+def display_send_results(ket_qua_gui):
+    """Display per-recipient send results; returns True if every email was sent"""
+    st.subheader("Kết quả Gửi Email")
+    all_success = True
+    for email, trang_thai in ket_qua_gui.items():
+        if trang_thai == TRANG_THAI_THANH_CONG:
+            st.success(f"{email}: {trang_thai}")
+        elif trang_thai == TRANG_THAI_DA_GUI_TRUOC:
+            st.info(f"{email}: {trang_thai}")
+        else:
+            st.error(f"{email}: {trang_thai}")
+            all_success = False
+    return all_success
+
 def initialize_app():
     """Initialize the Streamlit app with custom header and styling"""
     st.markdown("""
@@ -264,28 +301,117 @@ def process_attendance(ngay, gio, file_paths):
             
         return ket_qua, None
 
-def view_log_history(log_file="email_logs.txt"):
+def process_digest(tu_ngay, den_ngay, gio, file_paths):
+    """Collect every violation per member over a range of days, after leave filtering"""
+    with st.spinner("Đang đọc và phân tích file điểm danh..."):
+        ma_tran, loi = tao_ma_tran_diem_danh(gio.strftime('%H:%M'), file_paths["Excel điểm danh"])
+        if loi:
+            return None, loi
+        thang = ngay_kiem_tra_gan_nhat(den_ngay)
+        ma_tran = loc_ma_tran_nghi_phep(ma_tran, file_paths["danh sách nghỉ phép"], thang=thang)
+        return vi_pham_tu_ma_tran(ma_tran, tu_ngay, den_ngay, thang=thang), None
+
+def send_day_violations(gui_dong, tieu_de, lo):
+    """Render one day's violation emails in chunks and send each chunk through the outbox batch lo"""
+    file_paths = gui_dong["file_paths"]
+    ngay_vi_pham = ngay_kiem_tra_gan_nhat(gui_dong["ngay"])
+    nguon = tao_noi_dung_email_dong(
+        vi_pham_ngay_dong(
+            gui_dong["ngay"],
+            gui_dong["gio"],
+            ten_file_excel=file_paths["Excel điểm danh"],
+            ten_file_leave_requests=file_paths["danh sách nghỉ phép"],
+            ngay=ngay_vi_pham
+        ),
+        ten_file_emails=file_paths["CSV emails"],
+        ten_file_mau=file_paths["mẫu Email"],
+        ten_file_log=DEFAULT_EVENT_LOG_FILE,
+        ngay_vi_pham=ngay_vi_pham,
+        tang_muc_phat=gui_dong["tang_muc_phat"],
+        ten_file_so_cai=DEFAULT_LEDGER_FILE
+    )
+    return gui_qua_hop_thu_di(nguon, tieu_de, lo=lo, ten_file_so_cai=DEFAULT_LEDGER_FILE)
+
+def format_log_run(lan_chay):
+    """Format one run record from the event log as the text shown in the history tab."""
+    lines = [
+        f"Thời gian ghi log: {lan_chay.get('thoi_gian', '')}",
+        f"Ngày kiểm tra: {lan_chay.get('ngay_kiem_tra', '')}",
+        f"Giờ so sánh: {lan_chay.get('gio_so_sanh', '')}",
+        f"Tiêu đề email: {lan_chay.get('tieu_de', '')}",
+        "",
+        "DANH SÁCH VI PHẠM:",
+    ]
+    if lan_chay.get("di_muon"):
+        lines.append(f"Đi muộn ({len(lan_chay['di_muon'])}):")
+        lines.extend(f"- {ten}" for ten in lan_chay["di_muon"])
+    if lan_chay.get("vang"):
+        lines.append(f"Vắng mặt ({len(lan_chay['vang'])}):")
+        lines.extend(f"- {ten}" for ten in lan_chay["vang"])
+    lines.append("")
+    lines.append("KẾT QUẢ GỬI EMAIL:")
+    lines.extend(f"- {email}: {trang_thai}" for email, trang_thai in lan_chay.get("ket_qua", {}).items())
+    lines.append("")
+    lines.append(f"Tổng kết: Thành công: {lan_chay.get('thanh_cong', 0)}, Thất bại: {lan_chay.get('that_bai', 0)}")
+    return "\n".join(lines)
+
+LOG_PAGE_SIZE = 10  # Runs shown per page in the history tab
+
+def _load_log_page(log_file, page_size):
+    """Read the next (older) page of runs from the log and move to it."""
+    state = st.session_state.log_history
+    cursor = state["pages"][-1][1] if state["pages"] else None
+    state["pages"].append(doc_log_nguoc(page_size, cursor, log_file))
+    state["page"] = len(state["pages"]) - 1
+
+def _show_older_logs(log_file, page_size):
+    state = st.session_state.log_history
+    if state["page"] + 1 < len(state["pages"]):
+        state["page"] += 1
+    else:
+        _load_log_page(log_file, page_size)
+
+def _show_newer_logs():
+    st.session_state.log_history["page"] -= 1
+
+def view_log_history(log_file=DEFAULT_EVENT_LOG_FILE, page_size=LOG_PAGE_SIZE):
     """
-    Display the log history in a formatted way using Streamlit.
+    Display the log history one page at a time, most recent runs first.
+    
+    Pages are read backwards from the end of the log and kept in session state, so a
+    rerun only renders the current page; older pages are read when requested.
     
     Args:
-        log_file (str): Path to the log file
+        log_file (str): Path to the JSONL event log
+        page_size (int): Number of runs per page
     """
     try:
-        with open(log_file, "r", encoding="utf-8") as f:
-            logs = f.read().split("="*50)
-            logs = [log.strip() for log in logs if log.strip()]
-            
+        log_size = os.path.getsize(log_file) if os.path.exists(log_file) else -1
+        state = st.session_state.get("log_history")
+        if not state or state["file"] != log_file or state["size"] != log_size:
+            # New runs were logged (or another file was chosen): start again from the newest page
+            state = st.session_state.log_history = {"file": log_file, "size": log_size, "pages": [], "page": 0}
+            _load_log_page(log_file, page_size)
+            state["size"] = os.path.getsize(log_file) if os.path.exists(log_file) else -1
+
+        logs, cursor = state["pages"][state["page"]]
         if not logs:
             st.info("Chưa có lịch sử gửi email.")
             return
-            
-        for log in logs:
-            with st.expander(f"Log {log.split('Thời gian ghi log: ')[1].split('\n')[0]}", expanded=False):
-                st.text(log)
+
+        for lan_chay in logs:
+            with st.expander(f"Log {lan_chay.get('thoi_gian', '')}", expanded=False):
+                st.text(format_log_run(lan_chay))
+
+        col_newer, col_page, col_older = st.columns(3)
+        with col_newer:
+            st.button("← Mới hơn", key="log_newer", disabled=state["page"] == 0, on_click=_show_newer_logs)
+        with col_page:
+            st.caption(f"Trang {state['page'] + 1}")
+        with col_older:
+            st.button("Cũ hơn →", key="log_older", disabled=cursor == 0,
+                      on_click=_show_older_logs, args=(log_file, page_size))
                 
-    except FileNotFoundError:
-        st.info("Chưa có file log.")
     except Exception as e:
         st.error(f"Lỗi khi đọc log: {str(e)}")
 
@@ -306,7 +432,56 @@ def main():
     # Main processing
     with col1:
         st.subheader("Kết quả Phân tích Điểm danh")
-        if st.button("📊 Bắt đầu Kiểm tra"):
+        tang_muc_phat = st.checkbox(
+            "Tăng mức phạt theo số lần vi phạm",
+            value=False,
+            help="Số lần vi phạm được đếm từ lịch sử gửi email"
+        )
+        tong_hop = st.checkbox(
+            "Gửi email tổng hợp nhiều ngày",
+            value=False,
+            help="Mỗi thành viên nhận một email liệt kê mọi vi phạm trong khoảng ngày"
+        )
+        if tong_hop:
+            tu_ngay = st.number_input("Từ ngày", min_value=1, max_value=int(ngay), value=max(1, int(ngay) - 6), step=1)
+        if tong_hop and st.button("📊 Bắt đầu Kiểm tra", key="check_digest_button"):
+            vi_pham, error = process_digest(tu_ngay, ngay, gio, file_paths)
+            if error:
+                st.error(error)
+            else:
+                danh_sach_di_muon = [ten for ten, ds in vi_pham.items() if any(loai == VIOLATION_LATE for loai, _ in ds)]
+                danh_sach_vang = [ten for ten, ds in vi_pham.items() if any(loai == VIOLATION_ABSENT for loai, _ in ds)]
+                st.write(f"**Vi phạm từ ngày {tu_ngay} đến ngày {ngay} (đã lọc người nghỉ phép):**")
+                if vi_pham:
+                    st.dataframe(pd.DataFrame(
+                        [(ten, sum(loai == VIOLATION_LATE for loai, _ in ds), sum(loai == VIOLATION_ABSENT for loai, _ in ds))
+                         for ten, ds in vi_pham.items()],
+                        columns=["Tên", VIOLATION_LATE, VIOLATION_ABSENT]
+                    ))
+                st.session_state.processed_data = {
+                    "di_muon": danh_sach_di_muon,
+                    "vang_sau_loc": danh_sach_vang,
+                    "vi_pham": vi_pham
+                }
+                if vi_pham:
+                    with st.spinner("Đang tạo nội dung email..."):
+                        emails_can_gui = tao_email_tong_hop(
+                            vi_pham,
+                            ten_file_emails=file_paths["CSV emails"],
+                            ten_file_mau=file_paths["mẫu Email"],
+                            ten_file_log=DEFAULT_EVENT_LOG_FILE,
+                            tang_muc_phat=tang_muc_phat,
+                            ten_file_so_cai=DEFAULT_LEDGER_FILE
+                        )
+                        st.session_state.emails_can_gui = emails_can_gui
+                        st.session_state.gui_dong = None
+                        st.session_state.ket_qua_gui_tu_dong = None
+                        st.success(f"Đã tạo xong {len(emails_can_gui)} email tổng hợp.")
+                else:
+                    st.session_state.emails_can_gui = {}
+                    st.session_state.gui_dong = None
+                    st.info("Không có vi phạm nào cần tạo email.")
+        if not tong_hop and st.button("📊 Bắt đầu Kiểm tra"):
             results, error = process_attendance(ngay, gio, file_paths)
             if error:
                 st.error(error)
@@ -321,7 +496,8 @@ def main():
                 with st.spinner("Đang lọc danh sách người nghỉ phép..."):
                     danh_sach_vang_sau_loc = loai_bo_nguoi_nghi_phep(
                         danh_sach_vang=danh_sach_vang_ban_dau,
-                        ten_file_leave_requests=file_paths["danh sách nghỉ phép"]
+                        ten_file_leave_requests=file_paths["danh sách nghỉ phép"],
+                        ngay=ngay_kiem_tra_gan_nhat(ngay)
                     )
                 
                 removed_count = display_results_table(danh_sach_vang_sau_loc, "Danh sách vắng (sau khi lọc người nghỉ phép)")
@@ -333,18 +509,19 @@ def main():
                     "vang_sau_loc": danh_sach_vang_sau_loc
                 }
                 
+                # Nội dung email được tạo dần khi gửi (send_day_violations), không tạo trước cả lô
+                st.session_state.emails_can_gui = {}
+                st.session_state.ket_qua_gui_tu_dong = None
                 if danh_sach_di_muon or danh_sach_vang_sau_loc:
-                    with st.spinner("Đang tạo nội dung email..."):
-                        emails_can_gui = tao_noi_dung_email(
-                            danh_sach_vang=danh_sach_vang_sau_loc,
-                            danh_sach_di_muon=danh_sach_di_muon,
-                            ten_file_emails=file_paths["CSV emails"],
-                            ten_file_mau=file_paths["mẫu Email"]
-                        )
-                        st.session_state.emails_can_gui = emails_can_gui
-                        st.success(f"Đã tạo xong nội dung cho {len(emails_can_gui)} email.")
+                    st.session_state.gui_dong = {
+                        "ngay": ngay,
+                        "gio": gio.strftime('%H:%M'),
+                        "file_paths": dict(file_paths),
+                        "tang_muc_phat": tang_muc_phat
+                    }
+                    st.success(f"Có {len(danh_sach_di_muon) + len(danh_sach_vang_sau_loc)} vi phạm cần gửi email thông báo.")
                 else:
-                    st.session_state.emails_can_gui = {}
+                    st.session_state.gui_dong = None
                     st.info("Không có vi phạm nào cần tạo email.")
     
     # Email sending section
@@ -355,7 +532,66 @@ def main():
         tab1, tab2, tab3 = st.tabs(["Gửi Email Tự động", "Gửi Email Thủ công", "Lịch sử"])
         
         with tab1:
-            if 'emails_can_gui' in st.session_state and st.session_state.emails_can_gui:
+            # Email còn lại trong hộp thư đi từ lần chạy trước (ví dụ tab bị tải lại giữa chừng)
+            thong_ke_hop_thu = thong_ke_hop_thu_di()
+            if thong_ke_hop_thu.get(HOP_THU_KHONG_RO):
+                st.warning(f"{thong_ke_hop_thu[HOP_THU_KHONG_RO]} email bị gián đoạn khi đang gửi, không rõ đã tới người nhận hay chưa. Vui lòng kiểm tra thủ công.")
+            if thong_ke_hop_thu.get(HOP_THU_CHO_GUI):
+                st.info(f"Còn {thong_ke_hop_thu[HOP_THU_CHO_GUI]} email đang chờ trong hộp thư đi.")
+                if st.button("▶️ Tiếp tục gửi email đang chờ", key="resume_outbox_button"):
+                    with st.spinner("Đang gửi email đang chờ... Vui lòng đợi."):
+                        ket_qua_gui = xu_ly_hop_thu_di(ten_file_so_cai=DEFAULT_LEDGER_FILE)
+                    display_send_results(ket_qua_gui)
+            
+            gui_dong = st.session_state.get("gui_dong")
+            if gui_dong:
+                processed_data = st.session_state.processed_data
+                st.info(f"Có {len(processed_data['di_muon']) + len(processed_data['vang_sau_loc'])} vi phạm cần thông báo. Email được tạo và gửi dần.")
+
+                with st.expander("Xem trước danh sách người sẽ nhận email"):
+                    for ten in processed_data["vang_sau_loc"]:
+                        st.markdown(f"**{VIOLATION_ABSENT}:** {ten}")
+                    for ten in processed_data["di_muon"]:
+                        st.markdown(f"**{VIOLATION_LATE}:** {ten}")
+
+                tieu_de_email = st.text_input("Nhập tiêu đề email:", value=EMAIL_SUBJECT, key="stream_email_subject")
+
+                # Gửi lại chỉ các email lỗi của lô trước trong hộp thư đi, không tạo lại nội dung
+                ket_qua_truoc = st.session_state.get("ket_qua_gui_tu_dong")
+                gui_lai = bool(ket_qua_truoc) and any(
+                    tt not in (TRANG_THAI_THANH_CONG, TRANG_THAI_DA_GUI_TRUOC) for tt in ket_qua_truoc.values()
+                )
+                gui_moi = st.button("✉️ Gửi tất cả Email", key="send_stream_button")
+                if gui_moi or (gui_lai and st.button("🔁 Gửi lại các email lỗi", key="retry_stream_button")):
+                    with st.spinner("Đang tạo và gửi email... Vui lòng đợi."):
+                        from dotenv import load_dotenv
+                        load_dotenv()
+                        if gui_moi:
+                            lo = tao_ma_lo()
+                            st.session_state.lo_hop_thu_di = lo
+                            ket_qua_gui = send_day_violations(gui_dong, tieu_de_email, lo)
+                        else:
+                            ket_qua_gui = dict(ket_qua_truoc)
+                            ket_qua_gui.update(xu_ly_hop_thu_di(
+                                st.session_state.lo_hop_thu_di, gui_lai_loi=True, ten_file_so_cai=DEFAULT_LEDGER_FILE
+                            ))
+                    st.session_state.ket_qua_gui_tu_dong = ket_qua_gui
+
+                    all_success = display_send_results(ket_qua_gui)
+                    luu_log(
+                        ngay_kiem_tra=gui_dong["ngay"],
+                        gio_so_sanh=gui_dong["gio"],
+                        danh_sach_di_muon=processed_data["di_muon"],
+                        danh_sach_vang=processed_data["vang_sau_loc"],
+                        ket_qua_gui=ket_qua_gui,
+                        tieu_de=tieu_de_email
+                    )
+                    if all_success:
+                        st.balloons()
+                    else:
+                        st.warning("Một số email không gửi được. Vui lòng kiểm tra log lỗi.")
+
+            elif 'emails_can_gui' in st.session_state and st.session_state.emails_can_gui:
                 emails_to_send = st.session_state.emails_can_gui
                 st.info(f"Tìm thấy {len(emails_to_send)} email đã được tạo sẵn.")
                 
@@ -372,16 +608,15 @@ def main():
                         from dotenv import load_dotenv
                         load_dotenv()
                         
-                        ket_qua_gui = gui_email(emails_to_send, tieu_de_email)
+                        # Ghi vào hộp thư đi trước khi gửi để có thể tiếp tục nếu bị gián đoạn
+                        lo = tao_ma_lo()
+                        st.session_state.lo_hop_thu_di = lo
+                        ket_qua_gui = gui_qua_hop_thu_di(
+                            emails_to_send.items(), tieu_de_email, lo=lo, ten_file_so_cai=DEFAULT_LEDGER_FILE
+                        )
+                    st.session_state.ket_qua_gui_tu_dong = ket_qua_gui
                     
-                    st.subheader("Kết quả Gửi Email")
-                    all_success = True
-                    for email, trang_thai in ket_qua_gui.items():
-                        if trang_thai == "Thành công":
-                            st.success(f"{email}: {trang_thai}")
-                        else:
-                            st.error(f"{email}: {trang_thai}")
-                            all_success = False
+                    all_success = display_send_results(ket_qua_gui)
                     
                     # Add logging after sending emails
                     luu_log(
@@ -390,13 +625,40 @@ def main():
                         danh_sach_di_muon=st.session_state.processed_data["di_muon"],
                         danh_sach_vang=st.session_state.processed_data["vang_sau_loc"],
                         ket_qua_gui=ket_qua_gui,
-                        tieu_de=tieu_de_email
+                        tieu_de=tieu_de_email,
+                        vi_pham_theo_ten=st.session_state.processed_data.get("vi_pham")
                     )
                     
                     if all_success:
                         st.balloons()
                     else:
                         st.warning("Một số email không gửi được. Vui lòng kiểm tra log lỗi.")
+                
+                # Chỉ gửi lại những email lỗi của lần gửi trước
+                ket_qua_truoc = st.session_state.get("ket_qua_gui_tu_dong")
+                if ket_qua_truoc and any(tt not in (TRANG_THAI_THANH_CONG, TRANG_THAI_DA_GUI_TRUOC) for tt in ket_qua_truoc.values()):
+                    if st.button("🔁 Gửi lại các email lỗi", key="retry_failed_button"):
+                        with st.spinner("Đang gửi lại các email lỗi... Vui lòng đợi."):
+                            ket_qua_gui = dict(ket_qua_truoc)
+                            ket_qua_gui.update(xu_ly_hop_thu_di(
+                                st.session_state.lo_hop_thu_di, gui_lai_loi=True, ten_file_so_cai=DEFAULT_LEDGER_FILE
+                            ))
+                        st.session_state.ket_qua_gui_tu_dong = ket_qua_gui
+                        
+                        all_success = display_send_results(ket_qua_gui)
+                        luu_log(
+                            ngay_kiem_tra=ngay,
+                            gio_so_sanh=gio.strftime('%H:%M'),
+                            danh_sach_di_muon=st.session_state.processed_data["di_muon"],
+                            danh_sach_vang=st.session_state.processed_data["vang_sau_loc"],
+                            ket_qua_gui=ket_qua_gui,
+                            tieu_de=tieu_de_email,
+                            vi_pham_theo_ten=st.session_state.processed_data.get("vi_pham")
+                        )
+                        if all_success:
+                            st.balloons()
+                        else:
+                            st.warning("Vẫn còn email không gửi được. Vui lòng kiểm tra log lỗi.")
         
         # Add manual email tab
         with tab2:
@@ -461,12 +723,21 @@ def main():
                 try:
                     # Extract placeholders from template
                     if template_content:
-                        import re
-                        placeholders = re.findall(r'\[(.*?)\]', template_content)
+                        mau_email = bien_dich_mau_email(template_content)
+                        placeholders = mau_email.cac_placeholder
                         st.write("Các placeholder trong mẫu email:", ", ".join([f"[{p}]" for p in placeholders]))
                         
+                        # Map placeholders to CSV columns (case-insensitive) once
+                        columns_by_lower = {}
+                        for col in recipients_df.columns:
+                            columns_by_lower.setdefault(str(col).lower(), col)
+                        column_for_placeholder = {
+                            p: columns_by_lower[p.lower()] for p in placeholders
+                            if p != PLACEHOLDER_NAME and p.lower() in columns_by_lower
+                        }
+                        
                         # Verify CSV columns match placeholders
-                        missing_columns = [p for p in placeholders if p.lower() not in [col.lower() for col in recipients_df.columns]]
+                        missing_columns = [p for p in placeholders if p.lower() not in columns_by_lower]
                         if missing_columns:
                             st.warning(f"Các cột còn thiếu trong file CSV: {', '.join(missing_columns)}")
                         
@@ -506,34 +777,19 @@ def main():
                                             st.error(f"Email không hợp lệ: {recipient_email} cho {recipient_name}. Bỏ qua.")
                                             continue
                                             
-                                        # Create personalized content
-                                        personalized_content = template_content
-                                        
-                                        # Đảm bảo thay thế [Tên thành viên] bằng tên người nhận nếu có trong template
-                                        if "[Tên thành viên]" in personalized_content:
-                                            personalized_content = personalized_content.replace("[Tên thành viên]", recipient_name)
-                                        
-                                        # Thay thế các placeholder khác
-                                        for placeholder in placeholders:
-                                            if placeholder != "Tên thành viên" and placeholder.lower() in [col.lower() for col in recipients_df.columns]:
-                                                col = next(col for col in recipients_df.columns if col.lower() == placeholder.lower())
-                                                personalized_content = personalized_content.replace(f"[{placeholder}]", str(recipients_df.loc[idx, col]))
+                                        # Create personalized content: [Tên thành viên] is the recipient name,
+                                        # other placeholders come from the matching CSV column
+                                        values = {p: str(recipients_df.loc[idx, col]) for p, col in column_for_placeholder.items()}
+                                        values[PLACEHOLDER_NAME] = str(recipient_name)
                                         
-                                        emails_to_send[recipient_email] = personalized_content
+                                        emails_to_send[recipient_email] = mau_email.dien(values)
                                     
                                     with st.spinner("Đang gửi email... Vui lòng đợi."):
                                         from dotenv import load_dotenv
                                         load_dotenv()
                                         ket_qua_gui = gui_email(emails_to_send, tieu_de_email)
                                     
-                                    st.subheader("Kết quả Gửi Email")
-                                    all_success = True
-                                    for email, trang_thai in ket_qua_gui.items():
-                                        if trang_thai == "Thành công":
-                                            st.success(f"{email}: {trang_thai}")
-                                        else:
-                                            st.error(f"{email}: {trang_thai}")
-                                            all_success = False
+                                    all_success = display_send_results(ket_qua_gui)
                                     
                                     if all_success:
                                         st.balloons()
@@ -557,7 +813,7 @@ def main():
         with tab3:
             st.subheader("Lịch sử Gửi Email")
             if st.button("🔄 Làm mới", key="refresh_history"):
-                pass  # The view_log_history function will be called anyway
+                st.session_state.pop("log_history", None)
             view_log_history()
 
 if __name__ == "__main__":
@@ -1,11 +1,28 @@
 import pandas as pd
-from datetime import datetime, timedelta, time
+import numpy as np
+from datetime import date, datetime, timedelta, time
 import os
+import threading
+from time import monotonic, sleep
+import functools
+import difflib
+import hashlib
+import json
+import re
+import sqlite3
+import subprocess
 from dotenv import load_dotenv
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from typing import List, Dict, Optional, Tuple, Set
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.header import Header
+import base64
+import html
+from urllib.parse import quote
+import uuid
+from itertools import chain, islice
+from typing import List, Dict, Optional, Tuple, Set, Callable, Deque, Iterable, Iterator
 
 # --- Constants ---
 # File names
@@ -13,6 +30,15 @@ DEFAULT_ATTENDANCE_FILE = "attendance.xlsx"
 DEFAULT_LEAVE_REQUESTS_FILE = "leave_requests.txt"
 DEFAULT_EMAILS_FILE = "emails.csv"
 DEFAULT_EMAIL_TEMPLATE_FILE = "Mau_Email.txt"
+DEFAULT_CACHE_DIR = ".attendance_cache" # Parsed attendance sheets (sidecar .npz files)
+CACHE_MAX_BYTES = 64 * 1024 * 1024 # Size bound for DEFAULT_CACHE_DIR, oldest entries are evicted first
+DEFAULT_LOGO_FILE = os.path.join("assets", "logo.jpg") # Embedded at the top of the HTML email
+DEFAULT_EVENT_LOG_FILE = "email_logs.jsonl" # One JSON record per run and per recipient
+DEFAULT_LEDGER_FILE = "sent_ledger.db" # Violation notices already delivered (idempotency ledger)
+DEFAULT_QUOTA_FILE = "smtp_quota.json" # Messages sent today by each sender account
+DEFAULT_FILE_OUTPUT_DIR = "email_files" # Where the file transport writes messages (EMAIL_OUTPUT_PATH)
+DEFAULT_OUTBOX_FILE = "outbox.db" # SQLite outbox of rendered emails waiting to be sent
+OUTBOX_BATCH_SIZE = 50 # Emails claimed from the outbox per batch
 
 # Excel structure (Adjust if your structure differs)
 HEADER_ROW_INDEX = 3 # Row index (0-based) where the date numbers are found
@@ -23,6 +49,43 @@ ROW_INCREMENT = 2      # Number of rows per employee entry
 # Email settings & Content
 SMTP_DEFAULT_SERVER = 'smtp.gmail.com'
 SMTP_DEFAULT_PORT = 587
+SMTP_DEFAULT_POOL_SIZE = 4 # Parallel SMTP connections, override with SMTP_POOL_SIZE in .env
+# Transports (EMAIL_TRANSPORT in .env): SMTP server, local sendmail binary, or files on disk
+KENH_SMTP = "smtp"
+KENH_SENDMAIL = "sendmail"
+KENH_FILE = "file"
+CAC_KENH_GUI = (KENH_SMTP, KENH_SENDMAIL, KENH_FILE)
+SENDMAIL_DEFAULT_PATH = "/usr/sbin/sendmail"
+SENDMAIL_TEMPFAIL = 75 # sendmail exit code (EX_TEMPFAIL) for "try again later"
+DINH_DANG_EML = "eml" # One .eml file per message
+DINH_DANG_MAILDIR = "maildir" # Maildir (tmp/new/cur) usable by any mail client or relay
+DINH_DANG_MBOX = "mbox" # One mbox file per month
+CAC_DINH_DANG_FILE = (DINH_DANG_EML, DINH_DANG_MAILDIR, DINH_DANG_MBOX)
+SMTP_MAX_ACCOUNTS = 10 # Sender accounts read from .env: EMAIL_ADDRESS, EMAIL_ADDRESS_2 ... EMAIL_ADDRESS_<n>
+SMTP_DEFAULT_DAILY_QUOTA = 0 # Messages per account per day (0: no limit), override with EMAIL_DAILY_QUOTA[_<n>]
+SMTP_QUOTA_MARKERS = (b"5.4.5", b"limit exceeded", b"quota") # Replies meaning the sender account is out of quota
+SMTP_SEND_TIMEOUT = 60 # Seconds allowed per message in the asyncio send engine
+ASYNC_DEFAULT_MAX_IN_FLIGHT = 200 # Messages in progress at once in the asyncio send engine (benchmark only)
+STREAM_QUEUE_SIZE = 100 # Rendered emails waiting for a sender in the streaming pipeline
+STREAM_CHUNK_SIZE = 100 # Names looked up / rendered together in the streaming pipeline
+# Adaptive send rate (messages/second); SMTP_RATE_LIMIT in .env overrides the starting rate
+SMTP_DEFAULT_RATE = 5.0
+SMTP_MIN_RATE = 0.2
+SMTP_MAX_RATE = 50.0
+SMTP_THROTTLE_CODES = (421, 450, 451) # Temporary "slow down" replies from the provider
+SMTP_MAX_REQUEUE = 5 # Times a throttled message is put back in the queue before giving up
+SMTP_RECONNECT_ATTEMPTS = 5 # Reconnect attempts after a dropped SMTP session
+SMTP_RECONNECT_BASE_DELAY = 1.0 # Seconds before the first reconnect attempt, doubled after each failure
+TRANG_THAI_THANH_CONG = "Thành công"
+TRANG_THAI_DA_GUI_TRUOC = "Bỏ qua: đã gửi trước đó" # Every notice in this email was already delivered
+LOGO_CONTENT_ID = "logo-clb" # Content-ID referenced by the HTML part (<img src="cid:...">)
+
+# Outbox row states
+HOP_THU_CHO_GUI = "cho_gui"
+HOP_THU_DANG_GUI = "dang_gui"
+HOP_THU_DA_GUI = "da_gui"
+HOP_THU_LOI = "loi"
+HOP_THU_KHONG_RO = "khong_ro" # Was being sent when the process stopped; never resent automatically
 EMAIL_SUBJECT = "Thông báo vi phạm nội quy CLB Tiếng Anh"
 DAYS_TO_HANDLE_DEFAULT = 7 # Deadline for handling the violation
 
@@ -32,338 +95,3360 @@ VIOLATION_ABSENT = "Vắng không phép"
 FINE_LATE = "5,000"  # Format as string for direct insertion
 FINE_ABSENT = "20,000" # Format as string for direct insertion
 COUNT_DEFAULT = "1" # Default violation count
+# Escalating fines by violation count (1st, 2nd, ...); the last entry applies to every later violation
+FINE_ESCALATION = {
+    VIOLATION_LATE: [FINE_LATE, "10,000", "20,000"],
+    VIOLATION_ABSENT: [FINE_ABSENT, "40,000", "50,000"],
+}
+
+# Placeholders (text inside [...]) used by Mau_Email.txt
+PLACEHOLDER_NAME = "Tên thành viên"
+PLACEHOLDER_REASON = "Ví dụ: Đi họp muộn, nghỉ không phép, chưa đóng quỹ…"
+PLACEHOLDER_COUNT = "Số lần"
+PLACEHOLDER_FINE = "Số tiền"
+PLACEHOLDER_DEADLINE = "ngày/tháng/năm"
+
+# Attendance matrix statuses
+TRANG_THAI_DUNG_GIO = "Đúng giờ"
+TRANG_THAI_DI_MUON = "Đi muộn"
+TRANG_THAI_VANG = "Vắng"
+TRANG_THAI_KHONG_RO = "Không rõ" # Ô giờ vào không phân tích được
+TRANG_THAI_CO_PHEP = "Vắng có phép"
+# Status codes stored in the int8 matrix; the position in this list is the code
+CAC_TRANG_THAI = [TRANG_THAI_DUNG_GIO, TRANG_THAI_DI_MUON, TRANG_THAI_VANG, TRANG_THAI_KHONG_RO, TRANG_THAI_CO_PHEP]
+MA_DUNG_GIO, MA_DI_MUON, MA_VANG, MA_KHONG_RO, MA_CO_PHEP = range(len(CAC_TRANG_THAI))
+# Sentinels in the int16 minutes-since-midnight matrix
+PHUT_VANG = -1 # No "In" time (absent)
+PHUT_KHONG_HOP_LE = -2 # Unparseable "In" cell
+CACHE_FORMAT_VERSION = 2 # Bump when the layout of cached .npz files changes
+# Strings pd.read_excel treats as missing by default; the streaming reader mirrors this
+GIA_TRI_NA_EXCEL = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+    "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+})
+
+# Event log record types and the fixed-width sidecar index (<log>.idx), one entry per record
+LOG_BLOCK_SIZE = 64 * 1024 # Bytes read per step when reading the event log backwards
+LOG_LAN_CHAY = "lan_chay"
+LOG_NGUOI_NHAN = "nguoi_nhan"
+_MA_LOAI_LOG = {LOG_LAN_CHAY: 1, LOG_NGUOI_NHAN: 2}
+KIEU_CHI_MUC_LOG = np.dtype([
+    ("vi_tri", "<u8"),     # Byte offset of the record in the log
+    ("do_dai", "<u4"),     # Record length in bytes (including the newline)
+    ("loai", "u1"),        # _MA_LOAI_LOG
+    ("ngay", "<u4"),       # Date of the run as YYYYMMDD
+    ("nguoi_nhan", "<u8"), # _bam_nguoi_nhan(email) for recipient records, 0 for runs
+])
 
 # --- Functions ---
 
+def _doi_gio_sang_phut(cot_gio: pd.Series) -> pd.Series:
+    """
+    Chuyển cả một cột giờ vào sang số phút kể từ 0h.
+
+    Ô dạng chuỗi phải có định dạng 'HH:MM' (giống datetime.strptime(..., '%H:%M')),
+    ô dạng datetime/time được đổi cả loạt sang timedelta (pd.to_timedelta). Giây lẻ được
+    làm tròn lên phút kế tiếp để phép so sánh với giờ chuẩn (HH:MM) giữ nguyên kết quả.
+
+    Args:
+        cot_gio: Cột giá trị thô đọc từ Excel.
+
+    Returns:
+        Series kiểu float cùng index; NaN cho ô trống hoặc không phân tích được.
+    """
+    phut = pd.Series(np.nan, index=cot_gio.index, dtype="float64")
+    if cot_gio.empty:
+        return phut
+
+    # Ô dạng chuỗi: .str trả NaN cho mọi ô không phải chuỗi (chỉ dùng được khi cột có chuỗi)
+    if pd.api.types.infer_dtype(cot_gio, skipna=True) in ("string", "mixed", "mixed-integer"):
+        la_chuoi = cot_gio.str.len().notna()
+    else:
+        la_chuoi = pd.Series(False, index=cot_gio.index)
+
+    # Ô còn lại: datetime/time (openpyxl trả về khi ô được định dạng giờ). Bỏ phần ngày
+    # rồi đổi cả cột sang timedelta; ô không có dạng giờ (ví dụ số) thành NaN
+    la_thoi_gian = cot_gio.notna() & ~la_chuoi
+    if la_thoi_gian.any():
+        chuoi_gio = cot_gio[la_thoi_gian].astype(str).str.replace(r"^\d{4}-\d{2}-\d{2}[ T]", "", regex=True)
+        khoang = pd.to_timedelta(chuoi_gio.where(chuoi_gio.str.contains(":", regex=False)), errors="coerce")
+        # Làm tròn lên phút kế tiếp nếu có giây lẻ
+        phut[la_thoi_gian] = np.ceil(khoang.dt.total_seconds() / 60)
+
+    # Ô dạng chuỗi: tách giờ/phút bằng biểu thức chính quy trên cả cột
+    if la_chuoi.any():
+        gio_phut = cot_gio[la_chuoi].astype(str).str.strip().str.extract(r"^(\d{1,2}):(\d{1,2})$").astype("float64")
+        hop_le = (gio_phut[0] < 24) & (gio_phut[1] < 60)
+        phut[la_chuoi] = (gio_phut[0] * 60 + gio_phut[1]).where(hop_le)
+
+    return phut
+
+
+def _lap_ban_do_cot_in(hang_tieu_de: List[object], so_cot: int) -> Tuple[Dict[int, int], Set[int]]:
+    """
+    Lập bản đồ ngày -> cột 'In' từ hàng tiêu đề (giả định cột 'In' nằm ngay sau cột ngày).
+
+    Args:
+        hang_tieu_de: Giá trị các ô trên hàng HEADER_ROW_INDEX.
+        so_cot: Tổng số cột của bảng.
+
+    Returns:
+        (cot_in_theo_ngay, ngay_thieu_cot_in).
+    """
+    cot_in_theo_ngay: Dict[int, int] = {}
+    ngay_thieu_cot_in: Set[int] = set()
+    for col_idx, gia_tri in enumerate(hang_tieu_de):
+        if gia_tri is None or (isinstance(gia_tri, float) and np.isnan(gia_tri)):
+            continue
+        nhan = str(gia_tri).strip()
+        if not nhan.isdigit() or str(int(nhan)) != nhan:
+            continue
+        ngay = int(nhan)
+        if ngay in cot_in_theo_ngay or ngay in ngay_thieu_cot_in:
+            continue # Chỉ lấy cột đầu tiên của mỗi ngày
+        if col_idx + 1 >= so_cot:
+            ngay_thieu_cot_in.add(ngay)
+        else:
+            cot_in_theo_ngay[ngay] = col_idx + 1
+    return cot_in_theo_ngay, ngay_thieu_cot_in
+
+
+def _phan_tich_gio_vao(
+    cot_ten: pd.Series,
+    khung_gio_vao: pd.DataFrame,
+    ngay_thieu_cot_in: Set[int]
+) -> Dict:
+    """
+    Chuyển cột tên và các cột 'In' (đã tách theo từng hàng nhân viên) thành dữ liệu giờ vào.
+
+    Args:
+        cot_ten: Giá trị thô cột tên, index là chỉ số hàng (0-based) trong file.
+        khung_gio_vao: Giá trị thô các cột 'In', cùng index, cột là số ngày.
+        ngay_thieu_cot_in: Các ngày không có cột 'In' phía sau.
+
+    Returns:
+        Dictionary (mô hình dữ liệu gọn) gồm:
+            'ten': pd.Categorical tên thành viên (mỗi tên chỉ lưu một lần),
+            'hang': mảng int32 số thứ tự hàng Excel (bắt đầu từ 1) của từng thành viên,
+            'ngay': mảng int16 các ngày có cột 'In',
+            'phut': ma trận int16 (thành viên x ngày) số phút giờ vào kể từ 0h;
+                    PHUT_VANG là ô trống, PHUT_KHONG_HOP_LE là ô không phân tích được,
+            'o_loi': danh sách (hàng, tên, ngày, giá trị gốc) của các ô lỗi,
+            'ngay_thieu_cot_in': tập ngày không có cột 'In' phía sau.
+    """
+    # Bỏ qua các hàng không có tên nhân viên (dòng trống hoặc cuối file)
+    ten_da_loc = cot_ten.astype("string").str.strip()
+    co_ten = cot_ten.notna() & (ten_da_loc != "")
+    ten_nhan_vien = ten_da_loc[co_ten].astype(str)
+    khung_gio_vao = khung_gio_vao[co_ten]
+
+    phut = khung_gio_vao.apply(_doi_gio_sang_phut)
+    o_trong_mask = khung_gio_vao.isna()
+    o_loi_mask = ~o_trong_mask & phut.isna()
+
+    o_loi: List[Tuple[int, str, int, object]] = []
+    if o_loi_mask.to_numpy().any():
+        for row_idx, ngay in o_loi_mask.stack()[lambda m: m].index:
+            o_loi.append((row_idx + 1, ten_nhan_vien[row_idx], ngay, khung_gio_vao.at[row_idx, ngay]))
+
+    ma_tran_phut = phut.to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+    ma_tran_phut[o_trong_mask.to_numpy()] = PHUT_VANG
+    ma_tran_phut[o_loi_mask.to_numpy()] = PHUT_KHONG_HOP_LE
+
+    return {
+        "ten": pd.Categorical(ten_nhan_vien.tolist()),
+        "hang": (ten_nhan_vien.index.to_numpy() + 1).astype(np.int32),
+        "ngay": np.array(list(khung_gio_vao.columns), dtype=np.int16),
+        "phut": ma_tran_phut.astype(np.int16).reshape(len(ten_nhan_vien), khung_gio_vao.shape[1]),
+        "o_loi": o_loi,
+        "ngay_thieu_cot_in": ngay_thieu_cot_in,
+    }
+
+
+def _phan_tich_bang_diem_danh(df: pd.DataFrame) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Phân tích DataFrame thô của file điểm danh thành dữ liệu giờ vào cho cả tháng.
+
+    Dùng cho các file không đọc được bằng _doc_excel_streaming (ví dụ .xls).
+
+    Args:
+        df: DataFrame đọc bằng pd.read_excel(..., header=None).
+
+    Returns:
+        (du_lieu, loi), du_lieu như mô tả ở _phan_tich_gio_vao.
+    """
+    if HEADER_ROW_INDEX >= df.shape[0]:
+        return None, f"Lỗi: File Excel không có hàng tiêu đề ngày (hàng index {HEADER_ROW_INDEX})."
+
+    cot_in_theo_ngay, ngay_thieu_cot_in = _lap_ban_do_cot_in(df.iloc[HEADER_ROW_INDEX].tolist(), df.shape[1])
+
+    # --- Lấy cột tên và toàn bộ các cột 'In' của các hàng nhân viên trong một lần ---
+    cot_ten = df.iloc[DATA_START_ROW_INDEX::ROW_INCREMENT, NAME_COLUMN_INDEX]
+    khung_gio_vao = df.iloc[DATA_START_ROW_INDEX::ROW_INCREMENT, list(cot_in_theo_ngay.values())]
+    khung_gio_vao.columns = list(cot_in_theo_ngay.keys())
+
+    return _phan_tich_gio_vao(cot_ten, khung_gio_vao, ngay_thieu_cot_in), None
+
+
+def _chuan_hoa_o_excel(gia_tri: object) -> object:
+    """Chuẩn hóa giá trị ô openpyxl giống pd.read_excel (chuỗi NA -> None, số thực nguyên -> int)."""
+    if isinstance(gia_tri, str) and gia_tri in GIA_TRI_NA_EXCEL:
+        return None
+    if isinstance(gia_tri, float) and gia_tri.is_integer():
+        return int(gia_tri)
+    return gia_tri
+
+
+def _doc_excel_streaming(duong_dan: str) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Đọc file điểm danh .xlsx theo chế độ read-only của openpyxl, chỉ giữ các cột cần thiết.
+
+    Hàng tiêu đề được đọc trước để xác định các cột 'In'; sau đó chỉ lấy cột
+    NAME_COLUMN_INDEX và các cột 'In' của các hàng nhân viên (từ DATA_START_ROW_INDEX,
+    cách nhau ROW_INCREMENT hàng). Không tạo DataFrame cho toàn bộ bảng.
+
+    Args:
+        duong_dan: Đường dẫn file .xlsx/.xlsm.
+
+    Returns:
+        (du_lieu, loi), du_lieu như mô tả ở _phan_tich_gio_vao.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(duong_dan, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0] # Giống pd.read_excel: sheet đầu tiên
+        cac_hang = ws.iter_rows(values_only=True)
+
+        hang_tieu_de: Optional[Tuple] = None
+        for row_idx, hang in enumerate(cac_hang):
+            if row_idx == HEADER_ROW_INDEX:
+                hang_tieu_de = tuple(_chuan_hoa_o_excel(v) for v in hang)
+                break
+        if hang_tieu_de is None:
+            return None, f"Lỗi: File Excel không có hàng tiêu đề ngày (hàng index {HEADER_ROW_INDEX})."
+
+        so_cot = max(ws.max_column or 0, len(hang_tieu_de))
+        cot_in_theo_ngay, ngay_thieu_cot_in = _lap_ban_do_cot_in(list(hang_tieu_de), so_cot)
+        cac_cot_in = list(cot_in_theo_ngay.values())
+
+        chi_so_hang: List[int] = []
+        ten_tho: List[object] = []
+        gio_vao_tho: List[List[object]] = []
+        for row_idx, hang in enumerate(cac_hang, start=HEADER_ROW_INDEX + 1):
+            if row_idx < DATA_START_ROW_INDEX or (row_idx - DATA_START_ROW_INDEX) % ROW_INCREMENT:
+                continue
+            do_dai = len(hang)
+            chi_so_hang.append(row_idx)
+            ten_tho.append(_chuan_hoa_o_excel(hang[NAME_COLUMN_INDEX]) if NAME_COLUMN_INDEX < do_dai else None)
+            gio_vao_tho.append([_chuan_hoa_o_excel(hang[c]) if c < do_dai else None for c in cac_cot_in])
+    finally:
+        wb.close()
+
+    cot_ten = pd.Series(ten_tho, index=chi_so_hang, dtype=object)
+    khung_gio_vao = pd.DataFrame(gio_vao_tho, index=chi_so_hang, columns=list(cot_in_theo_ngay.keys()), dtype=object)
+    return _phan_tich_gio_vao(cot_ten, khung_gio_vao, ngay_thieu_cot_in), None
+
+
+def _bam_file(duong_dan: str) -> str:
+    """Tính mã băm SHA-256 nội dung file (đọc theo từng khối để không tốn bộ nhớ)."""
+    bam = hashlib.sha256()
+    with open(duong_dan, "rb") as f:
+        for khoi in iter(lambda: f.read(1024 * 1024), b""):
+            bam.update(khoi)
+    return bam.hexdigest()
+
+
+def _doc_chi_muc_cache(thu_muc_cache: str) -> Dict[str, Dict]:
+    """Đọc file chỉ mục cache: đường dẫn tuyệt đối -> {size, mtime_ns, sha256}."""
+    try:
+        with open(os.path.join(thu_muc_cache, "index.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _ghi_chi_muc_cache(thu_muc_cache: str, chi_muc: Dict[str, Dict]) -> None:
+    """Ghi file chỉ mục cache một cách nguyên tử (ghi file tạm rồi thay thế)."""
+    duong_dan = os.path.join(thu_muc_cache, "index.json")
+    with open(duong_dan + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(chi_muc, f, ensure_ascii=False)
+    os.replace(duong_dan + ".tmp", duong_dan)
+
+
+def _don_dep_cache(thu_muc_cache: str, gioi_han_bytes: int = CACHE_MAX_BYTES) -> None:
+    """Xóa các file cache ít được dùng nhất (theo mtime) cho tới khi tổng dung lượng dưới giới hạn."""
+    cac_file = []
+    for ten in os.listdir(thu_muc_cache):
+        if ten.endswith(".npz"):
+            thong_tin = os.stat(os.path.join(thu_muc_cache, ten))
+            cac_file.append((thong_tin.st_mtime_ns, thong_tin.st_size, ten))
+    tong = sum(kich_thuoc for _, kich_thuoc, _ in cac_file)
+    for _, kich_thuoc, ten in sorted(cac_file):
+        if tong <= gioi_han_bytes:
+            break
+        os.remove(os.path.join(thu_muc_cache, ten))
+        tong -= kich_thuoc
+
+
+def _luu_cache_dia(thu_muc_cache: str, ma_bam: str, du_lieu: Dict) -> None:
+    """Lưu dữ liệu điểm danh đã phân tích thành file .npz (các mảng cột) trong thư mục cache."""
+    o_loi = du_lieu["o_loi"]
+    duong_dan = os.path.join(thu_muc_cache, f"{ma_bam}-v{CACHE_FORMAT_VERSION}.npz")
+    with open(duong_dan + ".tmp", "wb") as f:
+        np.savez(
+            f,
+            ten_ma=du_lieu["ten"].codes,
+            ten_danh_muc=np.array(du_lieu["ten"].categories, dtype=str),
+            hang=du_lieu["hang"],
+            ngay=du_lieu["ngay"],
+            phut=du_lieu["phut"],
+            o_loi_hang=np.array([o[0] for o in o_loi], dtype=np.int64),
+            o_loi_ngay=np.array([o[2] for o in o_loi], dtype=np.int64),
+            o_loi_gia_tri=np.array([str(o[3]) for o in o_loi], dtype=str),
+            ngay_thieu_cot_in=np.array(sorted(du_lieu["ngay_thieu_cot_in"]), dtype=np.int64),
+        )
+    os.replace(duong_dan + ".tmp", duong_dan)
+
+
+def _doc_cache_dia(thu_muc_cache: str, ma_bam: str) -> Optional[Dict]:
+    """Đọc dữ liệu điểm danh đã phân tích từ cache; trả về None nếu không có hoặc file hỏng."""
+    duong_dan = os.path.join(thu_muc_cache, f"{ma_bam}-v{CACHE_FORMAT_VERSION}.npz")
+    try:
+        with np.load(duong_dan, allow_pickle=False) as npz:
+            ten = pd.Categorical.from_codes(npz["ten_ma"], categories=npz["ten_danh_muc"].tolist())
+            hang = npz["hang"]
+            ten_theo_hang = dict(zip(hang.tolist(), ten.tolist()))
+            du_lieu = {
+                "ten": ten,
+                "hang": hang,
+                "ngay": npz["ngay"],
+                "phut": npz["phut"],
+                "o_loi": [
+                    (h, ten_theo_hang[h], n, g)
+                    for h, n, g in zip(npz["o_loi_hang"].tolist(), npz["o_loi_ngay"].tolist(), npz["o_loi_gia_tri"].tolist())
+                ],
+                "ngay_thieu_cot_in": set(npz["ngay_thieu_cot_in"].tolist()),
+            }
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Cảnh báo: File cache {duong_dan} bị hỏng ({e}). Sẽ đọc lại file Excel.")
+        return None
+    os.utime(duong_dan) # Đánh dấu vừa được dùng để ưu tiên giữ lại khi dọn cache
+    return du_lieu
+
+
+def xoa_cache_diem_danh(ten_file_excel: str, thu_muc_cache: str = DEFAULT_CACHE_DIR) -> None:
+    """
+    Bỏ bản ghi cache của một file điểm danh (gọi khi file bị ghi đè, ví dụ lúc tải lên file mới).
+
+    Args:
+        ten_file_excel: Tên file Excel điểm danh.
+        thu_muc_cache: Thư mục chứa cache.
+    """
+    _doc_du_lieu_diem_danh_co_cache.cache_clear()
+    chi_muc = _doc_chi_muc_cache(thu_muc_cache)
+    if chi_muc.pop(os.path.abspath(ten_file_excel), None) is not None:
+        try:
+            _ghi_chi_muc_cache(thu_muc_cache, chi_muc)
+        except Exception as e:
+            print(f"Cảnh báo: Không thể cập nhật chỉ mục cache: {e}")
+
+
+@functools.lru_cache(maxsize=8)
+def _doc_du_lieu_diem_danh_co_cache(
+    duong_dan: str, mtime_ns: int, kich_thuoc: int
+) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Đọc và phân tích file điểm danh; kết quả được nhớ theo (đường dẫn, mtime, kích thước).
+
+    Bên dưới bộ nhớ trong tiến trình là cache trên đĩa (DEFAULT_CACHE_DIR) theo mã băm
+    nội dung file, nên file không đổi sẽ không phải đọc lại bằng openpyxl giữa các lần chạy.
+    """
+    duong_dan_tuyet_doi = os.path.abspath(duong_dan)
+    chi_muc: Dict[str, Dict] = {}
+    ma_bam: Optional[str] = None
+    try:
+        os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+        chi_muc = _doc_chi_muc_cache(DEFAULT_CACHE_DIR)
+        ban_ghi = chi_muc.get(duong_dan_tuyet_doi)
+        if ban_ghi and ban_ghi["size"] == kich_thuoc and ban_ghi["mtime_ns"] == mtime_ns:
+            ma_bam = ban_ghi["sha256"]
+        else:
+            ma_bam = _bam_file(duong_dan)
+        du_lieu = _doc_cache_dia(DEFAULT_CACHE_DIR, ma_bam)
+        if du_lieu is not None:
+            if ban_ghi is None or ban_ghi.get("sha256") != ma_bam or ban_ghi["mtime_ns"] != mtime_ns:
+                chi_muc[duong_dan_tuyet_doi] = {"size": kich_thuoc, "mtime_ns": mtime_ns, "sha256": ma_bam}
+                _ghi_chi_muc_cache(DEFAULT_CACHE_DIR, chi_muc)
+            return du_lieu, None
+    except FileNotFoundError:
+        return None, f"Lỗi: Không tìm thấy file: {duong_dan}"
+    except Exception as e:
+        print(f"Cảnh báo: Không thể dùng cache điểm danh: {e}")
+
+    try:
+        if duong_dan.lower().endswith((".xlsx", ".xlsm")):
+            # Đọc dạng streaming, chỉ lấy cột tên và các cột 'In'
+            du_lieu, loi = _doc_excel_streaming(duong_dan)
+        else:
+            # Định dạng khác (ví dụ .xls): đọc toàn bộ, không dùng header mặc định vì cấu trúc phức tạp
+            du_lieu, loi = _phan_tich_bang_diem_danh(pd.read_excel(duong_dan, header=None))
+    except FileNotFoundError:
+        return None, f"Lỗi: Không tìm thấy file: {duong_dan}"
+    except Exception as e:
+        return None, f"Lỗi khi đọc file Excel: {e}"
+
+    if du_lieu is not None and ma_bam is not None:
+        try:
+            _luu_cache_dia(DEFAULT_CACHE_DIR, ma_bam, du_lieu)
+            chi_muc[duong_dan_tuyet_doi] = {"size": kich_thuoc, "mtime_ns": mtime_ns, "sha256": ma_bam}
+            _ghi_chi_muc_cache(DEFAULT_CACHE_DIR, chi_muc)
+            _don_dep_cache(DEFAULT_CACHE_DIR)
+        except Exception as e:
+            print(f"Cảnh báo: Không thể ghi cache điểm danh: {e}")
+    return du_lieu, loi
+
+
+def _doc_du_lieu_diem_danh(ten_file_excel: str) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Đọc dữ liệu giờ vào cả tháng từ file điểm danh (xem _phan_tich_bang_diem_danh).
+
+    File chỉ được đọc lại khi nội dung trên đĩa thay đổi. Kết quả dùng chung giữa
+    các lần gọi nên không được sửa trực tiếp.
+    """
+    try:
+        thong_tin = os.stat(ten_file_excel)
+    except FileNotFoundError:
+        return None, f"Lỗi: Không tìm thấy file: {ten_file_excel}"
+    except Exception as e:
+        return None, f"Lỗi khi đọc file Excel: {e}"
+    du_lieu, loi = _doc_du_lieu_diem_danh_co_cache(ten_file_excel, thong_tin.st_mtime_ns, thong_tin.st_size)
+    return du_lieu, loi
+
+
+def _dung_bang_trang_thai(ten: pd.Categorical, ngay: np.ndarray, ma: np.ndarray) -> pd.DataFrame:
+    """Dựng DataFrame trạng thái (cột categorical, chỉ lưu mã int8) từ ma trận mã trạng thái."""
+    return pd.DataFrame(
+        {int(n): pd.Categorical.from_codes(ma[:, j], categories=CAC_TRANG_THAI) for j, n in enumerate(ngay)},
+        index=pd.CategoricalIndex(ten, name="ten"),
+    )
+
+
+def _ma_trang_thai(phut: np.ndarray, phut_so_sanh: int) -> np.ndarray:
+    """Mã trạng thái int8 (vị trí trong CAC_TRANG_THAI) tương ứng với số phút giờ vào."""
+    ma = np.full(phut.shape, MA_DUNG_GIO, dtype=np.int8)
+    ma[phut > phut_so_sanh] = MA_DI_MUON
+    ma[phut == PHUT_VANG] = MA_VANG
+    ma[phut == PHUT_KHONG_HOP_LE] = MA_KHONG_RO
+    return ma
+
+
+def tao_ma_tran_diem_danh(
+    gio_nhap_str: str,
+    ten_file_excel: str = DEFAULT_ATTENDANCE_FILE
+) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Đánh giá mọi ngày trong file điểm danh trong một lần, tạo ma trận thành viên x ngày.
+
+    Args:
+        gio_nhap_str: Giờ vào làm chuẩn dạng chuỗi (ví dụ: "18:00").
+        ten_file_excel: Tên file Excel chứa dữ liệu điểm danh.
+
+    Returns:
+        (ma_tran, loi). ma_tran là dictionary gồm:
+            'ma': ma trận int8 mã trạng thái (vị trí trong CAC_TRANG_THAI),
+            'trang_thai': DataFrame (hàng: tên thành viên, cột: ngày) với giá trị
+                          TRANG_THAI_DUNG_GIO / TRANG_THAI_DI_MUON / TRANG_THAI_VANG / TRANG_THAI_KHONG_RO,
+            'phut_muon': DataFrame int16 cùng kích thước, số phút đi muộn (0 nếu không muộn),
+            'ten', 'ngay', 'hang', 'o_loi', 'ngay_thieu_cot_in': như dữ liệu gốc đã phân tích.
+        Nếu có lỗi, ma_tran là None và loi chứa thông báo.
+    """
+    du_lieu, loi = _doc_du_lieu_diem_danh(ten_file_excel)
+    if loi:
+        return None, loi
+
+    try:
+        # Chuyển đổi giờ chuẩn sang đối tượng time một lần duy nhất
+        gio_so_sanh: time = datetime.strptime(gio_nhap_str, '%H:%M').time()
+    except ValueError:
+        return None, f"Lỗi: Định dạng giờ nhập vào không hợp lệ: {gio_nhap_str}"
+    phut_so_sanh = gio_so_sanh.hour * 60 + gio_so_sanh.minute
+
+    phut = du_lieu["phut"]
+    ma = _ma_trang_thai(phut, phut_so_sanh)
+
+    trang_thai = _dung_bang_trang_thai(du_lieu["ten"], du_lieu["ngay"], ma)
+    phut_muon = pd.DataFrame(
+        np.where(ma == MA_DI_MUON, phut - phut_so_sanh, 0).astype(np.int16),
+        index=trang_thai.index,
+        columns=trang_thai.columns,
+    )
+
+    ma_tran = {
+        "ma": ma,
+        "trang_thai": trang_thai,
+        "phut_muon": phut_muon,
+        "ten": du_lieu["ten"],
+        "ngay": du_lieu["ngay"],
+        "hang": du_lieu["hang"],
+        "o_loi": du_lieu["o_loi"],
+        "ngay_thieu_cot_in": du_lieu["ngay_thieu_cot_in"],
+    }
+    return ma_tran, None
+
+
+def _cot_ma_ngay(
+    ngay_nhap: int,
+    gio_nhap_str: str,
+    ten_file_excel: str = DEFAULT_ATTENDANCE_FILE
+) -> Tuple[Optional[np.ndarray], Optional[pd.Categorical], Optional[str]]:
+    """
+    Tính cột mã trạng thái của một ngày, chỉ từ cột số phút của ngày đó (không dựng ma
+    trận cả tháng như tao_ma_tran_diem_danh).
+
+    Returns:
+        (cột mã trạng thái, tên thành viên, lỗi); nếu có lỗi, hai phần tử đầu là None.
+    """
+    du_lieu, loi = _doc_du_lieu_diem_danh(ten_file_excel)
+    if loi:
+        return None, None, loi
+
+    try:
+        gio_so_sanh: time = datetime.strptime(gio_nhap_str, '%H:%M').time()
+    except ValueError:
+        return None, None, f"Lỗi: Định dạng giờ nhập vào không hợp lệ: {gio_nhap_str}"
+
+    if ngay_nhap in du_lieu["ngay_thieu_cot_in"]:
+        return None, None, f"Lỗi: Không tìm thấy cột 'In' dự kiến sau cột ngày {ngay_nhap}."
+    vi_tri_ngay = np.flatnonzero(du_lieu["ngay"] == ngay_nhap)
+    if vi_tri_ngay.size == 0:
+        return None, None, f"Không tìm thấy ngày {ngay_nhap} trên hàng {HEADER_ROW_INDEX + 1} trong file."
+
+    for hang, ten, ngay, gia_tri in du_lieu["o_loi"]:
+        if ngay == ngay_nhap:
+            # Ghi nhận lỗi nếu không thể phân tích cú pháp giờ
+            print(f"Cảnh báo: Không thể phân tích giờ '{gia_tri}' cho {ten} ở hàng {hang}. Bỏ qua.")
+
+    phut_so_sanh = gio_so_sanh.hour * 60 + gio_so_sanh.minute
+    return _ma_trang_thai(du_lieu["phut"][:, vi_tri_ngay[0]], phut_so_sanh), du_lieu["ten"], None
+
+
 def danh_gia_di_muon_vang(
     ngay_nhap: int,
     gio_nhap_str: str,
     ten_file_excel: str = DEFAULT_ATTENDANCE_FILE
 ) -> Dict[str, List[str]]:
     """
-    Đánh giá danh sách đi muộn và vắng dựa trên file Excel điểm danh.
+    Đánh giá danh sách đi muộn và vắng dựa trên file Excel điểm danh.
+
+    Chỉ cột của ngày cần kiểm tra được đánh giá (_cot_ma_ngay) từ dữ liệu đã đọc,
+    nên kiểm tra nhiều ngày của cùng một file chỉ phải đọc file một lần.
+
+    Args:
+        ngay_nhap: Ngày cần kiểm tra (ví dụ: 2).
+        gio_nhap_str: Giờ vào làm chuẩn dạng chuỗi (ví dụ: "18:00").
+        ten_file_excel: Tên file Excel chứa dữ liệu điểm danh.
+
+    Returns:
+        Một dictionary chứa hai danh sách: 'di_muon' và 'vang'.
+        Giá trị trong 'vang' có thể chứa thông báo lỗi nếu file/ngày không tìm thấy.
+    """
+    cot_ma, ten, loi = _cot_ma_ngay(ngay_nhap, gio_nhap_str, ten_file_excel)
+    if loi:
+        return {"di_muon": [], "vang": [loi]}
+
+    danh_sach_di_muon = ten[cot_ma == MA_DI_MUON].tolist()
+    danh_sach_vang = ten[cot_ma == MA_VANG].tolist()
+
+    return {"di_muon": danh_sach_di_muon, "vang": danh_sach_vang}
+
+
+def _chuan_hoa_ten(cac_ten: pd.Series) -> pd.Series:
+    """Chuẩn hóa tên để so khớp: Unicode NFC, không phân biệt hoa thường, gộp/bỏ khoảng trắng thừa."""
+    return cac_ten.astype(str).str.normalize("NFC").str.casefold().str.split().str.join(" ")
+
+
+def ngay_kiem_tra_gan_nhat(ngay: int, hom_nay: Optional[date] = None) -> Optional[date]:
+    """
+    Ngày gần nhất (không sau hom_nay) có số ngày trong tháng là ngay.
+
+    Bảng điểm danh chỉ ghi số ngày; ngày lớn hơn ngày hiện tại được hiểu là thuộc tháng trước
+    (ví dụ kiểm tra "hôm qua" vào ngày 1). Trả về None nếu tháng đó không có ngày này.
+    """
+    hom_nay = hom_nay or date.today()
+    nam, thang = hom_nay.year, hom_nay.month
+    if ngay > hom_nay.day:
+        nam, thang = (nam - 1, 12) if thang == 1 else (nam, thang - 1)
+    try:
+        return date(nam, thang, ngay)
+    except ValueError:
+        return None
+
+
+def _doc_ngay_nghi_phep(gia_tri: str) -> pd.Timestamp:
+    """Đọc ngày dạng 'YYYY-MM-DD' hoặc 'DD/MM/YYYY'."""
+    gia_tri = gia_tri.strip()
+    if "/" in gia_tri:
+        return pd.Timestamp(datetime.strptime(gia_tri, "%d/%m/%Y"))
+    return pd.Timestamp(datetime.strptime(gia_tri, "%Y-%m-%d"))
+
+
+class KhoNghiPhep:
+    """
+    Danh sách đơn nghỉ phép (tên, từ ngày, đến ngày, lý do) đánh chỉ mục theo khoảng ngày.
+
+    Mỗi dòng file nghỉ phép có dạng:
+        Tên                                  (nghỉ phép không thời hạn, như định dạng cũ)
+        Tên, 2025-04-05                      (nghỉ một ngày)
+        Tên, 2025-04-05, 2025-04-07, Lý do   (nghỉ từ ngày đến ngày, cả hai ngày đều tính)
+    Ngày có thể viết dạng YYYY-MM-DD hoặc DD/MM/YYYY. Tên được so khớp sau khi chuẩn hóa
+    (_chuan_hoa_ten).
+    """
+
+    __slots__ = ("don", "_khoang")
+
+    def __init__(self, don: pd.DataFrame) -> None:
+        self.don = don.reset_index(drop=True)
+        self._khoang = pd.IntervalIndex.from_arrays(self.don["bat_dau"], self.don["ket_thuc"], closed="both")
+
+    def __len__(self) -> int:
+        return len(self.don)
+
+    @classmethod
+    def tu_file(cls, ten_file_leave_requests: str) -> "KhoNghiPhep":
+        hang = []
+        with open(ten_file_leave_requests, "r", encoding="utf-8") as file:
+            for so_dong, dong in enumerate(file, start=1):
+                cac_truong = [truong.strip() for truong in dong.split(",")]
+                if not cac_truong[0]:
+                    continue
+                try:
+                    if len(cac_truong) == 1:
+                        bat_dau, ket_thuc = pd.Timestamp.min, pd.Timestamp.max
+                    else:
+                        bat_dau = _doc_ngay_nghi_phep(cac_truong[1])
+                        ket_thuc = _doc_ngay_nghi_phep(cac_truong[2]) if len(cac_truong) > 2 and cac_truong[2] else bat_dau
+                except ValueError:
+                    print(f"Cảnh báo: Ngày không hợp lệ ở dòng {so_dong} file nghỉ phép: '{dong.strip()}'. Bỏ qua.")
+                    continue
+                if ket_thuc < bat_dau:
+                    print(f"Cảnh báo: Ngày kết thúc trước ngày bắt đầu ở dòng {so_dong} file nghỉ phép. Bỏ qua.")
+                    continue
+                hang.append((cac_truong[0], bat_dau, ket_thuc, ", ".join(cac_truong[3:])))
+        don = pd.DataFrame(hang, columns=["ten", "bat_dau", "ket_thuc", "ly_do"])
+        don["bat_dau"] = pd.to_datetime(don["bat_dau"])
+        don["ket_thuc"] = pd.to_datetime(don["ket_thuc"])
+        don["khoa"] = _chuan_hoa_ten(don["ten"])
+        return cls(don)
+
+    def nguoi_nghi_ngay(self, ngay: Optional[date]) -> Set[str]:
+        """Tên đã chuẩn hóa của những người có đơn nghỉ phép bao gồm ngày này (None: chỉ đơn không thời hạn)."""
+        if len(self.don) == 0:
+            return set()
+        if ngay is None:
+            co_hieu_luc = (self.don["bat_dau"] == pd.Timestamp.min).to_numpy()
+        else:
+            co_hieu_luc = self._khoang.contains(pd.Timestamp(ngay))
+        return set(self.don["khoa"].to_numpy()[co_hieu_luc])
+
+    def mat_na(self, ten: pd.Categorical, cac_ngay: pd.DatetimeIndex) -> np.ndarray:
+        """
+        Ma trận bool (thành viên x ngày): True nếu thành viên có đơn nghỉ phép bao gồm ngày đó.
+
+        Tính một lần cho mọi đơn và mọi ngày (so sánh theo khoảng), rồi gộp theo danh mục
+        tên; ngày NaT chỉ khớp đơn không thời hạn.
+        """
+        mat_na = np.zeros((len(ten), len(cac_ngay)), dtype=bool)
+        if len(self.don) == 0 or len(ten) == 0:
+            return mat_na
+        vi_tri_ten = pd.Index(_chuan_hoa_ten(pd.Series(ten.categories))).get_indexer(self.don["khoa"])
+        co_ten = vi_tri_ten >= 0
+        if not co_ten.any():
+            return mat_na
+        ngay = cac_ngay.to_numpy()
+        khong_thoi_han = (self.don["bat_dau"] == pd.Timestamp.min).to_numpy()[co_ten, None]
+        don_ngay = khong_thoi_han | (
+            (self._khoang.left.to_numpy()[co_ten, None] <= ngay) & (ngay <= self._khoang.right.to_numpy()[co_ten, None])
+        )
+        theo_danh_muc = np.zeros((len(ten.categories), len(cac_ngay)), dtype=bool)
+        np.logical_or.at(theo_danh_muc, vi_tri_ten[co_ten], don_ngay)
+        ma_ten = np.asarray(ten.codes)
+        mat_na[ma_ten >= 0] = theo_danh_muc[ma_ten[ma_ten >= 0]]
+        return mat_na
+
+
+_KHO_NGHI_PHEP_THEO_FILE: Dict[str, Tuple[int, int, KhoNghiPhep]] = {}
+
+
+def tai_kho_nghi_phep(ten_file_leave_requests: str = DEFAULT_LEAVE_REQUESTS_FILE) -> Optional[KhoNghiPhep]:
+    """
+    Đọc file nghỉ phép thành KhoNghiPhep, dùng lại bản đã đọc cho tới khi file thay đổi.
+
+    Returns:
+        KhoNghiPhep, hoặc None (kèm cảnh báo) nếu không đọc được file.
+    """
+    try:
+        thong_tin = os.stat(ten_file_leave_requests)
+        duong_dan = os.path.abspath(ten_file_leave_requests)
+        da_luu = _KHO_NGHI_PHEP_THEO_FILE.get(duong_dan)
+        if da_luu and da_luu[0] == thong_tin.st_mtime_ns and da_luu[1] == thong_tin.st_size:
+            return da_luu[2]
+        kho = KhoNghiPhep.tu_file(ten_file_leave_requests)
+    except FileNotFoundError:
+        print(f"Cảnh báo: Không tìm thấy file nghỉ phép {ten_file_leave_requests}. Sẽ không loại trừ ai.")
+        return None
+    except Exception as e:
+        print(f"Lỗi khi đọc file nghỉ phép {ten_file_leave_requests}: {e}. Sẽ không loại trừ ai.")
+        return None
+    _KHO_NGHI_PHEP_THEO_FILE[duong_dan] = (thong_tin.st_mtime_ns, thong_tin.st_size, kho)
+    return kho
+
+
+def loai_bo_nguoi_nghi_phep(
+    danh_sach_vang: List[str],
+    ten_file_leave_requests: str = DEFAULT_LEAVE_REQUESTS_FILE,
+    ngay: Optional[date] = None
+) -> List[str]:
+    """
+    Loại bỏ những người đã xin nghỉ phép khỏi danh sách vắng.
+
+    Args:
+        danh_sach_vang: Danh sách tên những người được đánh giá là vắng.
+        ten_file_leave_requests: Tên file chứa danh sách người xin nghỉ phép.
+        ngay: Ngày vắng cần đối chiếu với thời gian nghỉ phép, thường là
+            ngay_kiem_tra_gan_nhat(ngày kiểm tra); mặc định: hôm nay.
+
+    Returns:
+        Danh sách vắng sau khi lọc.
+    """
+    kho = tai_kho_nghi_phep(ten_file_leave_requests)
+    if kho is None or not danh_sach_vang:
+        return danh_sach_vang
+
+    nguoi_nghi_phep = kho.nguoi_nghi_ngay(ngay if ngay is not None else date.today())
+    co_phep = _chuan_hoa_ten(pd.Series(danh_sach_vang, dtype=object)).isin(nguoi_nghi_phep).to_numpy()
+    return [ten for ten, bo_qua in zip(danh_sach_vang, co_phep) if not bo_qua]
+
+
+def loc_ma_tran_nghi_phep(
+    ma_tran: Dict,
+    ten_file_leave_requests: str = DEFAULT_LEAVE_REQUESTS_FILE,
+    thang: Optional[date] = None
+) -> Dict:
+    """
+    Chuyển các ô vắng có đơn nghỉ phép trong ma trận sang TRANG_THAI_CO_PHEP.
+
+    Mọi ô của cả tháng được đối chiếu với các đơn nghỉ phép trong một lần (KhoNghiPhep.mat_na).
+
+    Args:
+        ma_tran: Kết quả của tao_ma_tran_diem_danh.
+        ten_file_leave_requests: Tên file chứa danh sách người xin nghỉ phép.
+        thang: Một ngày bất kỳ trong tháng của bảng điểm danh (mặc định: tháng hiện tại).
+
+    Returns:
+        Ma trận mới (ma_tran đầu vào không bị sửa).
+    """
+    kho = tai_kho_nghi_phep(ten_file_leave_requests)
+    if not kho:
+        return ma_tran
+
+    thang = thang or date.today()
+    so_ngay = np.asarray(ma_tran["ngay"])
+    cac_ngay = pd.DatetimeIndex(pd.to_datetime(
+        pd.DataFrame({"year": thang.year, "month": thang.month, "day": so_ngay}), errors="coerce"
+    ))
+    ten: pd.Categorical = ma_tran["ten"]
+
+    ma = ma_tran["ma"].copy()
+    ma[kho.mat_na(ten, cac_ngay) & (ma == MA_VANG)] = MA_CO_PHEP
+
+    ket_qua = dict(ma_tran)
+    ket_qua["ma"] = ma
+    ket_qua["trang_thai"] = _dung_bang_trang_thai(ten, ma_tran["ngay"], ma)
+    return ket_qua
+
+
+def _chia_lo(nguon: Iterable, kich_thuoc: int) -> Iterator[List]:
+    """Chia một iterable thành các list tối đa kich_thuoc phần tử, đọc dần từ nguồn."""
+    nguon = iter(nguon)
+    while True:
+        lo = list(islice(nguon, kich_thuoc))
+        if not lo:
+            return
+        yield lo
+
+
+def vi_pham_ngay_dong(
+    ngay_nhap: int,
+    gio_nhap_str: str,
+    ten_file_excel: str = DEFAULT_ATTENDANCE_FILE,
+    ten_file_leave_requests: Optional[str] = DEFAULT_LEAVE_REQUESTS_FILE,
+    ngay: Optional[date] = None
+) -> Iterator[Tuple[str, str]]:
+    """
+    Trả dần (tên, VIOLATION_ABSENT/VIOLATION_LATE) của một ngày, người vắng trước.
+
+    Người vắng được lọc nghỉ phép theo từng lô STREAM_CHUNK_SIZE người, nên bước sau
+    (tao_noi_dung_email_dong) nhận được những người đầu tiên ngay. Nếu không đọc được
+    file hoặc ngày, lỗi được in ra và không có vi phạm nào.
+
+    Args:
+        ngay_nhap: Ngày cần kiểm tra (số ngày trong tháng).
+        gio_nhap_str: Giờ vào làm chuẩn dạng chuỗi (ví dụ: "18:00").
+        ten_file_excel: Tên file Excel chứa dữ liệu điểm danh.
+        ten_file_leave_requests: File nghỉ phép; None để không lọc.
+        ngay: Ngày đầy đủ để đối chiếu nghỉ phép (mặc định: ngay_kiem_tra_gan_nhat(ngay_nhap)).
+    """
+    cot_ma, ten, loi = _cot_ma_ngay(ngay_nhap, gio_nhap_str, ten_file_excel)
+    if loi:
+        print(loi)
+        return
+
+    ngay = ngay or ngay_kiem_tra_gan_nhat(ngay_nhap)
+    for loai, ma in ((VIOLATION_ABSENT, MA_VANG), (VIOLATION_LATE, MA_DI_MUON)):
+        vi_tri = np.flatnonzero(cot_ma == ma)
+        for dau in range(0, vi_tri.size, STREAM_CHUNK_SIZE):
+            cac_ten = ten[vi_tri[dau:dau + STREAM_CHUNK_SIZE]].tolist()
+            if loai == VIOLATION_ABSENT and ten_file_leave_requests:
+                cac_ten = loai_bo_nguoi_nghi_phep(cac_ten, ten_file_leave_requests, ngay=ngay)
+            for ten_thanh_vien in cac_ten:
+                yield ten_thanh_vien, loai
+
+
+def thong_ke_diem_danh(ma_tran: Dict) -> pd.DataFrame:
+    """
+    Thống kê số lần đi muộn/vắng và tổng số phút muộn của từng thành viên.
+
+    Args:
+        ma_tran: Kết quả của tao_ma_tran_diem_danh (có thể đã qua loc_ma_tran_nghi_phep).
+
+    Returns:
+        DataFrame (hàng: tên thành viên) với các cột số lần theo từng trạng thái
+        và cột 'Tổng phút muộn'.
+    """
+    ma = ma_tran["ma"]
+    thong_ke = pd.DataFrame(
+        {trang_thai: (ma == code).sum(axis=1).astype(np.int16) for code, trang_thai in enumerate(CAC_TRANG_THAI)},
+        index=pd.CategoricalIndex(ma_tran["ten"], name="ten"),
+    )
+    thong_ke["Tổng phút muộn"] = ma_tran["phut_muon"].to_numpy().sum(axis=1, dtype=np.int32)
+    return thong_ke
+
+
+class MauEmail:
+    """
+    Mẫu email đã biên dịch: danh sách đoạn văn bản cố định xen kẽ placeholder [..].
+
+    Mẫu chỉ được phân tích một lần; mỗi lần điền chỉ ghép các đoạn trong một lượt.
+    """
+
+    __slots__ = ("_cac_doan", "cac_placeholder", "ma_bam")
+
+    def __init__(self, noi_dung_mau: str) -> None:
+        # re.split với nhóm bắt: vị trí chẵn là văn bản, vị trí lẻ là tên placeholder
+        self._cac_doan: List[str] = re.split(r"\[(.*?)\]", noi_dung_mau)
+        self.cac_placeholder: List[str] = list(dict.fromkeys(self._cac_doan[1::2]))
+        self.ma_bam: str = hashlib.blake2b(noi_dung_mau.encode("utf-8"), digest_size=8).hexdigest()
+
+    def dien(self, gia_tri: Dict[str, str]) -> str:
+        """Điền mẫu; placeholder không có trong gia_tri được giữ nguyên dạng [tên]."""
+        cac_doan = self._cac_doan
+        ket_qua = cac_doan[:]
+        for i in range(1, len(cac_doan), 2):
+            ten = cac_doan[i]
+            ket_qua[i] = gia_tri[ten] if ten in gia_tri else f"[{ten}]"
+        return "".join(ket_qua)
+
+
+@functools.lru_cache(maxsize=32)
+def bien_dich_mau_email(noi_dung_mau: str) -> MauEmail:
+    """Biên dịch nội dung mẫu email; cùng một nội dung chỉ biên dịch một lần."""
+    return MauEmail(noi_dung_mau)
+
+
+_MAU_EMAIL_THEO_FILE: Dict[str, Tuple[int, int, MauEmail]] = {}
+
+
+def tai_mau_email(ten_file_mau: str = DEFAULT_EMAIL_TEMPLATE_FILE) -> MauEmail:
+    """
+    Đọc và biên dịch file mẫu email, dùng lại bản đã biên dịch cho tới khi file thay đổi.
+
+    Args:
+        ten_file_mau: Tên file chứa mẫu email.
+
+    Returns:
+        MauEmail đã biên dịch.
+
+    Raises:
+        FileNotFoundError / OSError nếu không đọc được file.
+    """
+    thong_tin = os.stat(ten_file_mau)
+    duong_dan = os.path.abspath(ten_file_mau)
+    da_luu = _MAU_EMAIL_THEO_FILE.get(duong_dan)
+    if da_luu and da_luu[0] == thong_tin.st_mtime_ns and da_luu[1] == thong_tin.st_size:
+        return da_luu[2]
+    with open(ten_file_mau, "r", encoding="utf-8") as f:
+        mau = bien_dich_mau_email(f.read())
+    _MAU_EMAIL_THEO_FILE[duong_dan] = (thong_tin.st_mtime_ns, thong_tin.st_size, mau)
+    return mau
+
+
+class DanhBaEmail:
+    """
+    Chỉ mục tên → email đọc từ file CSV (cột 'ten', 'email').
+
+    Khóa tra cứu là tên đã chuẩn hóa (_chuan_hoa_ten), nên khoảng trắng thừa hay cách
+    dựng dấu tiếng Việt khác nhau (NFC/NFD) giữa file Excel và file CSV vẫn khớp. Tên
+    trùng lặp lấy email đầu tiên.
+    """
+
+    __slots__ = ("_email_theo_khoa", "_ten_theo_khoa", "_cac_khoa")
+
+    def __init__(self, df_emails: pd.DataFrame) -> None:
+        bang = pd.DataFrame({
+            "khoa": _chuan_hoa_ten(df_emails["ten"]),
+            "ten": df_emails["ten"].astype(str).str.strip(),
+            "email": df_emails["email"].str.strip() if df_emails["email"].dtype == object else df_emails["email"],
+        }).drop_duplicates("khoa", keep="first").set_index("khoa")
+        self._email_theo_khoa: pd.Series = bang["email"]
+        self._ten_theo_khoa: pd.Series = bang["ten"]
+        self._cac_khoa: List[str] = bang.index.tolist()
+
+    def __len__(self) -> int:
+        return len(self._cac_khoa)
+
+    def tra_cuu(self, danh_sach_ten: List[str], so_goi_y: int = 3) -> Tuple[Dict[str, object], Dict[str, List[str]]]:
+        """
+        Tra email cho cả một danh sách tên trong một lần join.
+
+        Returns:
+            (tìm thấy, không tìm thấy): tìm thấy là {tên gốc: email}; không tìm thấy là
+            {tên gốc: các tên gần giống nhất trong danh bạ}.
+        """
+        if not danh_sach_ten:
+            return {}, {}
+        cac_ten = pd.Series(list(dict.fromkeys(danh_sach_ten)), dtype=object)
+        cac_email = _chuan_hoa_ten(cac_ten).map(self._email_theo_khoa)
+        co_email = cac_email.notna()
+        tim_thay = dict(zip(cac_ten[co_email], cac_email[co_email]))
+        khong_tim_thay = {
+            ten: [
+                self._ten_theo_khoa[khoa]
+                for khoa in difflib.get_close_matches(khoa_ten, self._cac_khoa, n=so_goi_y, cutoff=0.6)
+            ]
+            for ten, khoa_ten in zip(cac_ten[~co_email], _chuan_hoa_ten(cac_ten[~co_email]))
+        }
+        return tim_thay, khong_tim_thay
+
+
+_DANH_BA_THEO_FILE: Dict[str, Tuple[int, int, DanhBaEmail]] = {}
+
+
+def tai_danh_ba_email(ten_file_emails: str = DEFAULT_EMAILS_FILE) -> DanhBaEmail:
+    """
+    Đọc file CSV email thành DanhBaEmail, dùng lại bản đã đọc cho tới khi file thay đổi.
+
+    Raises:
+        FileNotFoundError / OSError nếu không đọc được file.
+        ValueError nếu file thiếu cột 'ten' hoặc 'email'.
+    """
+    thong_tin = os.stat(ten_file_emails)
+    duong_dan = os.path.abspath(ten_file_emails)
+    da_luu = _DANH_BA_THEO_FILE.get(duong_dan)
+    if da_luu and da_luu[0] == thong_tin.st_mtime_ns and da_luu[1] == thong_tin.st_size:
+        return da_luu[2]
+    df_emails = pd.read_csv(ten_file_emails, dtype=str, skipinitialspace=True)
+    if 'ten' not in df_emails.columns or 'email' not in df_emails.columns:
+        raise ValueError(f"File {ten_file_emails} phải chứa cột 'ten' và 'email'.")
+    danh_ba = DanhBaEmail(df_emails)
+    _DANH_BA_THEO_FILE[duong_dan] = (thong_tin.st_mtime_ns, thong_tin.st_size, danh_ba)
+    return danh_ba
+
+
+class SoCaiDaGui:
+    """
+    Sổ cái các thông báo vi phạm đã gửi, để chạy lại cùng một ngày không gửi trùng.
+
+    Mỗi thông báo có khóa 64 bit băm từ (ngày, thành viên, loại vi phạm, mã băm mẫu email).
+    Khi tạo nội dung, các khóa của một email được ghi ở trạng thái chờ, gắn với mã của
+    chính thư đó (ma_thu: băm địa chỉ và nội dung); khi thư gửi thành công, các khóa của
+    thư được xác nhận. Thư không có khóa nào trong sổ cái (ví dụ thông báo gửi thủ công)
+    không bao giờ bị bỏ qua. Khóa đã xác nhận được giữ trong một set trong bộ nhớ để tra
+    cứu nhanh và đọc lại khi tiến trình khác ghi vào sổ cái.
+    """
+
+    def __init__(self, ten_file: str) -> None:
+        self._khoa = threading.Lock()
+        self._ket_noi = sqlite3.connect(ten_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self._ket_noi.execute("PRAGMA journal_mode=WAL")
+        self._ket_noi.execute(
+            """CREATE TABLE IF NOT EXISTS so_cai (
+                khoa INTEGER PRIMARY KEY,
+                email TEXT NOT NULL,
+                da_gui INTEGER NOT NULL DEFAULT 0,
+                cap_nhat_luc TEXT NOT NULL
+            )"""
+        )
+        self._ket_noi.execute("CREATE INDEX IF NOT EXISTS so_cai_email ON so_cai (email, da_gui)")
+        self._ket_noi.execute(
+            """CREATE TABLE IF NOT EXISTS thu (
+                ma_thu INTEGER NOT NULL,
+                khoa INTEGER NOT NULL,
+                PRIMARY KEY (ma_thu, khoa)
+            ) WITHOUT ROWID"""
+        )
+        self._phien_ban: Optional[int] = None
+        self._da_gui: Set[int] = set()
+
+    @staticmethod
+    def tao_khoa(ngay: Optional[date], ten: str, loai: str, ma_mau: str) -> int:
+        """Khóa của một thông báo; ten nên là tên đã chuẩn hóa (_chuan_hoa_ten)."""
+        chuoi = f"{ngay.isoformat() if ngay else ''}|{ten}|{loai}|{ma_mau}"
+        return int.from_bytes(hashlib.blake2b(chuoi.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+    @staticmethod
+    def ma_thu(email: str, noi_dung: str) -> int:
+        """Mã 64 bit của một thư (địa chỉ người nhận và nội dung)."""
+        bam = hashlib.blake2b(email.encode("utf-8"), digest_size=8)
+        bam.update(b"\0")
+        bam.update(noi_dung.encode("utf-8"))
+        return int.from_bytes(bam.digest(), "little", signed=True)
+
+    def _lam_moi(self) -> None:
+        # data_version đổi khi một kết nối khác ghi vào file
+        phien_ban = self._ket_noi.execute("PRAGMA data_version").fetchone()[0]
+        if phien_ban != self._phien_ban:
+            self._da_gui = {hang[0] for hang in self._ket_noi.execute("SELECT khoa FROM so_cai WHERE da_gui = 1")}
+            self._phien_ban = phien_ban
+
+    def da_gui(self, khoa: int) -> bool:
+        with self._khoa:
+            self._lam_moi()
+            return khoa in self._da_gui
+
+    def cho_gui(self, cac_thu: List[Tuple[str, str, List[int]]]) -> None:
+        """Ghi các thư vừa tạo: (email, nội dung, khóa các thông báo trong thư), khóa ở trạng thái chờ."""
+        bay_gio = datetime.now().isoformat(timespec="seconds")
+        with self._khoa, self._ket_noi:
+            self._ket_noi.execute("BEGIN IMMEDIATE")
+            self._ket_noi.executemany(
+                "INSERT OR IGNORE INTO so_cai (khoa, email, da_gui, cap_nhat_luc) VALUES (?, ?, 0, ?)",
+                [(khoa, email, bay_gio) for email, _, cac_khoa in cac_thu for khoa in cac_khoa],
+            )
+            self._ket_noi.executemany(
+                "INSERT OR IGNORE INTO thu (ma_thu, khoa) VALUES (?, ?)",
+                [(self.ma_thu(email, noi_dung), khoa) for email, noi_dung, cac_khoa in cac_thu for khoa in cac_khoa],
+            )
+
+    def loc_da_gui(self, cac_ma_thu: List[int]) -> Set[int]:
+        """Các thư đã ghi trong sổ cái mà mọi thông báo trong thư đều đã gửi."""
+        da_gui: Set[int] = set()
+        with self._khoa:
+            for i in range(0, len(cac_ma_thu), 500):
+                nhom = cac_ma_thu[i:i + 500]
+                da_gui.update(hang[0] for hang in self._ket_noi.execute(
+                    f"SELECT thu.ma_thu FROM thu JOIN so_cai ON so_cai.khoa = thu.khoa "
+                    f"WHERE thu.ma_thu IN ({','.join('?' * len(nhom))}) "
+                    "GROUP BY thu.ma_thu HAVING MIN(so_cai.da_gui) = 1",
+                    nhom,
+                ))
+        return da_gui
+
+    def xac_nhan(self, cac_ma_thu: List[int]) -> None:
+        """Đánh dấu đã gửi mọi thông báo trong các thư này."""
+        if not cac_ma_thu:
+            return
+        bay_gio = datetime.now().isoformat(timespec="seconds")
+        with self._khoa, self._ket_noi:
+            self._ket_noi.execute("BEGIN IMMEDIATE")
+            self._ket_noi.executemany(
+                "UPDATE so_cai SET da_gui = 1, cap_nhat_luc = ? "
+                "WHERE da_gui = 0 AND khoa IN (SELECT khoa FROM thu WHERE ma_thu = ?)",
+                [(bay_gio, ma_thu) for ma_thu in cac_ma_thu],
+            )
+            # data_version không đổi với ghi của chính kết nối này: buộc đọc lại
+            self._phien_ban = None
+
+
+_SO_CAI_THEO_FILE: Dict[str, SoCaiDaGui] = {}
+
+
+def tai_so_cai(ten_file_so_cai: str = DEFAULT_LEDGER_FILE) -> SoCaiDaGui:
+    """Mở sổ cái đã gửi (mỗi file một đối tượng dùng chung trong tiến trình)."""
+    duong_dan = os.path.abspath(ten_file_so_cai)
+    if duong_dan not in _SO_CAI_THEO_FILE:
+        _SO_CAI_THEO_FILE[duong_dan] = SoCaiDaGui(duong_dan)
+    return _SO_CAI_THEO_FILE[duong_dan]
+
+
+def _loc_email_da_gui(
+    emails_data: Dict[str, str],
+    ten_file_so_cai: Optional[str],
+    khi_co_ket_qua: Optional[Callable[[str, str], None]] = None
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Tách các thư mà mọi thông báo trong thư đã gửi (theo sổ cái); trả về (email cần gửi,
+    kết quả của email bỏ qua). Thư không được ghi trong sổ cái luôn được gửi.
+    """
+    if not ten_file_so_cai or not emails_data:
+        return emails_data, {}
+    try:
+        ma_thu = {email: SoCaiDaGui.ma_thu(email, noi_dung) for email, noi_dung in emails_data.items()}
+        thu_da_gui = tai_so_cai(ten_file_so_cai).loc_da_gui(list(ma_thu.values()))
+    except Exception as e:
+        print(f"Cảnh báo: Không đọc được sổ cái {ten_file_so_cai}: {e}. Gửi tất cả email.")
+        return emails_data, {}
+    da_gui = {email for email, ma in ma_thu.items() if ma in thu_da_gui}
+    bo_qua = {}
+    for email in emails_data:
+        if email in da_gui:
+            print(f"Bỏ qua {email}: các thông báo trong email này đã được gửi trước đó.")
+            bo_qua[email] = TRANG_THAI_DA_GUI_TRUOC
+            if khi_co_ket_qua:
+                khi_co_ket_qua(email, TRANG_THAI_DA_GUI_TRUOC)
+    return {email: noi_dung for email, noi_dung in emails_data.items() if email not in da_gui}, bo_qua
+
+
+def _xac_nhan_so_cai(cac_ma_thu: List[int], ten_file_so_cai: Optional[str]) -> None:
+    """Xác nhận trong sổ cái các thư (SoCaiDaGui.ma_thu) vừa gửi thành công."""
+    if not ten_file_so_cai or not cac_ma_thu:
+        return
+    try:
+        tai_so_cai(ten_file_so_cai).xac_nhan(cac_ma_thu)
+    except Exception as e:
+        print(f"Cảnh báo: Không ghi được sổ cái {ten_file_so_cai}: {e}")
+
+
+def _tai_mau_va_email(
+    ten_file_mau: str,
+    ten_file_emails: str,
+    cac_ten: List[str]
+) -> Optional[Tuple[MauEmail, Dict[str, object]]]:
+    """
+    Đọc mẫu email và tra email cho mọi người trong cac_ten một lần.
+
+    Returns:
+        (mẫu email, {tên: email}), hoặc None (kèm thông báo lỗi) nếu không đọc được file.
+    """
+    # Đọc file mẫu email (đã biên dịch, chỉ đọc lại khi file thay đổi)
+    try:
+        mau_email = tai_mau_email(ten_file_mau)
+    except FileNotFoundError:
+        print(f"Lỗi: Không tìm thấy file mẫu email: {ten_file_mau}")
+        return None
+    except Exception as e:
+        print(f"Lỗi khi đọc file mẫu email: {e}")
+        return None
+
+    # Đọc danh bạ email (chỉ đọc lại khi file thay đổi) và tra email cho mọi người vi phạm một lần
+    try:
+        danh_ba = tai_danh_ba_email(ten_file_emails)
+    except FileNotFoundError:
+        print(f"Lỗi: Không tìm thấy file emails: {ten_file_emails}")
+        return None
+    except ValueError as e:
+        print(f"Lỗi: {e}")
+        return None
+    except Exception as e:
+        print(f"Lỗi khi đọc file emails {ten_file_emails}: {e}")
+        return None
+    email_map, khong_tim_thay = danh_ba.tra_cuu(cac_ten)
+    for ten, goi_y in khong_tim_thay.items():
+        goi_y_str = f" Có phải: {', '.join(goi_y)}?" if goi_y else ""
+        print(f"Cảnh báo: Không tìm thấy email cho '{ten}' trong {ten_file_emails}.{goi_y_str}")
+    return mau_email, email_map
+
+
+def _email_hop_le(email_map: Dict[str, object], ten: str) -> Optional[str]:
+    """Email của ten nếu hợp lệ; None nếu không có (đã cảnh báo khi tra cứu) hoặc không hợp lệ."""
+    email_nhan = email_map.get(ten)
+    if not email_nhan:
+        return None
+    if not isinstance(email_nhan, str) or '@' not in email_nhan:
+        print(f"Cảnh báo: Email không hợp lệ ('{email_nhan}') cho '{ten}'. Bỏ qua.")
+        return None
+    return email_nhan
+
+
+def _doc_so_tien(so_tien: str) -> int:
+    """Đọc số tiền dạng '5,000' thành số nguyên."""
+    return int(re.sub(r"[^0-9]", "", so_tien) or 0)
+
+
+def tao_noi_dung_email(
+    danh_sach_vang: List[str],
+    danh_sach_di_muon: List[str],
+    ten_file_emails: str = DEFAULT_EMAILS_FILE,
+    ten_file_mau: str = DEFAULT_EMAIL_TEMPLATE_FILE,
+    ten_file_log: Optional[str] = None,
+    ngay_vi_pham: Optional[date] = None,
+    tang_muc_phat: bool = False,
+    tong_hop: bool = False,
+    ten_file_so_cai: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Tạo nội dung email cá nhân hóa cho người vi phạm.
+
+    Args:
+        danh_sach_vang: Danh sách người vắng.
+        danh_sach_di_muon: Danh sách người đi muộn.
+        ten_file_emails: Tên file CSV chứa thông tin email (cột 'ten', 'email').
+        ten_file_mau: Tên file chứa mẫu email.
+        ten_file_log: Log sự kiện dùng để đếm số lần vi phạm (tai_bo_dem_vi_pham), thường
+            là DEFAULT_EVENT_LOG_FILE; None (mặc định): dùng COUNT_DEFAULT, không đọc hay
+            tạo file đếm.
+        ngay_vi_pham: Ngày của các vi phạm này (mặc định: hôm nay).
+        tang_muc_phat: Tính mức phạt theo số lần vi phạm (FINE_ESCALATION).
+        tong_hop: Gộp mọi vi phạm của một người vào một email (tao_email_tong_hop) thay vì
+            một email cho mỗi vi phạm.
+        ten_file_so_cai: Sổ cái đã gửi (SoCaiDaGui), thường là DEFAULT_LEDGER_FILE khi tạo để
+            gửi; vi phạm đã được thông báo với cùng mẫu email sẽ bị bỏ qua và khóa của các
+            email tạo ra được ghi chờ xác nhận. None (mặc định): không đọc hay ghi sổ cái,
+            ví dụ khi chỉ xem trước.
+
+    Returns:
+        Dictionary với key là email người nhận, value là nội dung email.
+    """
+    if tong_hop:
+        ngay = ngay_vi_pham or date.today()
+        vi_pham_theo_ten: Dict[str, List[Tuple[str, Optional[date]]]] = {}
+        for ten in danh_sach_di_muon:
+            vi_pham_theo_ten.setdefault(ten, []).append((VIOLATION_LATE, ngay))
+        for ten in danh_sach_vang:
+            vi_pham_theo_ten.setdefault(ten, []).append((VIOLATION_ABSENT, ngay))
+        return tao_email_tong_hop(
+            vi_pham_theo_ten, ten_file_emails, ten_file_mau, ten_file_log, tang_muc_phat, ten_file_so_cai
+        )
+
+    # Người vắng trước: mỗi địa chỉ chỉ nhận một email, thông báo vắng được ưu tiên
+    vi_pham = chain(
+        ((ten, VIOLATION_ABSENT) for ten in danh_sach_vang),
+        ((ten, VIOLATION_LATE) for ten in danh_sach_di_muon),
+    )
+    return dict(tao_noi_dung_email_dong(
+        vi_pham, ten_file_emails, ten_file_mau, ten_file_log, ngay_vi_pham, tang_muc_phat, ten_file_so_cai
+    ))
+
+
+def tao_noi_dung_email_dong(
+    vi_pham: Iterable[Tuple[str, str]],
+    ten_file_emails: str = DEFAULT_EMAILS_FILE,
+    ten_file_mau: str = DEFAULT_EMAIL_TEMPLATE_FILE,
+    ten_file_log: Optional[str] = None,
+    ngay_vi_pham: Optional[date] = None,
+    tang_muc_phat: bool = False,
+    ten_file_so_cai: Optional[str] = None
+) -> Iterator[Tuple[str, str]]:
+    """
+    Tạo nội dung email theo luồng: đọc dần (tên, loại vi phạm), trả dần (email, nội dung).
+
+    Đầu vào được xử lý theo lô STREAM_CHUNK_SIZE người (tra email, đếm số lần vi phạm, ghi
+    khóa chờ vào sổ cái cho cả lô), nên bộ nhớ không phụ thuộc số vi phạm; chỉ tập các
+    địa chỉ đã tạo email được giữ lại. Mỗi địa chỉ chỉ nhận một email: vi phạm sau của
+    cùng địa chỉ bị bỏ qua kèm cảnh báo.
+
+    Args:
+        vi_pham: Các cặp (tên, VIOLATION_LATE/VIOLATION_ABSENT), ví dụ từ vi_pham_ngay_dong.
+        Các tham số còn lại: như tao_noi_dung_email.
+
+    Yields:
+        (email người nhận, nội dung email), dùng làm nguồn cho gui_email_dong.
+    """
+    so_cai = None
+    if ten_file_so_cai:
+        try:
+            so_cai = tai_so_cai(ten_file_so_cai)
+        except Exception as e:
+            print(f"Cảnh báo: Không mở được sổ cái {ten_file_so_cai}: {e}. Không kiểm tra gửi trùng.")
+    bo_dem = None
+    if ten_file_log:
+        try:
+            bo_dem = tai_bo_dem_vi_pham(ten_file_log)
+        except Exception as e:
+            print(f"Cảnh báo: Không đếm được số lần vi phạm từ {ten_file_log}: {e}. Dùng giá trị mặc định.")
+
+    ngay = ngay_vi_pham or date.today()
+    muc_phat_co_ban = {VIOLATION_LATE: FINE_LATE, VIOLATION_ABSENT: FINE_ABSENT}
+    han_xu_ly = (datetime.now() + timedelta(days=DAYS_TO_HANDLE_DEFAULT)).strftime("%d/%m/%Y")
+    da_tao: Set[str] = set()
+
+    for lo in _chia_lo(vi_pham, STREAM_CHUNK_SIZE):
+        cac_ten = [ten for ten, _ in lo]
+        # Mẫu và danh bạ được đọc lại từ cache (chỉ đọc file khi file thay đổi)
+        da_tai = _tai_mau_va_email(ten_file_mau, ten_file_emails, cac_ten)
+        if da_tai is None:
+            return
+        mau_email, email_map = da_tai
+
+        # Số lần vi phạm của từng người theo loại, từ bộ đếm cập nhật dần theo log
+        so_lan: Dict[str, Dict[str, int]] = {}
+        if bo_dem is not None:
+            try:
+                for loai in muc_phat_co_ban:
+                    so_lan[loai] = bo_dem.so_lan([ten for ten, l in lo if l == loai], loai, ngay_vi_pham)
+            except Exception as e:
+                print(f"Cảnh báo: Không đếm được số lần vi phạm từ {ten_file_log}: {e}. Dùng giá trị mặc định.")
+        ten_chuan = _chuan_hoa_ten(pd.Series(cac_ten, dtype=object)).tolist() if so_cai is not None else []
+
+        lo_email: List[Tuple[str, str]] = []
+        khoa_theo_email: Dict[str, List[int]] = {}
+        for i, (ten, loai) in enumerate(lo):
+            email_nhan = _email_hop_le(email_map, ten)
+            if not email_nhan:
+                continue
+            if email_nhan in da_tao:
+                print(f"Cảnh báo: {email_nhan} có nhiều vi phạm, chỉ gửi thông báo đầu tiên. Dùng chế độ tổng hợp để gộp các vi phạm.")
+                continue
+            if so_cai is not None:
+                # Vi phạm đã thông báo với cùng mẫu email thì bỏ qua
+                khoa = so_cai.tao_khoa(ngay, ten_chuan[i], loai, mau_email.ma_bam)
+                if so_cai.da_gui(khoa):
+                    print(f"Bỏ qua '{ten}' ({loai}): đã gửi thông báo trước đó.")
+                    continue
+                khoa_theo_email[email_nhan] = [khoa]
+
+            lan = so_lan.get(loai, {}).get(ten)
+            so_tien = muc_phat_co_ban.get(loai, "0")
+            if lan and tang_muc_phat:
+                muc_phat = FINE_ESCALATION.get(loai) or [so_tien]
+                so_tien = muc_phat[min(lan, len(muc_phat)) - 1]
+            da_tao.add(email_nhan)
+            # Điền mẫu đã biên dịch trong một lượt
+            lo_email.append((email_nhan, mau_email.dien({
+                PLACEHOLDER_NAME: ten,
+                PLACEHOLDER_REASON: loai,
+                PLACEHOLDER_COUNT: str(lan) if lan else COUNT_DEFAULT,
+                PLACEHOLDER_FINE: so_tien,
+                PLACEHOLDER_DEADLINE: han_xu_ly,
+            })))
+
+        # Ghi khóa chờ trước khi trả email ra, để lần gửi thành công xác nhận được
+        if so_cai is not None and khoa_theo_email:
+            so_cai.cho_gui([(email, noi_dung, khoa_theo_email[email]) for email, noi_dung in lo_email])
+        yield from lo_email
+
+
+def vi_pham_tu_ma_tran(
+    ma_tran: Dict,
+    tu_ngay: int,
+    den_ngay: int,
+    thang: Optional[date] = None
+) -> Dict[str, List[Tuple[str, Optional[date]]]]:
+    """
+    Lấy mọi vi phạm (đi muộn, vắng) của từng thành viên trong khoảng ngày từ ma trận điểm danh.
+
+    Args:
+        ma_tran: Kết quả của tao_ma_tran_diem_danh (nên qua loc_ma_tran_nghi_phep trước).
+        tu_ngay, den_ngay: Khoảng ngày (số ngày trong tháng, tính cả hai đầu).
+        thang: Một ngày bất kỳ trong tháng của bảng điểm danh (mặc định: tháng của
+            ngay_kiem_tra_gan_nhat(den_ngay)).
+
+    Returns:
+        {tên: [(VIOLATION_LATE/VIOLATION_ABSENT, ngày), ...]} theo thứ tự ngày.
+    """
+    thang = thang or ngay_kiem_tra_gan_nhat(den_ngay) or date.today()
+    so_ngay = np.asarray(ma_tran["ngay"])
+    cot = np.flatnonzero((so_ngay >= tu_ngay) & (so_ngay <= den_ngay))
+    ma = ma_tran["ma"][:, cot]
+    hang, vi_tri = np.nonzero((ma == MA_DI_MUON) | (ma == MA_VANG))
+    thu_tu = np.lexsort((so_ngay[cot][vi_tri], hang)) # Theo thành viên rồi theo ngày
+    ten = np.asarray(ma_tran["ten"])
+
+    vi_pham_theo_ten: Dict[str, List[Tuple[str, Optional[date]]]] = {}
+    for h, j in zip(hang[thu_tu].tolist(), vi_tri[thu_tu].tolist()):
+        try:
+            ngay: Optional[date] = date(thang.year, thang.month, int(so_ngay[cot[j]]))
+        except ValueError:
+            ngay = None
+        loai = VIOLATION_LATE if ma[h, j] == MA_DI_MUON else VIOLATION_ABSENT
+        vi_pham_theo_ten.setdefault(str(ten[h]), []).append((loai, ngay))
+    return vi_pham_theo_ten
+
+
+def tao_email_tong_hop(
+    vi_pham_theo_ten: Dict[str, List[Tuple[str, Optional[date]]]],
+    ten_file_emails: str = DEFAULT_EMAILS_FILE,
+    ten_file_mau: str = DEFAULT_EMAIL_TEMPLATE_FILE,
+    ten_file_log: Optional[str] = None,
+    tang_muc_phat: bool = False,
+    ten_file_so_cai: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Tạo một email tổng hợp cho mỗi thành viên, gộp mọi vi phạm của người đó.
+
+    Lý do liệt kê từng loại vi phạm kèm các ngày; số tiền là tổng mức phạt của mọi vi phạm
+    (theo FINE_ESCALATION nếu tang_muc_phat); số lần là tổng số lần vi phạm tính cả các
+    lần trước trong log.
+
+    Args:
+        vi_pham_theo_ten: {tên: [(loại vi phạm, ngày), ...]}, ví dụ từ vi_pham_tu_ma_tran.
+        ten_file_emails: Tên file CSV chứa thông tin email (cột 'ten', 'email').
+        ten_file_mau: Tên file chứa mẫu email.
+        ten_file_log: Log sự kiện dùng để đếm các lần vi phạm trước; None (mặc định) để chỉ
+            đếm các vi phạm này.
+        tang_muc_phat: Tính mức phạt theo số lần vi phạm (FINE_ESCALATION).
+        ten_file_so_cai: Sổ cái đã gửi (SoCaiDaGui); vi phạm đã được thông báo với cùng mẫu
+            email không được đưa vào email nữa. None (mặc định) để không dùng sổ cái.
+
+    Returns:
+        Dictionary với key là email người nhận, value là nội dung email.
+    """
+    da_tai = _tai_mau_va_email(ten_file_mau, ten_file_emails, list(vi_pham_theo_ten))
+    if da_tai is None:
+        return {}
+    mau_email, email_map = da_tai
+
+    so_cai = None
+    khoa_theo_email: Dict[str, List[int]] = {}
+    if ten_file_so_cai:
+        try:
+            so_cai = tai_so_cai(ten_file_so_cai)
+        except Exception as e:
+            print(f"Cảnh báo: Không mở được sổ cái {ten_file_so_cai}: {e}. Không kiểm tra gửi trùng.")
+    khoa_ten = dict(zip(vi_pham_theo_ten, _chuan_hoa_ten(pd.Series(list(vi_pham_theo_ten), dtype=object)).tolist()))
+
+    ngay_truoc: Dict[str, Dict[str, Set[str]]] = {VIOLATION_LATE: {}, VIOLATION_ABSENT: {}}
+    if ten_file_log:
+        try:
+            bo_dem = tai_bo_dem_vi_pham(ten_file_log)
+            for loai in ngay_truoc:
+                ngay_truoc[loai] = bo_dem.cac_ngay(list(vi_pham_theo_ten), loai)
+        except Exception as e:
+            print(f"Cảnh báo: Không đếm được số lần vi phạm từ {ten_file_log}: {e}. Chỉ đếm các vi phạm lần này.")
+
+    muc_phat_co_ban = {VIOLATION_LATE: FINE_LATE, VIOLATION_ABSENT: FINE_ABSENT}
+    han_xu_ly = (datetime.now() + timedelta(days=DAYS_TO_HANDLE_DEFAULT)).strftime("%d/%m/%Y")
+    emails_to_send: Dict[str, str] = {}
+    for ten, cac_vi_pham in vi_pham_theo_ten.items():
+        email_nhan = _email_hop_le(email_map, ten)
+        if not email_nhan:
+            continue
+
+        theo_loai: Dict[str, List[Optional[date]]] = {}
+        cac_khoa: List[int] = []
+        for loai, ngay in cac_vi_pham:
+            if ngay is not None and ngay in theo_loai.get(loai, []):
+                continue
+            if so_cai is not None:
+                khoa = so_cai.tao_khoa(ngay, khoa_ten[ten], loai, mau_email.ma_bam)
+                if so_cai.da_gui(khoa):
+                    continue # Đã thông báo vi phạm này
+                cac_khoa.append(khoa)
+            theo_loai.setdefault(loai, []).append(ngay)
+        if not theo_loai:
+            print(f"Bỏ qua '{ten}': mọi vi phạm đã được thông báo trước đó.")
+            continue
+        cac_ly_do, tong_lan, tong_tien = [], 0, 0
+        for loai, cac_ngay in theo_loai.items():
+            ngay_lan_nay = {ngay.isoformat() for ngay in cac_ngay if ngay}
+            lan_truoc = len(ngay_truoc.get(loai, {}).get(ten, set()) - ngay_lan_nay)
+            muc_phat = FINE_ESCALATION.get(loai) if tang_muc_phat else None
+            for lan in range(lan_truoc + 1, lan_truoc + len(cac_ngay) + 1):
+                so_tien = muc_phat[min(lan, len(muc_phat)) - 1] if muc_phat else muc_phat_co_ban.get(loai, "0")
+                tong_tien += _doc_so_tien(so_tien)
+            tong_lan += lan_truoc + len(cac_ngay)
+            ngay_str = ", ".join(ngay.strftime("%d/%m") for ngay in cac_ngay if ngay)
+            cac_ly_do.append(f"{loai} ({len(cac_ngay)} lần{': ' + ngay_str if ngay_str else ''})")
+
+        if email_nhan in emails_to_send:
+            print(f"Cảnh báo: Nhiều thành viên dùng chung email {email_nhan}; chỉ gửi email tổng hợp của '{ten}'.")
+        emails_to_send[email_nhan] = mau_email.dien({
+            PLACEHOLDER_NAME: ten,
+            PLACEHOLDER_REASON: "; ".join(cac_ly_do),
+            PLACEHOLDER_COUNT: str(tong_lan),
+            PLACEHOLDER_FINE: f"{tong_tien:,}",
+            PLACEHOLDER_DEADLINE: han_xu_ly,
+        })
+        khoa_theo_email[email_nhan] = cac_khoa
+
+    if so_cai is not None and khoa_theo_email:
+        so_cai.cho_gui([(email, emails_to_send[email], khoa_theo_email[email]) for email in emails_to_send])
+    return emails_to_send
+
+
+def _doc_cau_hinh_smtp(hau_to: str = "") -> Dict[str, object]:
+    """
+    Đọc cấu hình gửi email từ file .env.
+
+    Args:
+        hau_to: Hậu tố tên biến của tài khoản phụ (ví dụ "_2" cho EMAIL_ADDRESS_2). Tài khoản
+            phụ dùng giá trị chung (SMTP_SERVER, SMTP_PORT, ...) cho biến không khai báo riêng.
+
+    Returns:
+        Dictionary gồm 'email', 'password', 'server', 'port', 'pool_size', 'rate',
+        'daily_quota' (EMAIL_DAILY_QUOTA, 0: không giới hạn), 'minute_quota' (EMAIL_MINUTE_QUOTA,
+        0: không giới hạn), 'starttls' (SMTP_STARTTLS), 'transport' (EMAIL_TRANSPORT, một trong CAC_KENH_GUI),
+        'sendmail_path' (SENDMAIL_PATH), 'output_path' và 'file_format' (EMAIL_OUTPUT_PATH,
+        EMAIL_FILE_FORMAT cho kênh file) và 'attachments' (danh sách file PDF đính kèm mặc
+        định, EMAIL_ATTACHMENTS cách nhau bởi dấu phẩy).
+        'email'/'password' có thể là None nếu thiếu cấu hình.
+    """
+    # Load biến môi trường từ file .env
+    load_dotenv()
+
+    def _doc(ten: str, mac_dinh: str) -> str:
+        return os.getenv(ten + hau_to) or os.getenv(ten, mac_dinh)
+
+    cau_hinh: Dict[str, object] = {
+        "email": os.getenv('EMAIL_ADDRESS' + hau_to),
+        "password": os.getenv('EMAIL_PASSWORD' + hau_to),
+        "server": _doc('SMTP_SERVER', SMTP_DEFAULT_SERVER),
+    }
+    # Đảm bảo port là số nguyên
+    try:
+        cau_hinh["port"] = int(_doc('SMTP_PORT', str(SMTP_DEFAULT_PORT)))
+    except ValueError:
+        print(f"Lỗi: SMTP_PORT{hau_to} trong .env không phải là số. Sử dụng port mặc định {SMTP_DEFAULT_PORT}.")
+        cau_hinh["port"] = SMTP_DEFAULT_PORT
+    try:
+        cau_hinh["pool_size"] = max(1, int(_doc('SMTP_POOL_SIZE', str(SMTP_DEFAULT_POOL_SIZE))))
+    except ValueError:
+        print(f"Lỗi: SMTP_POOL_SIZE{hau_to} trong .env không phải là số. Sử dụng giá trị mặc định {SMTP_DEFAULT_POOL_SIZE}.")
+        cau_hinh["pool_size"] = SMTP_DEFAULT_POOL_SIZE
+    try:
+        cau_hinh["rate"] = float(_doc('SMTP_RATE_LIMIT', str(SMTP_DEFAULT_RATE)))
+    except ValueError:
+        print(f"Lỗi: SMTP_RATE_LIMIT{hau_to} trong .env không phải là số. Sử dụng giá trị mặc định {SMTP_DEFAULT_RATE}.")
+        cau_hinh["rate"] = SMTP_DEFAULT_RATE
+    for khoa, ten, mac_dinh in (
+        ("daily_quota", "EMAIL_DAILY_QUOTA", SMTP_DEFAULT_DAILY_QUOTA),
+        ("minute_quota", "EMAIL_MINUTE_QUOTA", 0),
+    ):
+        try:
+            cau_hinh[khoa] = max(0, int(_doc(ten, str(mac_dinh))))
+        except ValueError:
+            print(f"Lỗi: {ten}{hau_to} trong .env không phải là số. Không giới hạn.")
+            cau_hinh[khoa] = 0
+    # SMTP_STARTTLS=0 cho relay nội bộ / máy chủ thử không hỗ trợ TLS
+    cau_hinh["starttls"] = _doc('SMTP_STARTTLS', '1').strip().lower() not in ('0', 'false', 'no')
+    cau_hinh["transport"] = _doc('EMAIL_TRANSPORT', KENH_SMTP).strip().lower()
+    if cau_hinh["transport"] not in CAC_KENH_GUI:
+        print(f"Lỗi: EMAIL_TRANSPORT{hau_to} phải là một trong {', '.join(CAC_KENH_GUI)}. Sử dụng {KENH_SMTP}.")
+        cau_hinh["transport"] = KENH_SMTP
+    cau_hinh["sendmail_path"] = _doc('SENDMAIL_PATH', SENDMAIL_DEFAULT_PATH)
+    cau_hinh["output_path"] = _doc('EMAIL_OUTPUT_PATH', DEFAULT_FILE_OUTPUT_DIR)
+    cau_hinh["file_format"] = _doc('EMAIL_FILE_FORMAT', DINH_DANG_EML).strip().lower()
+    if cau_hinh["file_format"] not in CAC_DINH_DANG_FILE:
+        print(f"Lỗi: EMAIL_FILE_FORMAT{hau_to} phải là một trong {', '.join(CAC_DINH_DANG_FILE)}. Sử dụng {DINH_DANG_EML}.")
+        cau_hinh["file_format"] = DINH_DANG_EML
+    cau_hinh["attachments"] = [p.strip() for p in os.getenv('EMAIL_ATTACHMENTS', '').split(',') if p.strip()]
+    return cau_hinh
+
+
+def _thieu_cau_hinh(cau_hinh: Dict[str, object]) -> bool:
+    """Thiếu địa chỉ gửi, hoặc thiếu mật khẩu khi gửi qua SMTP."""
+    return not cau_hinh["email"] or (cau_hinh.get("transport", KENH_SMTP) == KENH_SMTP and not cau_hinh["password"])
+
+
+def _mo_ta_kenh(cau_hinh: Dict[str, object]) -> str:
+    """Mô tả nơi thư được gửi tới, dùng trong thông báo."""
+    if cau_hinh.get("transport") == KENH_SENDMAIL:
+        return str(cau_hinh["sendmail_path"])
+    if cau_hinh.get("transport") == KENH_FILE:
+        return f"{cau_hinh['output_path']} ({cau_hinh['file_format']})"
+    return f"{cau_hinh['server']}:{cau_hinh['port']}"
+
+
+def _doc_cac_tai_khoan_smtp(kenh_gui: Optional[str] = None) -> List[Dict[str, object]]:
+    """
+    Đọc mọi tài khoản gửi trong .env: EMAIL_ADDRESS/EMAIL_PASSWORD và các tài khoản phụ
+    EMAIL_ADDRESS_2/EMAIL_PASSWORD_2 ... tới SMTP_MAX_ACCOUNTS.
+
+    Mỗi tài khoản phụ có thể khai báo riêng SMTP_SERVER_<n>, SMTP_PORT_<n>, SMTP_POOL_SIZE_<n>,
+    SMTP_RATE_LIMIT_<n>, EMAIL_DAILY_QUOTA_<n>, EMAIL_MINUTE_QUOTA_<n>.
+
+    Args:
+        kenh_gui: Kênh gửi (một trong CAC_KENH_GUI) dùng cho mọi tài khoản thay cho EMAIL_TRANSPORT.
+
+    Returns:
+        Cấu hình (như _doc_cau_hinh_smtp) của các tài khoản có đủ email và mật khẩu
+        (kênh sendmail và file không cần mật khẩu).
+    """
+    load_dotenv()
+    cac_hau_to = [""] + [f"_{i}" for i in range(2, SMTP_MAX_ACCOUNTS + 1) if os.getenv(f"EMAIL_ADDRESS_{i}")]
+    cac_tai_khoan = []
+    for hau_to in cac_hau_to:
+        cau_hinh = _doc_cau_hinh_smtp(hau_to)
+        if kenh_gui:
+            cau_hinh["transport"] = kenh_gui
+        if not _thieu_cau_hinh(cau_hinh):
+            cac_tai_khoan.append(cau_hinh)
+        elif hau_to:
+            print(f"Cảnh báo: Thiếu EMAIL_PASSWORD{hau_to} cho tài khoản {cau_hinh['email']}. Bỏ qua tài khoản này.")
+    return cac_tai_khoan
+
+
+class HanMucGui:
+    """
+    Số email mỗi tài khoản đã gửi trong ngày, để chia việc theo hạn mức còn lại.
+
+    Tài khoản có 'daily_quota' > 0 không được gửi quá hạn mức đó; tài khoản bị máy chủ báo
+    hết hạn mức (SMTP_QUOTA_MARKERS) bị dừng tới hết ngày. Số đếm về 0 khi sang ngày mới.
+    Dùng chung được giữa nhiều thread.
+    """
+
+    def __init__(self, ngay: Optional[str] = None, da_gui: Optional[Dict[str, int]] = None, het: Optional[List[str]] = None) -> None:
+        self._khoa = threading.Lock()
+        self.ngay = ngay or date.today().isoformat()
+        self._da_gui: Dict[str, int] = dict(da_gui or {})
+        self._het: Set[str] = set(het or [])
+        self._lam_moi_ngay()
+
+    def _lam_moi_ngay(self) -> None:
+        hom_nay = date.today().isoformat()
+        if self.ngay != hom_nay:
+            self.ngay, self._da_gui, self._het = hom_nay, {}, set()
+
+    def con_lai(self, tai_khoan: Dict[str, object]) -> Optional[int]:
+        """Số email tài khoản còn được gửi hôm nay; None nếu không giới hạn."""
+        email = str(tai_khoan["email"]).lower()
+        with self._khoa:
+            self._lam_moi_ngay()
+            if email in self._het:
+                return 0
+            if not tai_khoan.get("daily_quota"):
+                return None
+            return max(0, int(tai_khoan["daily_quota"]) - self._da_gui.get(email, 0))
+
+    def lay(self, tai_khoan: Dict[str, object]) -> bool:
+        """Giữ một lượt gửi của tài khoản; False nếu tài khoản đã hết hạn mức."""
+        email = str(tai_khoan["email"]).lower()
+        with self._khoa:
+            self._lam_moi_ngay()
+            da_gui = self._da_gui.get(email, 0)
+            if email in self._het or (tai_khoan.get("daily_quota") and da_gui >= int(tai_khoan["daily_quota"])):
+                return False
+            self._da_gui[email] = da_gui + 1
+            return True
+
+    def hoan_lai(self, tai_khoan: Dict[str, object]) -> None:
+        """Trả lại lượt gửi đã giữ cho email không được máy chủ nhận."""
+        email = str(tai_khoan["email"]).lower()
+        with self._khoa:
+            if self._da_gui.get(email, 0) > 0:
+                self._da_gui[email] -= 1
+
+    def danh_dau_het(self, tai_khoan: Dict[str, object]) -> None:
+        """Máy chủ báo tài khoản hết hạn mức: không dùng tài khoản này tới hết ngày."""
+        with self._khoa:
+            self._het.add(str(tai_khoan["email"]).lower())
+
+    def luu(self, ten_file: str) -> None:
+        with self._khoa:
+            du_lieu = {"ngay": self.ngay, "da_gui": dict(self._da_gui), "het": sorted(self._het)}
+        with open(ten_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(du_lieu, f, ensure_ascii=False)
+        os.replace(ten_file + ".tmp", ten_file)
+
+    @classmethod
+    def tu_file(cls, ten_file: str) -> "HanMucGui":
+        try:
+            with open(ten_file, "r", encoding="utf-8") as f:
+                du_lieu = json.load(f)
+            return cls(du_lieu["ngay"], du_lieu["da_gui"], du_lieu.get("het"))
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls()
+
+
+_HAN_MUC_THEO_FILE: Dict[str, Tuple[int, int, HanMucGui]] = {}
+
+
+def tai_han_muc_gui(ten_file_han_muc: str = DEFAULT_QUOTA_FILE) -> HanMucGui:
+    """Đọc hạn mức đã dùng trong ngày, dùng lại bản đã đọc cho tới khi file thay đổi."""
+    duong_dan = os.path.abspath(ten_file_han_muc)
+    try:
+        thong_tin = os.stat(ten_file_han_muc)
+        dau_hieu = (thong_tin.st_mtime_ns, thong_tin.st_size)
+    except OSError:
+        dau_hieu = (0, 0)
+    da_luu = _HAN_MUC_THEO_FILE.get(duong_dan)
+    if da_luu and da_luu[:2] == dau_hieu:
+        return da_luu[2]
+    han_muc = HanMucGui.tu_file(ten_file_han_muc)
+    _HAN_MUC_THEO_FILE[duong_dan] = (*dau_hieu, han_muc)
+    return han_muc
+
+
+def _luu_han_muc_gui(han_muc: HanMucGui, ten_file_han_muc: str) -> None:
+    """Ghi hạn mức đã dùng và cập nhật cache để lần đọc sau không phải đọc lại file."""
+    try:
+        han_muc.luu(ten_file_han_muc)
+        thong_tin = os.stat(ten_file_han_muc)
+        _HAN_MUC_THEO_FILE[os.path.abspath(ten_file_han_muc)] = (thong_tin.st_mtime_ns, thong_tin.st_size, han_muc)
+    except OSError as e:
+        print(f"Cảnh báo: Không ghi được hạn mức gửi {ten_file_han_muc}: {e}")
+
+
+class KenhSendmail:
+    """
+    Kênh gửi qua chương trình sendmail cục bộ (Postfix, Exim, msmtp, ...): mỗi thư một lần gọi.
+
+    Có các hàm sendmail/quit/close như smtplib.SMTP nên dùng được thay cho kết nối SMTP.
+    Mã thoát SENDMAIL_TEMPFAIL được báo như lỗi tạm thời 451 để thư được gửi lại sau.
+    """
+
+    def __init__(self, duong_dan_sendmail: str = SENDMAIL_DEFAULT_PATH) -> None:
+        if not os.path.isfile(duong_dan_sendmail):
+            raise FileNotFoundError(f"Không tìm thấy chương trình sendmail: {duong_dan_sendmail}")
+        self.duong_dan_sendmail = duong_dan_sendmail
+
+    def sendmail(self, email_gui: str, cac_nguoi_nhan: List[str], thu: bytes) -> Dict:
+        # -i: dòng chỉ có "." không kết thúc thư; sendmail nhận thư với dòng kết thúc LF
+        tien_trinh = subprocess.run(
+            [self.duong_dan_sendmail, "-i", "-f", email_gui, "--", *cac_nguoi_nhan],
+            input=thu.replace(b"\r\n", b"\n"),
+            capture_output=True,
+            timeout=SMTP_SEND_TIMEOUT,
+        )
+        if tien_trinh.returncode != 0:
+            loi = tien_trinh.stderr.strip() or f"sendmail thoát với mã {tien_trinh.returncode}".encode("utf-8")
+            raise smtplib.SMTPDataError(451 if tien_trinh.returncode == SENDMAIL_TEMPFAIL else 554, loi)
+        return {}
+
+    def quit(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+_KHOA_MBOX: Dict[str, threading.Lock] = {}
+_KHOA_TAO_KHOA_MBOX = threading.Lock()
+
+
+class KenhTepThu:
+    """
+    Kênh "gửi" bằng cách ghi thư ra đĩa: mỗi thư một file .eml, một thư mục maildir, hoặc
+    một file mbox mỗi tháng (trong thư mục thu_muc).
 
-    Args:
-        ngay_nhap: Ngày cần kiểm tra (ví dụ: 2).
-        gio_nhap_str: Giờ vào làm chuẩn dạng chuỗi (ví dụ: "18:00").
-        ten_file_excel: Tên file Excel chứa dữ liệu điểm danh.
+    Dùng để chạy thử, lưu trữ cả lô email, hoặc tạo sẵn thư để chuyển cho một relay.
+    Có các hàm sendmail/quit/close như smtplib.SMTP nên dùng được thay cho kết nối SMTP.
+    """
 
-    Returns:
-        Một dictionary chứa hai danh sách: 'di_muon' và 'vang'.
-        Giá trị trong 'vang' có thể chứa thông báo lỗi nếu file/ngày không tìm thấy.
+    def __init__(self, thu_muc: str = DEFAULT_FILE_OUTPUT_DIR, dinh_dang: str = DINH_DANG_EML) -> None:
+        self.thu_muc = thu_muc
+        self.dinh_dang = dinh_dang
+        if dinh_dang == DINH_DANG_MAILDIR:
+            for thu_muc_con in ("tmp", "new", "cur"):
+                os.makedirs(os.path.join(thu_muc, thu_muc_con), exist_ok=True)
+        else:
+            os.makedirs(thu_muc, exist_ok=True)
+
+    def sendmail(self, email_gui: str, cac_nguoi_nhan: List[str], thu: bytes) -> Dict:
+        bay_gio = datetime.now()
+        ten = f"{bay_gio:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:16]}"
+        if self.dinh_dang == DINH_DANG_EML:
+            with open(os.path.join(self.thu_muc, ten + ".eml"), "xb") as f:
+                f.write(thu)
+        elif self.dinh_dang == DINH_DANG_MAILDIR:
+            # Ghi vào tmp/ rồi đổi tên sang new/ để không ai đọc được thư ghi dở
+            tam = os.path.join(self.thu_muc, "tmp", ten)
+            with open(tam, "xb") as f:
+                f.write(thu.replace(b"\r\n", b"\n"))
+            os.replace(tam, os.path.join(self.thu_muc, "new", ten))
+        else:
+            duong_dan = os.path.join(self.thu_muc, f"{bay_gio:%Y-%m}.mbox")
+            # Dòng bắt đầu bằng "From " trong thư được thoát thành ">From " (mboxrd)
+            noi_dung = re.sub(rb"(?m)^(>*From )", rb">\1", thu.replace(b"\r\n", b"\n"))
+            dau = f"From {email_gui} {bay_gio:%a %b %d %H:%M:%S %Y}\n".encode("utf-8")
+            with _KHOA_TAO_KHOA_MBOX:
+                khoa = _KHOA_MBOX.setdefault(os.path.abspath(duong_dan), threading.Lock())
+            with khoa, open(duong_dan, "ab") as f:
+                f.write(dau + noi_dung.rstrip(b"\n") + b"\n\n")
+        return {}
+
+    def quit(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def _mo_ket_noi_smtp(cau_hinh: Dict[str, object]) -> smtplib.SMTP:
     """
+    Mở một kết nối gửi theo cau_hinh['transport']: kết nối SMTP đã bật TLS và đăng nhập,
+    hoặc KenhSendmail / KenhTepThu (có cùng các hàm sendmail/quit/close).
+    """
+    if cau_hinh.get("transport") == KENH_SENDMAIL:
+        return KenhSendmail(cau_hinh["sendmail_path"])
+    if cau_hinh.get("transport") == KENH_FILE:
+        return KenhTepThu(cau_hinh["output_path"], cau_hinh["file_format"])
+    server = smtplib.SMTP(cau_hinh["server"], cau_hinh["port"], timeout=30) # Thêm timeout
     try:
-        # Đọc file Excel, không dùng header mặc định vì cấu trúc phức tạp
-        df = pd.read_excel(ten_file_excel, header=None)
-    except FileNotFoundError:
-        return {"di_muon": [], "vang": [f"Lỗi: Không tìm thấy file: {ten_file_excel}"]}
-    except Exception as e:
-        return {"di_muon": [], "vang": [f"Lỗi khi đọc file Excel: {e}"]}
+        server.ehlo() # Chào hỏi server
+        if cau_hinh.get("starttls", True):
+            server.starttls() # Bắt đầu mã hóa TLS
+            server.ehlo() # Chào hỏi lại sau TLS
+        server.login(cau_hinh["email"], cau_hinh["password"])
+    except Exception:
+        server.close()
+        raise
+    return server
 
-    danh_sach_di_muon: List[str] = []
-    danh_sach_vang: List[str] = []
 
+def _mo_lai_ket_noi_smtp(cau_hinh: Dict[str, object], server_cu: Optional[smtplib.SMTP] = None) -> smtplib.SMTP:
+    """
+    Mở lại kết nối SMTP sau khi bị ngắt, chờ tăng dần theo cấp số nhân giữa các lần thử.
+
+    Thử tối đa SMTP_RECONNECT_ATTEMPTS lần, lần đầu chờ SMTP_RECONNECT_BASE_DELAY giây.
+    Lỗi xác thực không được thử lại. Ném ra lỗi của lần thử cuối nếu tất cả đều thất bại.
+    """
+    if server_cu is not None:
+        server_cu.close()
+    thoi_gian_cho = SMTP_RECONNECT_BASE_DELAY
+    for lan_thu in range(1, SMTP_RECONNECT_ATTEMPTS + 1):
+        sleep(thoi_gian_cho)
+        try:
+            server = _mo_ket_noi_smtp(cau_hinh)
+            print(f"Đã kết nối lại SMTP sau {lan_thu} lần thử.")
+            return server
+        except smtplib.SMTPAuthenticationError:
+            raise
+        except Exception as e:
+            print(f"Cảnh báo: Kết nối lại SMTP lần {lan_thu} thất bại: {e}")
+            if lan_thu == SMTP_RECONNECT_ATTEMPTS:
+                raise
+        thoi_gian_cho *= 2
+    raise smtplib.SMTPServerDisconnected("Không thể kết nối lại SMTP")
+
+
+def _dong_ket_noi_smtp(server: smtplib.SMTP) -> None:
+    """Đóng kết nối SMTP, bỏ qua lỗi nếu kết nối đã hỏng."""
     try:
-        # Chuyển đổi giờ chuẩn sang đối tượng time một lần duy nhất
-        gio_so_sanh: time = datetime.strptime(gio_nhap_str, '%H:%M').time()
-    except ValueError:
-        return {"di_muon": [], "vang": [f"Lỗi: Định dạng giờ nhập vào không hợp lệ: {gio_nhap_str}"]}
+        server.quit()
+    except Exception as e:
+        print(f"Lỗi khi đóng kết nối SMTP: {e}")
+        server.close()
+
+
+def _trang_thai_loi_ket_noi(e: Exception, cau_hinh: Dict[str, object]) -> str:
+    """Chuyển lỗi khi mở kết nối SMTP thành trạng thái gửi cho các email chưa gửi được."""
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        print(f"Lỗi: Xác thực SMTP thất bại cho {cau_hinh['email']}. Kiểm tra EMAIL_ADDRESS và EMAIL_PASSWORD.")
+        return "Lỗi: Xác thực SMTP thất bại"
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        print("Lỗi: Mất kết nối đến máy chủ SMTP.")
+        return "Lỗi: Mất kết nối SMTP"
+    if isinstance(e, ConnectionRefusedError):
+        print(f"Lỗi: Kết nối đến {cau_hinh['server']}:{cau_hinh['port']} bị từ chối. Kiểm tra địa chỉ/port và tường lửa.")
+        return "Lỗi: Kết nối SMTP bị từ chối"
+    if isinstance(e, FileNotFoundError):
+        print(f"Lỗi: {e}. Kiểm tra SENDMAIL_PATH.")
+        return f"Lỗi: {e}"
+    print(f"Lỗi kết nối SMTP hoặc lỗi không xác định khác: {str(e)}")
+    return f"Lỗi SMTP chung: {str(e)}"
+
+
+class BoDieuTietTocDo:
+    """
+    Token bucket điều chỉnh tốc độ gửi theo phản hồi của máy chủ (tăng cộng, giảm nhân).
 
-    # --- Tìm cột ngày và cột 'In' ---
-    cot_ngay: Optional[int] = None
-    ngay_str = str(ngay_nhap) # Chuyển ngày sang chuỗi để so sánh
+    Mỗi email lấy một token. Khi nhận mã tạm thời trong SMTP_THROTTLE_CODES, tốc độ giảm
+    một nửa; sau mỗi chuỗi gửi thành công liên tiếp, tốc độ tăng dần trở lại tới toc_do_toi_da.
+    Dùng chung được giữa nhiều thread.
+    """
 
-    if HEADER_ROW_INDEX >= df.shape[0]:
-         return {"di_muon": [], "vang": [f"Lỗi: File Excel không có hàng tiêu đề ngày (hàng index {HEADER_ROW_INDEX})."]}
-
-    # Tìm cột chứa ngày nhập trên hàng HEADER_ROW_INDEX
-    for col_idx in range(df.shape[1]):
-        # Thêm kiểm tra pd.notna để tránh lỗi nếu ô bị trống
-        cell_value = df.iloc[HEADER_ROW_INDEX, col_idx]
-        if pd.notna(cell_value) and str(cell_value).strip() == ngay_str:
-            cot_ngay = col_idx
-            break
+    def __init__(
+        self,
+        toc_do: float = SMTP_DEFAULT_RATE,
+        toc_do_toi_thieu: float = SMTP_MIN_RATE,
+        toc_do_toi_da: float = SMTP_MAX_RATE
+    ) -> None:
+        self.toc_do_toi_thieu = toc_do_toi_thieu
+        self.toc_do_toi_da = toc_do_toi_da
+        self.toc_do = min(max(toc_do, toc_do_toi_thieu), toc_do_toi_da)
+        self._token = 1.0
+        self._cap_nhat_luc = monotonic()
+        self._thanh_cong_lien_tiep = 0
+        self._giam_toc_luc = float("-inf")
+        self._khoa = threading.Lock()
+
+    def dat_cho(self) -> float:
+        """Giữ chỗ một token; trả về số giây người gọi phải chờ trước khi gửi (0 nếu gửi ngay)."""
+        with self._khoa:
+            bay_gio = monotonic()
+            # Bucket chứa tối đa 1 giây lưu lượng để không gửi dồn một loạt sau khi rảnh
+            self._token = min(max(1.0, self.toc_do), self._token + (bay_gio - self._cap_nhat_luc) * self.toc_do)
+            self._cap_nhat_luc = bay_gio
+            self._token -= 1.0
+            return 0.0 if self._token >= 0 else -self._token / self.toc_do
+
+    def cho(self) -> None:
+        """Chờ (blocking) tới lượt gửi email tiếp theo."""
+        thoi_gian = self.dat_cho()
+        if thoi_gian > 0:
+            sleep(thoi_gian)
+
+    def bao_thanh_cong(self) -> None:
+        """Ghi nhận một email gửi thành công; tăng tốc sau mỗi chuỗi thành công đủ dài."""
+        with self._khoa:
+            self._thanh_cong_lien_tiep += 1
+            if self._thanh_cong_lien_tiep >= max(1, int(self.toc_do)):
+                self._thanh_cong_lien_tiep = 0
+                self.toc_do = min(self.toc_do_toi_da, self.toc_do + 1.0)
+
+    def bao_bi_gioi_han(self) -> None:
+        """Ghi nhận máy chủ yêu cầu giảm tốc: giảm một nửa tốc độ và bỏ các token đang tích lũy."""
+        with self._khoa:
+            self._thanh_cong_lien_tiep = 0
+            bay_gio = monotonic()
+            if bay_gio - self._giam_toc_luc < 1.0:
+                return # Các lỗi cùng một đợt gửi dồn chỉ tính là một lần giảm tốc
+            self._giam_toc_luc = bay_gio
+            self.toc_do = max(self.toc_do_toi_thieu, self.toc_do / 2)
+            self._token = min(self._token, 0.0)
+            print(f"Cảnh báo: Máy chủ SMTP yêu cầu giảm tốc. Tốc độ gửi mới: {self.toc_do:.1f} email/giây.")
+
+
+def _tao_bo_dieu_tiet(cau_hinh: Dict[str, object]) -> Optional[BoDieuTietTocDo]:
+    """Bộ điều tiết tốc độ cho tài khoản gửi qua SMTP (giới hạn thêm bởi 'minute_quota'); None cho kênh khác."""
+    if cau_hinh.get("transport", KENH_SMTP) != KENH_SMTP:
+        return None
+    toc_do_toi_da = SMTP_MAX_RATE
+    if cau_hinh.get("minute_quota"):
+        toc_do_toi_da = min(toc_do_toi_da, int(cau_hinh["minute_quota"]) / 60)
+    return BoDieuTietTocDo(cau_hinh["rate"], min(SMTP_MIN_RATE, toc_do_toi_da), toc_do_toi_da)
+
+
+def _ma_loi_tam_thoi(e: Exception) -> Optional[int]:
+    """Trả về mã SMTP nếu lỗi là lỗi tạm thời do bị giới hạn tốc độ (SMTP_THROTTLE_CODES), ngược lại None."""
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        cac_ma = {ma for ma, _ in e.recipients.values()}
+        if cac_ma and cac_ma <= set(SMTP_THROTTLE_CODES):
+            return min(cac_ma)
+        return None
+    if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code in SMTP_THROTTLE_CODES:
+        return e.smtp_code
+    return None
+
+
+def _la_loi_het_han_muc(e: Exception) -> bool:
+    """Lỗi cho biết tài khoản gửi đã hết hạn mức (ví dụ Gmail: 550 5.4.5 Daily user sending limit exceeded)."""
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        cac_loi = [loi for _, loi in e.recipients.values()]
+    elif isinstance(e, smtplib.SMTPResponseException):
+        cac_loi = [e.smtp_error]
+    else:
+        return False
+    for loi in cac_loi:
+        loi = (loi if isinstance(loi, bytes) else str(loi).encode("utf-8", "replace")).lower()
+        if any(dau_hieu in loi for dau_hieu in SMTP_QUOTA_MARKERS):
+            return True
+    return False
+
+
+def tao_html_email(noi_dung: str, co_logo: bool = True) -> str:
+    """
+    Chuyển nội dung email dạng văn bản sang HTML đơn giản để gửi kèm phần plain-text.
 
-    if cot_ngay is None:
-        return {"di_muon": [], "vang": [f"Không tìm thấy ngày {ngay_nhap} trên hàng {HEADER_ROW_INDEX + 1} trong file."]}
-
-    # Xác định cột 'In' (giả định nó nằm ngay sau cột ngày)
-    cot_in = cot_ngay + 1
-    if cot_in >= df.shape[1]:
-         return {"di_muon": [], "vang": [f"Lỗi: Không tìm thấy cột 'In' dự kiến tại index {cot_in} sau cột ngày {ngay_nhap}."]}
-
-    # --- Lặp qua các hàng dữ liệu nhân viên ---
-    row_idx = DATA_START_ROW_INDEX
-    while row_idx < df.shape[0]:
-        # Lấy tên nhân viên (kiểm tra ô tên không rỗng)
-        ten_nhan_vien_raw = df.iloc[row_idx, NAME_COLUMN_INDEX]
-        if pd.isna(ten_nhan_vien_raw) or str(ten_nhan_vien_raw).strip() == "":
-             # Bỏ qua hàng nếu không có tên nhân viên, có thể là dòng trống hoặc cuối file
-             row_idx += ROW_INCREMENT
-             continue
-        ten_nhan_vien = str(ten_nhan_vien_raw).strip()
-
-        # Kiểm tra giá trị ở cột 'In'
-        # Đảm bảo row_idx và cot_in nằm trong giới hạn của DataFrame
-        if row_idx < df.shape[0] and cot_in < df.shape[1]:
-            gio_vao_cell = df.iloc[row_idx, cot_in]
-
-            if pd.notna(gio_vao_cell):
-                try:
-                    # Xử lý cả kiểu datetime và string
-                    if isinstance(gio_vao_cell, (datetime, time)):
-                        gio_vao = gio_vao_cell.time() # Lấy phần time nếu là datetime
-                    else:
-                        # Chuyển đổi chuỗi sang time, loại bỏ khoảng trắng thừa
-                        gio_vao_str = str(gio_vao_cell).strip()
-                        gio_vao = datetime.strptime(gio_vao_str, '%H:%M').time()
+    Mỗi đoạn (cách nhau bởi dòng trống) thành một thẻ <p>; logo CLB (nếu có) được
+    nhúng ở đầu thư qua Content-ID LOGO_CONTENT_ID.
+    """
+    cac_doan = [
+        "<p>" + html.escape(doan).replace("\n", "<br>\n") + "</p>"
+        for doan in re.split(r"\n\s*\n", noi_dung.strip()) if doan.strip()
+    ]
+    logo = f'<p><img src="cid:{LOGO_CONTENT_ID}" alt="Logo CLB" style="max-height:80px"></p>\n' if co_logo else ""
+    return (
+        '<!DOCTYPE html>\n<html><head><meta charset="utf-8"></head>\n'
+        '<body style="font-family:Arial,sans-serif;font-size:14px;line-height:1.5">\n'
+        + logo + "\n".join(cac_doan) + "\n</body></html>\n"
+    )
 
-                    # So sánh giờ vào với giờ chuẩn
-                    if gio_vao > gio_so_sanh:
-                        danh_sach_di_muon.append(ten_nhan_vien)
 
-                except ValueError:
-                    # Ghi nhận lỗi nếu không thể phân tích cú pháp giờ
-                    print(f"Cảnh báo: Không thể phân tích giờ '{gio_vao_cell}' cho {ten_nhan_vien} ở hàng {row_idx + 1}. Bỏ qua.")
-                except Exception as e:
-                     print(f"Cảnh báo: Lỗi không xác định khi xử lý giờ cho {ten_nhan_vien} ở hàng {row_idx + 1}: {e}. Bỏ qua.")
+def _base64_crlf(du_lieu: bytes) -> bytes:
+    """Mã hóa base64 theo dòng 76 ký tự, kết thúc dòng CRLF."""
+    return base64.encodebytes(du_lieu).replace(b"\n", b"\r\n")
 
-            else: # Nếu ô giờ vào là NaN/trống
-                danh_sach_vang.append(ten_nhan_vien)
-        else:
-            # Nếu chỉ số hàng hoặc cột 'In' nằm ngoài giới hạn (ví dụ: cuối file)
-            print(f"Cảnh báo: Đã đến cuối file hoặc cấu trúc bất thường tại hàng {row_idx + 1} cho {ten_nhan_vien}.")
-            # Quyết định dừng hoặc tiếp tục tùy theo logic mong muốn
-            # break # Dừng nếu muốn kết thúc khi gặp bất thường
 
-        # Chuyển đến mục nhập của nhân viên tiếp theo
-        row_idx += ROW_INCREMENT
+@functools.lru_cache(maxsize=16)
+def _ma_hoa_tep_dinh_kem(duong_dan: str, mtime_ns: int, kich_thuoc: int) -> bytes:
+    """Đọc và mã hóa base64 một file đính kèm; chỉ làm lại khi file thay đổi (mtime/kích thước)."""
+    with open(duong_dan, "rb") as f:
+        return _base64_crlf(f.read())
 
-    return {"di_muon": danh_sach_di_muon, "vang": danh_sach_vang}
 
+def _tep_dinh_kem_da_ma_hoa(duong_dan: str) -> bytes:
+    thong_tin = os.stat(duong_dan)
+    return _ma_hoa_tep_dinh_kem(os.path.abspath(duong_dan), thong_tin.st_mtime_ns, thong_tin.st_size)
 
-def loai_bo_nguoi_nghi_phep(
-    danh_sach_vang: List[str],
-    ten_file_leave_requests: str = DEFAULT_LEAVE_REQUESTS_FILE
-) -> List[str]:
+
+class NhaMayThu:
     """
-    Loại bỏ những người đã xin nghỉ phép khỏi danh sách vắng.
+    Tạo nhanh bytes MIME cho cả một lô email cùng người gửi, tiêu đề và file đính kèm.
 
-    Args:
-        danh_sach_vang: Danh sách tên những người được đánh giá là vắng.
-        ten_file_leave_requests: Tên file chứa danh sách người xin nghỉ phép.
+    Mỗi thư gồm phần plain-text và HTML (multipart/alternative), logo CLB nhúng trong thư
+    (multipart/related) và các file PDF đính kèm (multipart/mixed). Phần header chung,
+    logo và file đính kèm được mã hóa base64 một lần cho cả lô và dùng lại (theo tham
+    chiếu) cho mọi người nhận; mỗi thư chỉ cần mã hóa header To và hai phần nội dung.
+    """
+
+    def __init__(
+        self,
+        email_gui: str,
+        tieu_de: str,
+        logo: Optional[str] = DEFAULT_LOGO_FILE,
+        tep_dinh_kem: Optional[List[str]] = None
+    ) -> None:
+        self.email_gui = email_gui
+        self.tieu_de = tieu_de
+        if logo and not os.path.exists(logo):
+            print(f"Cảnh báo: Không tìm thấy logo {logo}. Gửi email không kèm logo.")
+            logo = None
+        self.co_logo = bool(logo)
+        ma = uuid.uuid4().hex
+        ranh_gioi_mixed = f"===============mixed{ma}=="
+        ranh_gioi_related = f"===============related{ma}=="
+        ranh_gioi_alt = f"===============alt{ma}=="
+        tieu_de_ma_hoa = Header(tieu_de, "utf-8").encode().replace("\n", "\r\n")
+
+        # Header thư, phần trước nội dung plain-text
+        dau = [
+            f'Content-Type: multipart/mixed; boundary="{ranh_gioi_mixed}"\r\n'
+            f"MIME-Version: 1.0\r\n"
+            f"From: {email_gui}\r\n"
+            f"To: "
+        ]
+        sau_nguoi_nhan = [f"\r\nSubject: {tieu_de_ma_hoa}\r\n\r\n--{ranh_gioi_mixed}\r\n"]
+        if self.co_logo:
+            sau_nguoi_nhan.append(
+                f'Content-Type: multipart/related; boundary="{ranh_gioi_related}"\r\n\r\n'
+                f"--{ranh_gioi_related}\r\n"
+            )
+        sau_nguoi_nhan.append(
+            f'Content-Type: multipart/alternative; boundary="{ranh_gioi_alt}"\r\n\r\n'
+            f"--{ranh_gioi_alt}\r\n"
+            f'Content-Type: text/plain; charset="utf-8"\r\n'
+            f"Content-Transfer-Encoding: base64\r\n\r\n"
+        )
+        self._dau_thu = "".join(dau).encode("ascii")
+        self._truoc_plain = "".join(sau_nguoi_nhan).encode("ascii")
+        self._truoc_html = (
+            f"\r\n--{ranh_gioi_alt}\r\n"
+            f'Content-Type: text/html; charset="utf-8"\r\n'
+            f"Content-Transfer-Encoding: base64\r\n\r\n"
+        ).encode("ascii")
+
+        # Phần chung sau nội dung HTML: logo và file đính kèm, mã hóa một lần cho cả lô
+        cuoi = [f"\r\n--{ranh_gioi_alt}--\r\n".encode("ascii")]
+        if self.co_logo:
+            cuoi.append((
+                f"\r\n--{ranh_gioi_related}\r\n"
+                f"Content-Type: image/jpeg\r\n"
+                f"Content-Transfer-Encoding: base64\r\n"
+                f"Content-ID: <{LOGO_CONTENT_ID}>\r\n"
+                f'Content-Disposition: inline; filename="{os.path.basename(logo)}"\r\n\r\n'
+            ).encode("ascii"))
+            cuoi.append(_tep_dinh_kem_da_ma_hoa(logo))
+            cuoi.append(f"\r\n--{ranh_gioi_related}--\r\n".encode("ascii"))
+        for duong_dan in tep_dinh_kem or []:
+            try:
+                du_lieu = _tep_dinh_kem_da_ma_hoa(duong_dan)
+            except OSError as e:
+                print(f"Cảnh báo: Không đọc được file đính kèm {duong_dan}: {e}. Bỏ qua.")
+                continue
+            ten_file = os.path.basename(duong_dan)
+            # Tên file có dấu được mã hóa theo RFC 2231
+            ten_file = f'filename="{ten_file}"' if ten_file.isascii() else f"filename*=utf-8''{quote(ten_file)}"
+            cuoi.append((
+                f"\r\n--{ranh_gioi_mixed}\r\n"
+                f"Content-Type: application/pdf\r\n"
+                f"Content-Transfer-Encoding: base64\r\n"
+                f"Content-Disposition: attachment; {ten_file}\r\n\r\n"
+            ).encode("ascii"))
+            cuoi.append(du_lieu)
+        cuoi.append(f"\r\n--{ranh_gioi_mixed}--\r\n".encode("ascii"))
+        self._cuoi_thu = b"".join(cuoi)
+
+    def tao_thu(self, email_nhan: str, noi_dung: str) -> bytes:
+        """Tạo bytes của thư gửi tới email_nhan, sẵn sàng cho server.sendmail."""
+        nguoi_nhan = email_nhan if email_nhan.isascii() else Header(email_nhan, "utf-8").encode()
+        return b"".join((
+            self._dau_thu,
+            nguoi_nhan.encode("ascii"),
+            self._truoc_plain,
+            _base64_crlf(noi_dung.encode("utf-8")),
+            self._truoc_html,
+            _base64_crlf(tao_html_email(noi_dung, self.co_logo).encode("utf-8")),
+            self._cuoi_thu,
+        ))
+
+
+def _gui_mot_email(server: smtplib.SMTP, nha_may: NhaMayThu, email_nhan: str, noi_dung: str) -> str:
+    """
+    Gửi một email qua kết nối đã mở.
 
     Returns:
-        Danh sách vắng sau khi lọc.
+        "Thành công" hoặc "Lỗi: ...". Lỗi mất kết nối, lỗi tạm thời do bị giới hạn
+        tốc độ (xem _ma_loi_tam_thoi) và lỗi hết hạn mức (_la_loi_het_han_muc) được ném
+        ra để luồng gửi xử lý.
     """
     try:
-        with open(ten_file_leave_requests, "r", encoding="utf-8") as file:
-            # Đọc và loại bỏ khoảng trắng, chuyển thành set để tối ưu việc kiểm tra
-            nguoi_nghi_phep: Set[str] = {line.strip() for line in file if line.strip()}
-    except FileNotFoundError:
-        print(f"Cảnh báo: Không tìm thấy file nghỉ phép {ten_file_leave_requests}. Sẽ không loại trừ ai.")
-        return danh_sach_vang
+        # Gửi thẳng bytes đã dựng sẵn, không cần flatten lại thư
+        server.sendmail(nha_may.email_gui, [email_nhan], nha_may.tao_thu(email_nhan, noi_dung))
+        print(f"Đã gửi email thành công tới: {email_nhan}")
+        return TRANG_THAI_THANH_CONG
+
+    except smtplib.SMTPServerDisconnected:
+        raise
+    except smtplib.SMTPRecipientsRefused as e:
+        if _ma_loi_tam_thoi(e) is not None or _la_loi_het_han_muc(e):
+            raise
+        error_msg = "Địa chỉ người nhận bị từ chối."
     except Exception as e:
-         print(f"Lỗi khi đọc file nghỉ phép {ten_file_leave_requests}: {e}. Sẽ không loại trừ ai.")
-         return danh_sach_vang
+        if _ma_loi_tam_thoi(e) is not None or _la_loi_het_han_muc(e):
+            raise
+        error_msg = str(e)
+    print(f"Lỗi khi gửi email tới {email_nhan}: {error_msg}")
+    return f"Lỗi: {error_msg}"
 
-    # Sử dụng list comprehension và kiểm tra trong set (nhanh hơn list)
-    danh_sach_vang_sau_loc = [
-        ten for ten in danh_sach_vang if ten not in nguoi_nghi_phep
-    ]
-    return danh_sach_vang_sau_loc
 
+class HangDoiGui:
+    """
+    Hàng đợi giữa bước tạo nội dung và các worker gửi email.
 
-def tao_noi_dung_email(
-    danh_sach_vang: List[str],
-    danh_sach_di_muon: List[str],
-    ten_file_emails: str = DEFAULT_EMAILS_FILE,
-    ten_file_mau: str = DEFAULT_EMAIL_TEMPLATE_FILE
-) -> Dict[str, str]:
+    Email mới được giữ tối đa kich_thuoc phần tử (0: không giới hạn); dua_vao chờ khi hàng
+    đợi đầy, nên bộ nhớ không phụ thuộc số email của cả lô. Email bị trả lại (máy chủ tạm
+    từ chối, mất kết nối) được lấy ra trước và không tính vào giới hạn. Worker chỉ dừng khi
+    nguồn đã đóng, hàng đợi rỗng và không còn email nào đang gửi dở.
     """
-    Tạo nội dung email cá nhân hóa cho người vi phạm.
 
-    Args:
-        danh_sach_vang: Danh sách người vắng.
-        danh_sach_di_muon: Danh sách người đi muộn.
-        ten_file_emails: Tên file CSV chứa thông tin email (cột 'ten', 'email').
-        ten_file_mau: Tên file chứa mẫu email.
+    def __init__(self, kich_thuoc: int = 0, so_worker: int = 1) -> None:
+        self._dieu_kien = threading.Condition()
+        self._moi: Deque[Tuple[str, str, int]] = deque()
+        self._tra_lai: Deque[Tuple[str, str, int]] = deque()
+        self._kich_thuoc = kich_thuoc
+        self._dang_gui = 0
+        self._da_dong = False
+        self._so_worker = so_worker
+        self.loi_ket_noi: Optional[str] = None
+
+    def dua_vao(self, email_nhan: str, noi_dung: str) -> bool:
+        """Đưa một email mới vào hàng đợi, chờ nếu đầy. False nếu không còn worker nào để gửi."""
+        with self._dieu_kien:
+            self._dieu_kien.wait_for(
+                lambda: not self._so_worker or not self._kich_thuoc or len(self._moi) < self._kich_thuoc
+            )
+            if not self._so_worker:
+                return False
+            self._moi.append((email_nhan, noi_dung, 0))
+            self._dieu_kien.notify_all()
+            return True
+
+    def dong(self) -> None:
+        """Báo đã hết email mới."""
+        with self._dieu_kien:
+            self._da_dong = True
+            self._dieu_kien.notify_all()
+
+    def lay(self) -> Optional[Tuple[str, str, int]]:
+        """Lấy (email, nội dung, số lần đã bị trả lại) tiếp theo; None khi đã gửi hết."""
+        with self._dieu_kien:
+            while True:
+                if self._tra_lai:
+                    phan_tu = self._tra_lai.popleft()
+                elif self._moi:
+                    phan_tu = self._moi.popleft()
+                elif self._da_dong and not self._dang_gui:
+                    return None
+                else:
+                    self._dieu_kien.wait()
+                    continue
+                self._dang_gui += 1
+                self._dieu_kien.notify_all()
+                return phan_tu
+
+    def xong(self, tra_lai: Optional[Tuple[str, str, int]] = None) -> None:
+        """Kết thúc email vừa lấy; tra_lai (nếu có) được đưa lại vào hàng đợi để gửi lại."""
+        with self._dieu_kien:
+            self._dang_gui -= 1
+            if tra_lai is not None:
+                self._tra_lai.append(tra_lai)
+            self._dieu_kien.notify_all()
+
+    def worker_dung(self, loi: Optional[str]) -> List[Tuple[str, str, int]]:
+        """
+        Ghi nhận một worker đã dừng (loi: trạng thái lỗi kết nối nếu có).
+
+        Returns:
+            Các email còn trong hàng đợi nếu đây là worker cuối cùng, để đánh dấu lỗi.
+        """
+        with self._dieu_kien:
+            self._so_worker -= 1
+            if loi:
+                self.loi_ket_noi = loi
+            self._dieu_kien.notify_all()
+            if self._so_worker:
+                return []
+            con_lai = list(self._tra_lai) + list(self._moi)
+            self._tra_lai.clear()
+            self._moi.clear()
+            return con_lai
+
+
+def _luong_gui_email(
+    cau_hinh: Dict[str, object],
+    hang_doi: HangDoiGui,
+    ket_qua: Dict[str, Optional[str]],
+    nha_may: NhaMayThu,
+    bo_dieu_tiet: Optional[BoDieuTietTocDo],
+    khi_co_ket_qua: Optional[Callable[[str, str], None]] = None,
+    han_muc: Optional[HanMucGui] = None
+) -> Optional[str]:
+    """
+    Một worker của pool: giữ một kết nối SMTP đã đăng nhập và gửi lần lượt các email lấy từ hàng đợi.
+
+    Email bị máy chủ tạm thời từ chối do gửi quá nhanh, hoặc đang gửi dở khi mất kết nối,
+    được trả lại hàng đợi (tối đa SMTP_MAX_REQUEUE lần). Khi mất kết nối, worker kết nối
+    lại (_mo_lai_ket_noi_smtp) rồi tiếp tục với phần còn lại của hàng đợi.
+
+    Nếu có han_muc, mỗi email giữ một lượt gửi của tài khoản; khi tài khoản hết hạn mức
+    (theo cấu hình hoặc do máy chủ báo), email được trả lại hàng đợi cho tài khoản khác
+    và worker dừng.
+
+    khi_co_ket_qua (nếu có) được gọi ngay khi một email có trạng thái cuối cùng.
 
     Returns:
-        Dictionary với key là email người nhận, value là nội dung email.
+        None nếu worker gửi hết hàng đợi, hoặc trạng thái lỗi nếu worker không thể kết nối
+        lại hay tài khoản hết hạn mức (các email còn lại trong hàng đợi sẽ do worker khác gửi).
     """
-    # Đọc file mẫu email
+    het_han_muc = f"Lỗi: Tài khoản {cau_hinh['email']} đã hết hạn mức gửi trong ngày"
     try:
-        with open(ten_file_mau, "r", encoding="utf-8") as f:
-            mau_email_base = f.read()
-    except FileNotFoundError:
-        print(f"Lỗi: Không tìm thấy file mẫu email: {ten_file_mau}")
-        return {}
+        server = _mo_ket_noi_smtp(cau_hinh)
     except Exception as e:
-        print(f"Lỗi khi đọc file mẫu email: {e}")
-        return {}
+        return _trang_thai_loi_ket_noi(e, cau_hinh)
 
-    # Đọc danh sách email và tạo map để truy cập nhanh
     try:
-        df_emails = pd.read_csv(ten_file_emails)
-        # Kiểm tra cột cần thiết có tồn tại không
-        if 'ten' not in df_emails.columns or 'email' not in df_emails.columns:
-            print(f"Lỗi: File {ten_file_emails} phải chứa cột 'ten' và 'email'.")
-            return {}
-        # Tạo dictionary từ tên sang email, xử lý tên trùng lặp (lấy email đầu tiên)
-        email_map = pd.Series(df_emails.email.values, index=df_emails.ten).to_dict()
-    except FileNotFoundError:
-        print(f"Lỗi: Không tìm thấy file emails: {ten_file_emails}")
-        return {}
-    except Exception as e:
-        print(f"Lỗi khi đọc file emails {ten_file_emails}: {e}")
+        while True:
+            phan_tu = hang_doi.lay()
+            if phan_tu is None:
+                return None
+            email_nhan, noi_dung, so_lan_tra_lai = phan_tu
+            if han_muc is not None and not han_muc.lay(cau_hinh):
+                hang_doi.xong(phan_tu)
+                return het_han_muc
+            if bo_dieu_tiet is not None:
+                bo_dieu_tiet.cho()
+            try:
+                ket_qua[email_nhan] = _gui_mot_email(server, nha_may, email_nhan, noi_dung)
+                if bo_dieu_tiet is not None:
+                    bo_dieu_tiet.bao_thanh_cong()
+                hang_doi.xong()
+                if khi_co_ket_qua:
+                    khi_co_ket_qua(email_nhan, ket_qua[email_nhan])
+                continue
+            except smtplib.SMTPServerDisconnected as e:
+                print(f"Cảnh báo: Mất kết nối SMTP khi gửi tới {email_nhan}: {e}. Đang kết nối lại...")
+                ma_loi: Optional[int] = None
+                can_ket_noi_lai = True
+                ly_do = f"Mất kết nối SMTP ({e})"
+            except smtplib.SMTPException as e:
+                if _la_loi_het_han_muc(e):
+                    print(f"Cảnh báo: Máy chủ báo tài khoản {cau_hinh['email']} hết hạn mức gửi: {e}. Chuyển sang tài khoản khác.")
+                    if han_muc is not None:
+                        han_muc.hoan_lai(cau_hinh)
+                        han_muc.danh_dau_het(cau_hinh)
+                    hang_doi.xong(phan_tu)
+                    return het_han_muc
+                ma_loi = _ma_loi_tam_thoi(e)
+                if bo_dieu_tiet is not None:
+                    bo_dieu_tiet.bao_bi_gioi_han()
+                # 421: máy chủ đóng kết nối, cần mở kết nối mới để tiếp tục
+                can_ket_noi_lai = ma_loi == 421
+                ly_do = f"Máy chủ tạm thời từ chối ({ma_loi})"
+
+            # Email không được máy chủ nhận: không tính vào hạn mức
+            if han_muc is not None:
+                han_muc.hoan_lai(cau_hinh)
+            if so_lan_tra_lai < SMTP_MAX_REQUEUE:
+                hang_doi.xong((email_nhan, noi_dung, so_lan_tra_lai + 1))
+            else:
+                ket_qua[email_nhan] = f"Lỗi: {ly_do} sau {SMTP_MAX_REQUEUE} lần thử lại"
+                print(f"Lỗi khi gửi email tới {email_nhan}: {ket_qua[email_nhan]}")
+                hang_doi.xong()
+                if khi_co_ket_qua:
+                    khi_co_ket_qua(email_nhan, ket_qua[email_nhan])
+            if can_ket_noi_lai:
+                try:
+                    server = _mo_lai_ket_noi_smtp(cau_hinh, server)
+                except Exception as e_mo:
+                    return _trang_thai_loi_ket_noi(e_mo, cau_hinh)
+    finally:
+        _dong_ket_noi_smtp(server)
+
+
+def gui_email(
+    emails_data: Dict[str, str],
+    tieu_de: str = EMAIL_SUBJECT,
+    khi_co_ket_qua: Optional[Callable[[str, str], None]] = None,
+    tep_dinh_kem: Optional[List[str]] = None,
+    ten_file_so_cai: Optional[str] = None,
+    kenh_gui: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Gửi email thông báo vi phạm tới danh sách người nhận.
+
+    Email được gửi song song qua một pool gồm SMTP_POOL_SIZE kết nối (cấu hình trong .env,
+    mặc định SMTP_DEFAULT_POOL_SIZE) cho mỗi tài khoản gửi (_doc_cac_tai_khoan_smtp); mỗi
+    kết nối do một worker giữ và mọi worker lấy email từ cùng một hàng đợi, nên tài khoản
+    gửi nhanh hơn nhận nhiều email hơn. Tốc độ gửi của mỗi tài khoản được điều tiết bởi
+    BoDieuTietTocDo riêng; tài khoản hết hạn mức trong ngày (HanMucGui) hoặc bị khóa thì
+    các email còn lại chuyển sang tài khoản khác.
+
+    Args:
+        emails_data: Dictionary với key là email người nhận, value là nội dung email.
+        tieu_de: Tiêu đề email (mặc định: EMAIL_SUBJECT).
+        khi_co_ket_qua: Hàm (email, trạng thái) được gọi ngay khi mỗi email có kết quả
+            (từ thread gửi), ví dụ để ghi trạng thái vào hộp thư đi.
+        tep_dinh_kem: Các file PDF đính kèm mọi email (None: dùng EMAIL_ATTACHMENTS trong .env).
+        ten_file_so_cai: Sổ cái đã gửi (SoCaiDaGui), chỉ truyền khi gửi thông báo vi phạm đã
+            tạo với cùng sổ cái. Thư mà mọi thông báo trong đó đã gửi được bỏ qua (trạng thái
+            TRANG_THAI_DA_GUI_TRUOC); thư gửi thành công được xác nhận vào sổ cái. Thư không
+            ghi trong sổ cái luôn được gửi. None (mặc định): không dùng sổ cái.
+        kenh_gui: Kênh gửi thay cho EMAIL_TRANSPORT trong .env: KENH_SMTP, KENH_SENDMAIL
+            (chương trình sendmail cục bộ) hoặc KENH_FILE (ghi thư ra EMAIL_OUTPUT_PATH theo
+            EMAIL_FILE_FORMAT, không cần mạng; thư ghi ra file không được xác nhận vào sổ cái).
+
+    Returns:
+        Dictionary với key là email, value là trạng thái gửi ("Thành công" hoặc "Lỗi: ..."),
+        theo đúng thứ tự của emails_data.
+    """
+    if not emails_data:
+        print("Không có email nào để gửi.")
         return {}
+    # Cả lô đã nằm trong bộ nhớ nên hàng đợi không cần giới hạn
+    return gui_email_dong(
+        emails_data.items(), tieu_de, khi_co_ket_qua, tep_dinh_kem, ten_file_so_cai,
+        kich_thuoc_hang_doi=0, kenh_gui=kenh_gui,
+    )
 
-    emails_to_send: Dict[str, str] = {}
-    han_xu_ly = (datetime.now() + timedelta(days=DAYS_TO_HANDLE_DEFAULT)).strftime("%d/%m/%Y")
 
-    # Hàm trợ giúp để tạo nội dung email
-    def _tao_noi_dung(ten: str, ly_do: str, so_tien: str) -> Optional[str]:
-        email_nhan = email_map.get(ten)
-        if not email_nhan:
-            print(f"Cảnh báo: Không tìm thấy email cho '{ten}' trong {ten_file_emails}.")
-            return None
-        if not isinstance(email_nhan, str) or '@' not in email_nhan:
-             print(f"Cảnh báo: Email không hợp lệ ('{email_nhan}') cho '{ten}'. Bỏ qua.")
-             return None
-
-        # Sử dụng f-string hoặc str.format để thay thế dễ đọc hơn
-        noi_dung = mau_email_base.replace("[Tên thành viên]", ten)
-        noi_dung = noi_dung.replace("[Ví dụ: Đi họp muộn, nghỉ không phép, chưa đóng quỹ…]", ly_do)
-        noi_dung = noi_dung.replace("[Số lần]", COUNT_DEFAULT)
-        noi_dung = noi_dung.replace("[Số tiền]", so_tien)
-        noi_dung = noi_dung.replace("[ngày/tháng/năm]", han_xu_ly)
-        return noi_dung
-
-    # Xử lý danh sách đi muộn
-    for ten in danh_sach_di_muon:
-        noi_dung = _tao_noi_dung(ten, VIOLATION_LATE, FINE_LATE)
-        if noi_dung:
-             email_nhan = email_map.get(ten) # Lấy lại email đã được xác thực
-             if email_nhan:
-                emails_to_send[email_nhan] = noi_dung
-
-
-    # Xử lý danh sách vắng
-    for ten in danh_sach_vang:
-        noi_dung = _tao_noi_dung(ten, VIOLATION_ABSENT, FINE_ABSENT)
-        if noi_dung:
-            email_nhan = email_map.get(ten) # Lấy lại email đã được xác thực
-            if email_nhan:
-                # Kiểm tra nếu người này vừa đi muộn vừa vắng (ít khả năng nhưng đề phòng)
-                # Hoặc nếu muốn gửi email vắng thay vì đi muộn nếu có cả 2 lỗi
-                emails_to_send[email_nhan] = noi_dung # Ghi đè nếu đã có email đi muộn
+def gui_email_dong(
+    nguon: Iterable[Tuple[str, str]],
+    tieu_de: str = EMAIL_SUBJECT,
+    khi_co_ket_qua: Optional[Callable[[str, str], None]] = None,
+    tep_dinh_kem: Optional[List[str]] = None,
+    ten_file_so_cai: Optional[str] = None,
+    kich_thuoc_hang_doi: int = STREAM_QUEUE_SIZE,
+    ten_file_han_muc: Optional[str] = DEFAULT_QUOTA_FILE,
+    kenh_gui: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Gửi email lấy dần từ nguon (ví dụ tao_noi_dung_email_dong) qua pool SMTP của gui_email.
 
-    return emails_to_send
+    Các worker bắt đầu gửi ngay khi email đầu tiên được tạo; nguồn chỉ được đọc tiếp khi
+    hàng đợi (HangDoiGui, tối đa kich_thuoc_hang_doi email) còn chỗ, nên nội dung email
+    không bao giờ nằm trong bộ nhớ cùng lúc. Sổ cái được lọc theo từng lô STREAM_CHUNK_SIZE
+    email và xác nhận dần trong khi gửi.
 
+    Args:
+        nguon: Các cặp (email người nhận, nội dung email).
+        kich_thuoc_hang_doi: Số email đã tạo tối đa chờ gửi (0: không giới hạn).
+        ten_file_han_muc: File lưu số email mỗi tài khoản đã gửi trong ngày (HanMucGui);
+            None để chỉ theo dõi hạn mức trong lần gửi này. Chỉ áp dụng cho kênh SMTP.
+        Các tham số còn lại: như gui_email.
 
-def gui_email(emails_data: Dict[str, str], tieu_de: str = EMAIL_SUBJECT) -> Dict[str, str]:
+    Returns:
+        Dictionary {email: trạng thái} theo thứ tự của nguon (không giữ nội dung email).
     """
-    Gửi email thông báo vi phạm tới danh sách người nhận.
+    ket_qua: Dict[str, Optional[str]] = {}
+    cac_tai_khoan = _doc_cac_tai_khoan_smtp(kenh_gui)
+    han_muc = tai_han_muc_gui(ten_file_han_muc) if ten_file_han_muc else HanMucGui()
+    loi_truoc_khi_gui: Optional[str] = None
+    if not cac_tai_khoan:
+        print("Lỗi: Thiếu EMAIL_ADDRESS hoặc EMAIL_PASSWORD trong file .env. Không thể gửi email.")
+        loi_truoc_khi_gui = "Lỗi: Thiếu cấu hình email gửi"
+    else:
+        for tai_khoan in cac_tai_khoan:
+            if tai_khoan["transport"] == KENH_SMTP and han_muc.con_lai(tai_khoan) == 0:
+                print(f"Cảnh báo: Tài khoản {tai_khoan['email']} đã hết hạn mức gửi hôm nay. Bỏ qua.")
+        cac_tai_khoan = [
+            tai_khoan for tai_khoan in cac_tai_khoan
+            if tai_khoan["transport"] != KENH_SMTP or han_muc.con_lai(tai_khoan) != 0
+        ]
+        if not cac_tai_khoan:
+            loi_truoc_khi_gui = "Lỗi: Mọi tài khoản gửi đã hết hạn mức trong ngày"
+
+    # Email gửi thành công, chờ xác nhận vào sổ cái (ghi từ thread gửi). Thư chỉ được ghi
+    # ra file (chạy thử, lưu trữ) thì chưa tới người nhận nên không được xác nhận
+    cho_xac_nhan: Deque[int] = deque()
+    so_cai_xac_nhan = ten_file_so_cai if any(tk["transport"] != KENH_FILE for tk in cac_tai_khoan) else None
+    ma_thu_dang_gui: Dict[str, int] = {}
+
+    def _khi_co_ket_qua(email_nhan: str, trang_thai: str) -> None:
+        ma_thu = ma_thu_dang_gui.pop(email_nhan, None)
+        if trang_thai == TRANG_THAI_THANH_CONG and ma_thu is not None:
+            cho_xac_nhan.append(ma_thu)
+        if khi_co_ket_qua:
+            khi_co_ket_qua(email_nhan, trang_thai)
+
+    def _luu_tien_do() -> None:
+        cac_ma_thu = [cho_xac_nhan.popleft() for _ in range(len(cho_xac_nhan))]
+        _xac_nhan_so_cai(cac_ma_thu, so_cai_xac_nhan)
+        if ten_file_han_muc and any(tk["transport"] == KENH_SMTP for tk in cac_tai_khoan):
+            _luu_han_muc_gui(han_muc, ten_file_han_muc)
+
+    def _danh_dau_loi(email_nhan: str, trang_thai: str) -> None:
+        ket_qua[email_nhan] = trang_thai
+        if khi_co_ket_qua:
+            khi_co_ket_qua(email_nhan, trang_thai)
+
+    # Chia kết nối xoay vòng giữa các tài khoản. Mỗi tài khoản có ít nhất một kết nối để
+    # nhận email khi tài khoản khác bị khóa hoặc hết hạn mức; ngoài ra không mở nhiều kết
+    # nối hơn số email
+    thu_tu_ket_noi = [
+        tai_khoan
+        for vong in range(max((int(tk["pool_size"]) for tk in cac_tai_khoan), default=0))
+        for tai_khoan in cac_tai_khoan
+        if vong < int(tai_khoan["pool_size"])
+    ]
+    if hasattr(nguon, "__len__"):
+        thu_tu_ket_noi = thu_tu_ket_noi[:max(len(nguon), len(cac_tai_khoan))]
+    hang_doi = HangDoiGui(kich_thuoc_hang_doi, len(thu_tu_ket_noi))
+
+    # Mỗi tài khoản có bộ điều tiết tốc độ và bộ dựng thư (địa chỉ From) riêng
+    bo_dieu_tiet_theo_tk: Dict[str, Optional[BoDieuTietTocDo]] = {}
+    nha_may_theo_tk: Dict[str, NhaMayThu] = {}
+    for tai_khoan in cac_tai_khoan:
+        bo_dieu_tiet_theo_tk[tai_khoan["email"]] = _tao_bo_dieu_tiet(tai_khoan)
+        nha_may_theo_tk[tai_khoan["email"]] = NhaMayThu(
+            tai_khoan["email"], tieu_de, tep_dinh_kem=tai_khoan["attachments"] if tep_dinh_kem is None else tep_dinh_kem
+        )
+
+    def _worker(tai_khoan: Dict[str, object]) -> None:
+        loi = _luong_gui_email(
+            tai_khoan, hang_doi, ket_qua, nha_may_theo_tk[tai_khoan["email"]],
+            bo_dieu_tiet_theo_tk[tai_khoan["email"]], _khi_co_ket_qua,
+            han_muc if tai_khoan["transport"] == KENH_SMTP else None,
+        )
+        # Worker cuối cùng dừng vì lỗi: các email còn lại không thể gửi
+        for email_nhan, _, _ in hang_doi.worker_dung(loi):
+            _danh_dau_loi(email_nhan, hang_doi.loi_ket_noi or "Lỗi SMTP chung")
+
+    for tai_khoan in cac_tai_khoan:
+        so_ket_noi = sum(1 for tk in thu_tu_ket_noi if tk is tai_khoan)
+        if so_ket_noi:
+            print(f"Đang kết nối tới {_mo_ta_kenh(tai_khoan)} ({tai_khoan['email']}) với {so_ket_noi} kết nối...")
+    with ThreadPoolExecutor(max_workers=max(1, len(thu_tu_ket_noi))) as pool:
+        for tai_khoan in thu_tu_ket_noi:
+            pool.submit(_worker, tai_khoan)
+        try:
+            for lo in _chia_lo(nguon, STREAM_CHUNK_SIZE):
+                _, bo_qua = _loc_email_da_gui(dict(lo), ten_file_so_cai, khi_co_ket_qua)
+                for email_nhan, noi_dung in lo:
+                    if email_nhan in bo_qua:
+                        ket_qua[email_nhan] = bo_qua[email_nhan]
+                    elif loi_truoc_khi_gui:
+                        _danh_dau_loi(email_nhan, loi_truoc_khi_gui)
+                    else:
+                        # Tạo key trước theo thứ tự nguồn; worker chỉ gán giá trị
+                        ket_qua[email_nhan] = None
+                        if so_cai_xac_nhan:
+                            ma_thu_dang_gui[email_nhan] = SoCaiDaGui.ma_thu(email_nhan, noi_dung)
+                        if not hang_doi.dua_vao(email_nhan, noi_dung):
+                            _danh_dau_loi(email_nhan, hang_doi.loi_ket_noi or "Lỗi SMTP chung")
+                _luu_tien_do()
+        finally:
+            hang_doi.dong()
+
+    if not ket_qua:
+        print("Không có email nào để gửi.")
+    elif thu_tu_ket_noi:
+        print("Đã đóng các kết nối SMTP.")
+    _luu_tien_do()
+    return ket_qua
+
+
+def gui_lai_email_loi(
+    emails_data: Dict[str, str],
+    ket_qua_truoc: Dict[str, str],
+    tieu_de: str = EMAIL_SUBJECT,
+    ten_file_so_cai: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Chỉ gửi lại các email chưa thành công trong một lần gửi trước.
+
+    Args:
+        emails_data: Dictionary {email: nội dung} đã dùng cho lần gửi trước.
+        ket_qua_truoc: Kết quả {email: trạng thái} của lần gửi trước.
+        tieu_de: Tiêu đề email.
+        ten_file_so_cai: Sổ cái đã gửi, như gui_email.
+
+    Returns:
+        Kết quả đã gộp: trạng thái của các email gửi lại được cập nhật, các email
+        đã thành công giữ nguyên.
+    """
+    can_gui_lai = {
+        email: noi_dung for email, noi_dung in emails_data.items()
+        if ket_qua_truoc.get(email) not in (TRANG_THAI_THANH_CONG, TRANG_THAI_DA_GUI_TRUOC)
+    }
+    ket_qua = dict(ket_qua_truoc)
+    if not can_gui_lai:
+        print("Không có email lỗi nào cần gửi lại.")
+        return ket_qua
+    print(f"Gửi lại {len(can_gui_lai)} email chưa thành công...")
+    ket_qua.update(gui_email(can_gui_lai, tieu_de, ten_file_so_cai=ten_file_so_cai))
+    return ket_qua
+
+
+async def gui_email_async(
+    emails_data: Dict[str, str],
+    tieu_de: str = EMAIL_SUBJECT,
+    so_dong_thoi: int = ASYNC_DEFAULT_MAX_IN_FLIGHT,
+    thoi_gian_cho: float = SMTP_SEND_TIMEOUT,
+    tep_dinh_kem: Optional[List[str]] = None,
+    ten_file_so_cai: Optional[str] = None,
+    kenh_gui: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Bộ gửi email dùng asyncio, một tài khoản gửi; dùng để so sánh với pool thread của
+    gui_email trong bench_gui_email.py.
+
+    Không hỗ trợ nhiều tài khoản gửi và hạn mức trong ngày (HanMucGui) như gui_email_dong,
+    nên ứng dụng và hàm main dùng gui_email / gui_qua_hop_thu_di thay vì hàm này.
+
+    Mỗi email là một coroutine; số email đang xử lý cùng lúc bị giới hạn bởi semaphore
+    (so_dong_thoi), còn việc gửi thực tế chia sẻ một nhóm nhỏ kết nối SMTP_POOL_SIZE.
+    smtplib là thư viện blocking nên mỗi lệnh gửi chạy trong thread (asyncio.to_thread).
+    Kết nối bị lỗi hoặc quá thời gian được đóng và mở lại thay thế; tốc độ gửi được điều
+    tiết bởi BoDieuTietTocDo và email bị giới hạn tốc độ được thử lại.
 
     Args:
         emails_data: Dictionary với key là email người nhận, value là nội dung email.
-        tieu_de: Tiêu đề email (mặc định: EMAIL_SUBJECT).
+        tieu_de: Tiêu đề email.
+        so_dong_thoi: Số email tối đa đang xử lý cùng lúc.
+        thoi_gian_cho: Thời gian tối đa (giây) cho mỗi email.
+        tep_dinh_kem: Các file PDF đính kèm mọi email (None: dùng EMAIL_ATTACHMENTS trong .env).
+        ten_file_so_cai: Sổ cái đã gửi, như gui_email.
+        kenh_gui: Kênh gửi thay cho EMAIL_TRANSPORT, như gui_email.
 
     Returns:
-        Dictionary với key là email, value là trạng thái gửi ("Thành công" hoặc "Lỗi: ...").
+        Dictionary {email: trạng thái} giống gui_email.
     """
     if not emails_data:
         print("Không có email nào để gửi.")
         return {}
+    thu_tu = list(emails_data)
+    emails_data, bo_qua = _loc_email_da_gui(emails_data, ten_file_so_cai)
+    if not emails_data:
+        return bo_qua
 
-    # Load biến môi trường từ file .env
-    load_dotenv()
-    EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
-    EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
-    SMTP_SERVER = os.getenv('SMTP_SERVER', SMTP_DEFAULT_SERVER)
-    # Đảm bảo port là số nguyên
+    cau_hinh = _doc_cau_hinh_smtp()
+    if kenh_gui:
+        cau_hinh["transport"] = kenh_gui
+    if _thieu_cau_hinh(cau_hinh):
+        print("Lỗi: Thiếu EMAIL_ADDRESS hoặc EMAIL_PASSWORD trong file .env. Không thể gửi email.")
+        return {email: bo_qua.get(email) or "Lỗi: Thiếu cấu hình email gửi" for email in thu_tu}
+
+    so_ket_noi = min(cau_hinh["pool_size"], len(emails_data))
+    print(f"Đang kết nối tới {_mo_ta_kenh(cau_hinh)} với {so_ket_noi} kết nối...")
+    ket_noi_ranh: "asyncio.Queue[Optional[smtplib.SMTP]]" = asyncio.Queue()
+    # con_song: kết nối đang dùng được; dang_mo: lần mở kết nối chưa xong;
+    # het_ket_noi: đã đặt dấu None (pool hết kết nối) vào ket_noi_ranh
+    pool = {"con_song": 0, "dang_mo": 0, "het_ket_noi": False, "loi": "Lỗi SMTP chung", "het_han_muc": None}
+
+    def _tra_ket_noi_moi(server: smtplib.SMTP) -> None:
+        pool["con_song"] += 1
+        if pool["het_ket_noi"]:
+            # Có kết nối trở lại: bỏ dấu None để các email sau không bị báo lỗi
+            pool["het_ket_noi"] = False
+            con_lai = [ket_noi_ranh.get_nowait() for _ in range(ket_noi_ranh.qsize())]
+            for ket_noi in con_lai:
+                if ket_noi is not None:
+                    ket_noi_ranh.put_nowait(ket_noi)
+        ket_noi_ranh.put_nowait(server)
+
+    def _bao_mo_that_bai(e: Exception) -> None:
+        pool["loi"] = _trang_thai_loi_ket_noi(e, cau_hinh)
+        # Chỉ báo hết kết nối khi mọi lần mở đã xong mà không còn kết nối nào sống
+        if pool["con_song"] == 0 and pool["dang_mo"] == 0 and not pool["het_ket_noi"]:
+            pool["het_ket_noi"] = True
+            ket_noi_ranh.put_nowait(None)
+
+    async def _mo_ket_noi() -> None:
+        pool["dang_mo"] += 1
+        try:
+            server = await asyncio.to_thread(_mo_ket_noi_smtp, cau_hinh)
+        except Exception as e:
+            pool["dang_mo"] -= 1
+            _bao_mo_that_bai(e)
+            return
+        pool["dang_mo"] -= 1
+        _tra_ket_noi_moi(server)
+
+    async def _bo_ket_noi(server: smtplib.SMTP) -> None:
+        """Đóng kết nối hỏng và mở lại (có chờ tăng dần) một kết nối thay thế."""
+        pool["con_song"] -= 1
+        pool["dang_mo"] += 1
+        try:
+            server_moi = await asyncio.to_thread(_mo_lai_ket_noi_smtp, cau_hinh, server)
+        except Exception as e:
+            pool["dang_mo"] -= 1
+            _bao_mo_that_bai(e)
+            return
+        pool["dang_mo"] -= 1
+        _tra_ket_noi_moi(server_moi)
+
+    await asyncio.gather(*(_mo_ket_noi() for _ in range(so_ket_noi)))
+    gioi_han = asyncio.Semaphore(max(1, so_dong_thoi))
+    bo_dieu_tiet = _tao_bo_dieu_tiet(cau_hinh)
+    nha_may = NhaMayThu(cau_hinh["email"], tieu_de, tep_dinh_kem=cau_hinh["attachments"] if tep_dinh_kem is None else tep_dinh_kem)
+
+    async def _gui(email_nhan: str, noi_dung: str) -> str:
+        async with gioi_han:
+            for so_lan_tra_lai in range(SMTP_MAX_REQUEUE + 1):
+                if pool["het_han_muc"]:
+                    return pool["het_han_muc"]
+                thoi_gian = bo_dieu_tiet.dat_cho() if bo_dieu_tiet is not None else 0.0
+                if thoi_gian > 0:
+                    await asyncio.sleep(thoi_gian)
+                server = await ket_noi_ranh.get()
+                if server is None:
+                    ket_noi_ranh.put_nowait(None)
+                    return pool["loi"]
+                if pool["het_han_muc"]:
+                    ket_noi_ranh.put_nowait(server)
+                    return pool["het_han_muc"]
+                try:
+                    trang_thai = await asyncio.wait_for(
+                        asyncio.to_thread(_gui_mot_email, server, nha_may, email_nhan, noi_dung),
+                        timeout=thoi_gian_cho,
+                    )
+                except asyncio.TimeoutError:
+                    print(f"Lỗi khi gửi email tới {email_nhan}: quá {thoi_gian_cho} giây.")
+                    await _bo_ket_noi(server)
+                    return f"Lỗi: Quá thời gian gửi ({thoi_gian_cho} giây)"
+                except smtplib.SMTPServerDisconnected as e:
+                    # Mất kết nối: kết nối lại rồi thử lại email này
+                    print(f"Cảnh báo: Mất kết nối SMTP khi gửi tới {email_nhan}: {e}. Đang kết nối lại...")
+                    ma_loi = None
+                    await _bo_ket_noi(server)
+                    continue
+                except smtplib.SMTPException as e:
+                    if _la_loi_het_han_muc(e):
+                        # Hết hạn mức gửi trong ngày: thử lại vô ích, dừng gửi các email còn lại
+                        ket_noi_ranh.put_nowait(server)
+                        if not pool["het_han_muc"]:
+                            print(f"Cảnh báo: Máy chủ báo tài khoản {cau_hinh['email']} hết hạn mức gửi: {e}.")
+                            pool["het_han_muc"] = f"Lỗi: Tài khoản {cau_hinh['email']} đã hết hạn mức gửi trong ngày"
+                        return pool["het_han_muc"]
+                    # Bị giới hạn tốc độ: giảm tốc rồi thử lại email này
+                    ma_loi = _ma_loi_tam_thoi(e)
+                    if bo_dieu_tiet is not None:
+                        bo_dieu_tiet.bao_bi_gioi_han()
+                    if ma_loi == 421:
+                        await _bo_ket_noi(server)
+                    else:
+                        ket_noi_ranh.put_nowait(server)
+                    continue
+                ket_noi_ranh.put_nowait(server)
+                if bo_dieu_tiet is not None:
+                    bo_dieu_tiet.bao_thanh_cong()
+                return trang_thai
+            ly_do = f"Máy chủ tạm thời từ chối ({ma_loi})" if ma_loi else "Mất kết nối SMTP"
+            trang_thai = f"Lỗi: {ly_do} sau {SMTP_MAX_REQUEUE} lần thử lại"
+            print(f"Lỗi khi gửi email tới {email_nhan}: {trang_thai}")
+            return trang_thai
+
+    cac_trang_thai = await asyncio.gather(*(_gui(email, noi_dung) for email, noi_dung in emails_data.items()))
+
+    # Đóng các kết nối còn lại
+    while not ket_noi_ranh.empty():
+        server = ket_noi_ranh.get_nowait()
+        if server is not None:
+            await asyncio.to_thread(_dong_ket_noi_smtp, server)
+    print("Đã đóng các kết nối SMTP.")
+
+    ket_qua = dict(zip(emails_data, cac_trang_thai))
+    if cau_hinh["transport"] != KENH_FILE:
+        _xac_nhan_so_cai([
+            SoCaiDaGui.ma_thu(email, emails_data[email]) for email, tt in ket_qua.items() if tt == TRANG_THAI_THANH_CONG
+        ], ten_file_so_cai)
+    return {email: bo_qua.get(email) or ket_qua[email] for email in thu_tu}
+
+
+def gui_email_dong_bo(
+    emails_data: Dict[str, str],
+    tieu_de: str = EMAIL_SUBJECT,
+    so_dong_thoi: int = ASYNC_DEFAULT_MAX_IN_FLIGHT,
+    thoi_gian_cho: float = SMTP_SEND_TIMEOUT,
+    tep_dinh_kem: Optional[List[str]] = None,
+    ten_file_so_cai: Optional[str] = None,
+    kenh_gui: Optional[str] = None
+) -> Dict[str, str]:
+    """Gọi gui_email_async từ code đồng bộ (bench_gui_email.py, chế độ dong_bo)."""
+    return asyncio.run(gui_email_async(
+        emails_data, tieu_de, so_dong_thoi, thoi_gian_cho, tep_dinh_kem, ten_file_so_cai, kenh_gui
+    ))
+
+
+def _mo_hop_thu_di(ten_file_outbox: str) -> sqlite3.Connection:
+    """Mở (và tạo nếu chưa có) hộp thư đi SQLite."""
+    ket_noi = sqlite3.connect(ten_file_outbox, timeout=30, check_same_thread=False, isolation_level=None)
+    ket_noi.execute("PRAGMA journal_mode=WAL")
+    ket_noi.execute(
+        """CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lo TEXT NOT NULL,
+            email TEXT NOT NULL,
+            tieu_de TEXT NOT NULL,
+            noi_dung TEXT NOT NULL,
+            trang_thai TEXT NOT NULL,
+            so_lan_thu INTEGER NOT NULL DEFAULT 0,
+            loi TEXT,
+            tao_luc TEXT NOT NULL,
+            cap_nhat_luc TEXT NOT NULL,
+            UNIQUE (lo, email)
+        )"""
+    )
+    ket_noi.execute("CREATE INDEX IF NOT EXISTS outbox_trang_thai ON outbox (trang_thai, lo, id)")
+    # ma_thu (SoCaiDaGui.ma_thu): cùng một thư chỉ có một hàng, dù được đưa vào nhiều lô
+    if not any(cot[1] == "ma_thu" for cot in ket_noi.execute("PRAGMA table_info(outbox)")):
+        ket_noi.execute("ALTER TABLE outbox ADD COLUMN ma_thu INTEGER")
+    ket_noi.execute("CREATE UNIQUE INDEX IF NOT EXISTS outbox_ma_thu ON outbox (ma_thu)")
+    return ket_noi
+
+
+def tao_ma_lo() -> str:
+    """Mã lô mới cho hộp thư đi, theo thời gian hiện tại."""
+    return datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+
+def them_vao_hop_thu_di(
+    emails_data: Dict[str, str],
+    tieu_de: str = EMAIL_SUBJECT,
+    lo: Optional[str] = None,
+    ten_file_outbox: str = DEFAULT_OUTBOX_FILE
+) -> str:
+    """
+    Đưa các email đã tạo nội dung (kết quả tao_noi_dung_email) vào hộp thư đi trên đĩa.
+
+    Mỗi thư được nhận diện theo ma_thu (địa chỉ và nội dung), không theo lô: thư đã có
+    trong hộp thư đi mà còn chờ gửi hoặc bị lỗi được chuyển sang lô này; thư đã gửi, đang
+    gửi hoặc không rõ trạng thái được giữ nguyên, nên tạo lại và đưa vào cùng một thông báo
+    sau khi bị gián đoạn không gửi trùng.
+
+    Args:
+        emails_data: Dictionary {email: nội dung}.
+        tieu_de: Tiêu đề email.
+        lo: Mã lô gửi; mặc định tạo mới (tao_ma_lo).
+        ten_file_outbox: File SQLite của hộp thư đi.
+
+    Returns:
+        Mã lô đã dùng.
+    """
+    lo = lo or tao_ma_lo()
+    bay_gio = datetime.now().isoformat(timespec="seconds")
+    cac_thu = [(email, noi_dung, SoCaiDaGui.ma_thu(email, noi_dung)) for email, noi_dung in emails_data.items()]
+    ket_noi = _mo_hop_thu_di(ten_file_outbox)
     try:
-        SMTP_PORT = int(os.getenv('SMTP_PORT', str(SMTP_DEFAULT_PORT)))
-    except ValueError:
-        print(f"Lỗi: SMTP_PORT trong .env không phải là số. Sử dụng port mặc định {SMTP_DEFAULT_PORT}.")
-        SMTP_PORT = SMTP_DEFAULT_PORT
+        with ket_noi:
+            ket_noi.execute("BEGIN IMMEDIATE")
+            truoc = ket_noi.total_changes
+            ket_noi.executemany(
+                "UPDATE OR IGNORE outbox SET lo = ?, tieu_de = ?, trang_thai = ?, loi = NULL, cap_nhat_luc = ? "
+                "WHERE ma_thu = ? AND trang_thai IN (?, ?)",
+                [(lo, tieu_de, HOP_THU_CHO_GUI, bay_gio, ma_thu, HOP_THU_CHO_GUI, HOP_THU_LOI) for _, _, ma_thu in cac_thu],
+            )
+            ket_noi.executemany(
+                "INSERT OR IGNORE INTO outbox (lo, email, tieu_de, noi_dung, ma_thu, trang_thai, tao_luc, cap_nhat_luc) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(lo, email, tieu_de, noi_dung, ma_thu, HOP_THU_CHO_GUI, bay_gio, bay_gio) for email, noi_dung, ma_thu in cac_thu],
+            )
+            so_da_dua = ket_noi.total_changes - truoc
+    finally:
+        ket_noi.close()
+    print(f"Đã đưa {so_da_dua} email vào hộp thư đi (lô {lo}).")
+    if so_da_dua < len(emails_data):
+        print(f"Bỏ qua {len(emails_data) - so_da_dua} email đã có trong hộp thư đi.")
+    return lo
 
-    if not EMAIL_ADDRESS or not EMAIL_PASSWORD:
-        print("Lỗi: Thiếu EMAIL_ADDRESS hoặc EMAIL_PASSWORD trong file .env. Không thể gửi email.")
-        return {email: "Lỗi: Thiếu cấu hình email gửi" for email in emails_data}
 
+def gui_qua_hop_thu_di(
+    nguon: Iterable[Tuple[str, str]],
+    tieu_de: str = EMAIL_SUBJECT,
+    lo: Optional[str] = None,
+    kich_thuoc_lo: int = OUTBOX_BATCH_SIZE,
+    ten_file_outbox: str = DEFAULT_OUTBOX_FILE,
+    ten_file_so_cai: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Gửi email lấy dần từ nguon (ví dụ tao_noi_dung_email_dong) qua hộp thư đi.
+
+    Mỗi đợt kich_thuoc_lo email được ghi vào hộp thư đi (them_vao_hop_thu_di) rồi gửi
+    (xu_ly_hop_thu_di) trước khi đọc tiếp nguồn, nên bộ nhớ chỉ giữ một đợt và mỗi email
+    có trạng thái riêng trên đĩa: chạy lại sau khi bị gián đoạn chỉ gửi email chưa gửi.
+
+    Args:
+        nguon: Các cặp (email người nhận, nội dung email).
+        lo: Mã lô cho mọi email của lần gửi này (mặc định tạo mới), dùng để gửi lại email
+            lỗi bằng xu_ly_hop_thu_di(lo, gui_lai_loi=True).
+        Các tham số còn lại: như xu_ly_hop_thu_di.
+
+    Returns:
+        Dictionary {email: trạng thái} theo thứ tự của nguon. Email đã gửi trong lần chạy
+        trước có trạng thái TRANG_THAI_DA_GUI_TRUOC.
+    """
+    lo = lo or tao_ma_lo()
     ket_qua: Dict[str, str] = {}
-    server: Optional[smtplib.SMTP] = None # Khởi tạo server là None
+    for dot in _chia_lo(nguon, kich_thuoc_lo):
+        emails_data = dict(dot)
+        them_vao_hop_thu_di(emails_data, tieu_de, lo, ten_file_outbox)
+        ket_qua_dot = xu_ly_hop_thu_di(lo, kich_thuoc_lo, ten_file_outbox=ten_file_outbox, ten_file_so_cai=ten_file_so_cai)
+
+        # Email không được gửi trong đợt này: đã có trong hộp thư đi từ lần chạy trước
+        ma_thu_con_lai = {
+            SoCaiDaGui.ma_thu(email, noi_dung): email for email, noi_dung in emails_data.items() if email not in ket_qua_dot
+        }
+        if ma_thu_con_lai:
+            ket_noi = _mo_hop_thu_di(ten_file_outbox)
+            try:
+                trang_thai_cu = dict(ket_noi.execute(
+                    f"SELECT ma_thu, trang_thai FROM outbox WHERE ma_thu IN ({','.join('?' * len(ma_thu_con_lai))})",
+                    list(ma_thu_con_lai),
+                ).fetchall())
+            finally:
+                ket_noi.close()
+            da_gui = [ma_thu for ma_thu, trang_thai in trang_thai_cu.items() if trang_thai == HOP_THU_DA_GUI]
+            # Thư đã tới máy chủ nhưng chưa kịp xác nhận vào sổ cái khi bị gián đoạn
+            _xac_nhan_so_cai(da_gui, ten_file_so_cai)
+            for ma_thu, email in ma_thu_con_lai.items():
+                trang_thai = trang_thai_cu.get(ma_thu)
+                ket_qua_dot[email] = (
+                    TRANG_THAI_DA_GUI_TRUOC if trang_thai == HOP_THU_DA_GUI
+                    else f"Lỗi: Email đã có trong hộp thư đi (trạng thái {trang_thai}), không gửi lại"
+                )
+        ket_qua.update((email, ket_qua_dot[email]) for email in emails_data)
+    return ket_qua
+
 
+def thong_ke_hop_thu_di(ten_file_outbox: str = DEFAULT_OUTBOX_FILE) -> Dict[str, int]:
+    """Đếm số email trong hộp thư đi theo trạng thái."""
+    if not os.path.exists(ten_file_outbox):
+        return {}
+    ket_noi = _mo_hop_thu_di(ten_file_outbox)
     try:
-        # Thiết lập kết nối SMTP
-        # Sử dụng context manager (with) để đảm bảo server.quit() được gọi
-        print(f"Đang kết nối tới {SMTP_SERVER}:{SMTP_PORT}...")
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30) # Thêm timeout
-        server.ehlo() # Chào hỏi server
-        server.starttls() # Bắt đầu mã hóa TLS
-        server.ehlo() # Chào hỏi lại sau TLS
-        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        print("Kết nối và đăng nhập SMTP thành công.")
+        return dict(ket_noi.execute("SELECT trang_thai, COUNT(*) FROM outbox GROUP BY trang_thai").fetchall())
+    finally:
+        ket_noi.close()
 
-        # Gửi email cho từng người
-        for email_nhan, noi_dung in emails_data.items():
-            try:
-                msg = MIMEMultipart()
-                msg['From'] = EMAIL_ADDRESS
-                msg['To'] = email_nhan
-                msg['Subject'] = tieu_de
-
-                # Đính kèm nội dung email với encoding utf-8
-                msg.attach(MIMEText(noi_dung, 'plain', 'utf-8'))
-
-                # Gửi email
-                server.send_message(msg)
-                ket_qua[email_nhan] = "Thành công"
-                print(f"Đã gửi email thành công tới: {email_nhan}")
-
-            except smtplib.SMTPRecipientsRefused:
-                error_msg = "Địa chỉ người nhận bị từ chối."
-                ket_qua[email_nhan] = f"Lỗi: {error_msg}"
-                print(f"Lỗi khi gửi email tới {email_nhan}: {error_msg}")
-            except Exception as e:
-                error_msg = str(e)
-                ket_qua[email_nhan] = f"Lỗi: {error_msg}"
-                print(f"Lỗi khi gửi email tới {email_nhan}: {error_msg}")
 
-    except smtplib.SMTPAuthenticationError:
-        print("Lỗi: Xác thực SMTP thất bại. Kiểm tra EMAIL_ADDRESS và EMAIL_PASSWORD.")
-        ket_qua = {email: "Lỗi: Xác thực SMTP thất bại" for email in emails_data}
-    except smtplib.SMTPServerDisconnected:
-         print("Lỗi: Mất kết nối đến máy chủ SMTP.")
-         ket_qua = {email: "Lỗi: Mất kết nối SMTP" for email in emails_data}
-    except ConnectionRefusedError:
-         print(f"Lỗi: Kết nối đến {SMTP_SERVER}:{SMTP_PORT} bị từ chối. Kiểm tra địa chỉ/port và tường lửa.")
-         ket_qua = {email: "Lỗi: Kết nối SMTP bị từ chối" for email in emails_data}
-    except Exception as e:
-        print(f"Lỗi kết nối SMTP hoặc lỗi không xác định khác: {str(e)}")
-        # Gán lỗi chung cho tất cả nếu lỗi xảy ra trước vòng lặp gửi
-        if not ket_qua:
-             ket_qua = {email: f"Lỗi SMTP chung: {str(e)}" for email in emails_data}
-        # Nếu lỗi xảy ra sau khi đã gửi một số email, chỉ cập nhật trạng thái cho những email chưa gửi
-        else:
-             for email in emails_data:
-                  if email not in ket_qua:
-                       ket_qua[email] = f"Lỗi SMTP chung: {str(e)}"
+def xu_ly_hop_thu_di(
+    lo: Optional[str] = None,
+    kich_thuoc_lo: int = OUTBOX_BATCH_SIZE,
+    gui_lai_loi: bool = False,
+    ten_file_outbox: str = DEFAULT_OUTBOX_FILE,
+    ten_file_so_cai: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Gửi các email đang chờ trong hộp thư đi theo từng đợt, ghi trạng thái từng email ngay khi có.
+
+    Email được đánh dấu 'dang_gui' trước khi gửi và 'da_gui'/'loi' ngay khi có kết quả, nên
+    nếu tiến trình dừng giữa chừng, lần chạy sau tiếp tục đúng chỗ dừng. Email còn ở trạng
+    thái 'dang_gui' từ lần chạy trước (không rõ đã tới máy chủ hay chưa) được chuyển sang
+    'khong_ro' và không tự động gửi lại, để không gửi trùng.
+
+    Args:
+        lo: Chỉ xử lý lô này; None để xử lý mọi lô.
+        kich_thuoc_lo: Số email lấy ra trong mỗi đợt.
+        gui_lai_loi: Đưa các email 'loi' trở lại hàng chờ trước khi gửi.
+        ten_file_outbox: File SQLite của hộp thư đi.
+        ten_file_so_cai: Sổ cái đã gửi, như gui_email (truyền khi hộp thư đi chứa thông báo vi phạm).
+
+    Returns:
+        Dictionary {email: trạng thái} của các email đã xử lý trong lần gọi này.
+    """
+    ket_noi = _mo_hop_thu_di(ten_file_outbox)
+    khoa = threading.Lock()
+    dieu_kien_lo, tham_so_lo = ("AND lo = ?", (lo,)) if lo else ("", ())
+    ket_qua: Dict[str, str] = {}
 
+    try:
+        bay_gio = datetime.now().isoformat(timespec="seconds")
+        so_khong_ro = ket_noi.execute(
+            f"UPDATE outbox SET trang_thai = ?, cap_nhat_luc = ? WHERE trang_thai = ? {dieu_kien_lo}",
+            (HOP_THU_KHONG_RO, bay_gio, HOP_THU_DANG_GUI, *tham_so_lo),
+        ).rowcount
+        if so_khong_ro:
+            print(f"Cảnh báo: {so_khong_ro} email bị gián đoạn ở lần chạy trước, không rõ đã gửi hay chưa. Không tự động gửi lại.")
+        if gui_lai_loi:
+            ket_noi.execute(
+                f"UPDATE outbox SET trang_thai = ?, cap_nhat_luc = ? WHERE trang_thai = ? {dieu_kien_lo}",
+                (HOP_THU_CHO_GUI, bay_gio, HOP_THU_LOI, *tham_so_lo),
+            )
+
+        while True:
+            # Nhận một đợt email đang chờ
+            with ket_noi:
+                ket_noi.execute("BEGIN IMMEDIATE")
+                dot = ket_noi.execute(
+                    f"SELECT id, email, tieu_de, noi_dung FROM outbox WHERE trang_thai = ? {dieu_kien_lo} ORDER BY id LIMIT ?",
+                    (HOP_THU_CHO_GUI, *tham_so_lo, kich_thuoc_lo),
+                ).fetchall()
+                ket_noi.executemany(
+                    "UPDATE outbox SET trang_thai = ?, so_lan_thu = so_lan_thu + 1, cap_nhat_luc = ? WHERE id = ?",
+                    [(HOP_THU_DANG_GUI, datetime.now().isoformat(timespec="seconds"), hang[0]) for hang in dot],
+                )
+            if not dot:
+                break
+
+            # Gửi theo từng tiêu đề, ghi kết quả từng email ngay khi có
+            theo_tieu_de: Dict[str, Dict[str, int]] = {}
+            for id_hang, email, tieu_de, _ in dot:
+                theo_tieu_de.setdefault(tieu_de, {})[email] = id_hang
+            noi_dung_theo_id = {hang[0]: hang[3] for hang in dot}
+
+            for tieu_de, id_theo_email in theo_tieu_de.items():
+                def _ghi_ket_qua(email: str, trang_thai: str, id_theo_email: Dict[str, int] = id_theo_email) -> None:
+                    trang_thai_hop_thu = (
+                        HOP_THU_DA_GUI if trang_thai in (TRANG_THAI_THANH_CONG, TRANG_THAI_DA_GUI_TRUOC) else HOP_THU_LOI
+                    )
+                    with khoa:
+                        ket_noi.execute(
+                            "UPDATE outbox SET trang_thai = ?, loi = ?, cap_nhat_luc = ? WHERE id = ?",
+                            (
+                                trang_thai_hop_thu,
+                                None if trang_thai_hop_thu == HOP_THU_DA_GUI else trang_thai,
+                                datetime.now().isoformat(timespec="seconds"),
+                                id_theo_email[email],
+                            ),
+                        )
+
+                emails_data = {email: noi_dung_theo_id[id_hang] for email, id_hang in id_theo_email.items()}
+                ket_qua.update(gui_email(
+                    emails_data, tieu_de, khi_co_ket_qua=_ghi_ket_qua, ten_file_so_cai=ten_file_so_cai
+                ))
     finally:
-        # Đảm bảo đóng kết nối ngay cả khi có lỗi
-        if server:
-            try:
-                server.quit()
-                print("Đã đóng kết nối SMTP.")
-            except Exception as e:
-                print(f"Lỗi khi đóng kết nối SMTP: {e}")
+        ket_noi.close()
 
     return ket_qua
 
 
+def chay_nen_hop_thu_di(
+    lo: Optional[str] = None,
+    kich_thuoc_lo: int = OUTBOX_BATCH_SIZE,
+    ten_file_outbox: str = DEFAULT_OUTBOX_FILE,
+    ten_file_so_cai: Optional[str] = None
+) -> threading.Thread:
+    """Chạy xu_ly_hop_thu_di trong một thread nền (daemon) và trả về thread đó."""
+    worker = threading.Thread(
+        target=xu_ly_hop_thu_di,
+        kwargs={
+            "lo": lo, "kich_thuoc_lo": kich_thuoc_lo, "ten_file_outbox": ten_file_outbox,
+            "ten_file_so_cai": ten_file_so_cai,
+        },
+        name="outbox-worker",
+        daemon=True,
+    )
+    worker.start()
+    return worker
+
+
+_KHOA_LOG = threading.Lock()
+
+
+def _bam_nguoi_nhan(email: str) -> int:
+    """Băm 64 bit của địa chỉ email (không phân biệt hoa thường, bỏ khoảng trắng) cho chỉ mục log."""
+    return int.from_bytes(hashlib.blake2b(email.strip().lower().encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _muc_chi_muc(ban_ghi: Dict, vi_tri: int, do_dai: int) -> Tuple[int, int, int, int, int]:
+    """Tạo một mục chỉ mục (theo KIEU_CHI_MUC_LOG) cho bản ghi nằm ở vi_tri trong file log."""
+    ngay = int(ban_ghi.get("thoi_gian", "")[:10].replace("-", "") or 0)
+    email = ban_ghi.get("email")
+    return (vi_tri, do_dai, _MA_LOAI_LOG.get(ban_ghi.get("loai"), 0), ngay, _bam_nguoi_nhan(email) if email else 0)
+
+
+def _nhap_log_van_ban_cu(ten_file_txt: str) -> List[Dict]:
+    """Chuyển các khối log văn bản cũ (email_logs.txt) thành bản ghi cho log JSONL."""
+    with open(ten_file_txt, "r", encoding="utf-8") as f:
+        cac_khoi = [khoi.strip() for khoi in f.read().split("=" * 50) if khoi.strip()]
+
+    cac_ban_ghi: List[Dict] = []
+    for so_thu_tu, khoi in enumerate(cac_khoi):
+        lan_chay = {"loai": LOG_LAN_CHAY, "thoi_gian": "", "ngay_kiem_tra": None, "gio_so_sanh": "",
+                    "tieu_de": EMAIL_SUBJECT, "di_muon": [], "vang": [], "thanh_cong": 0, "that_bai": 0}
+        ket_qua: Dict[str, str] = {}
+        muc = None
+        for dong in khoi.splitlines():
+            dong = dong.strip()
+            if dong.startswith("Thời gian ghi log: "):
+                lan_chay["thoi_gian"] = dong.split(": ", 1)[1]
+            elif dong.startswith("Ngày kiểm tra: "):
+                gia_tri = dong.split(": ", 1)[1]
+                lan_chay["ngay_kiem_tra"] = int(gia_tri) if gia_tri.isdigit() else gia_tri
+            elif dong.startswith("Giờ so sánh: "):
+                lan_chay["gio_so_sanh"] = dong.split(": ", 1)[1]
+            elif dong.startswith("Tiêu đề email: "):
+                lan_chay["tieu_de"] = dong.split(": ", 1)[1]
+            elif dong.startswith("Đi muộn ("):
+                muc = lan_chay["di_muon"]
+            elif dong.startswith("Vắng mặt ("):
+                muc = lan_chay["vang"]
+            elif dong == "KẾT QUẢ GỬI EMAIL:":
+                muc = ket_qua
+            elif dong.startswith("- ") and muc is not None:
+                if muc is ket_qua:
+                    email, _, trang_thai = dong[2:].partition(": ")
+                    ket_qua[email.strip()] = trang_thai.strip()
+                else:
+                    muc.append(dong[2:])
+        if not lan_chay["thoi_gian"]:
+            continue
+        lan_chay["lan_chay"] = f"van-ban-{so_thu_tu}"
+        lan_chay["thanh_cong"] = sum(1 for tt in ket_qua.values() if tt == TRANG_THAI_THANH_CONG)
+        lan_chay["that_bai"] = len(ket_qua) - lan_chay["thanh_cong"]
+        cac_ban_ghi.append(lan_chay)
+        cac_ban_ghi.extend(
+            {"loai": LOG_NGUOI_NHAN, "lan_chay": lan_chay["lan_chay"], "thoi_gian": lan_chay["thoi_gian"],
+             "email": email, "trang_thai": trang_thai}
+            for email, trang_thai in ket_qua.items()
+        )
+    return cac_ban_ghi
+
+
+def _dong_bo_chi_muc_log(ten_file_log: str) -> np.ndarray:
+    """
+    Đọc chỉ mục của file log, bổ sung các bản ghi chưa có trong chỉ mục (ví dụ khi tiến
+    trình dừng giữa lúc ghi log và ghi chỉ mục) hoặc dựng lại nếu chỉ mục không khớp.
+
+    Nếu file log chưa tồn tại mà có file log văn bản cũ cùng tên (.txt), các khối log cũ
+    được chuyển sang trước. Phải gọi khi đang giữ _KHOA_LOG.
+    """
+    ten_file_chi_muc = ten_file_log + ".idx"
+    if not os.path.exists(ten_file_log):
+        ten_file_txt = os.path.splitext(ten_file_log)[0] + ".txt"
+        cac_ban_ghi = _nhap_log_van_ban_cu(ten_file_txt) if os.path.exists(ten_file_txt) else []
+        with open(ten_file_log, "wb") as f:
+            f.writelines((json.dumps(ban_ghi, ensure_ascii=False) + "\n").encode("utf-8") for ban_ghi in cac_ban_ghi)
+        if cac_ban_ghi:
+            print(f"Đã chuyển {len(cac_ban_ghi)} bản ghi từ {ten_file_txt} sang {ten_file_log}.")
+        if os.path.exists(ten_file_chi_muc):
+            os.remove(ten_file_chi_muc)
+
+    chi_muc = np.zeros(0, dtype=KIEU_CHI_MUC_LOG)
+    if os.path.exists(ten_file_chi_muc) and os.path.getsize(ten_file_chi_muc) % KIEU_CHI_MUC_LOG.itemsize == 0:
+        chi_muc = np.fromfile(ten_file_chi_muc, dtype=KIEU_CHI_MUC_LOG)
+    kich_thuoc_log = os.path.getsize(ten_file_log)
+    da_chi_muc = int(chi_muc["vi_tri"][-1]) + int(chi_muc["do_dai"][-1]) if len(chi_muc) else 0
+    if da_chi_muc > kich_thuoc_log:
+        # File log bị thay thế hoặc cắt ngắn: dựng lại toàn bộ chỉ mục
+        chi_muc, da_chi_muc = chi_muc[:0], 0
+        open(ten_file_chi_muc, "wb").close()
+    if da_chi_muc == kich_thuoc_log:
+        return chi_muc
+
+    muc_moi = []
+    with open(ten_file_log, "rb") as f:
+        f.seek(da_chi_muc)
+        vi_tri = da_chi_muc
+        for dong in f:
+            if not dong.endswith(b"\n"):
+                break # Bản ghi đang ghi dở
+            try:
+                muc_moi.append(_muc_chi_muc(json.loads(dong), vi_tri, len(dong)))
+            except ValueError:
+                pass # Dòng hỏng: bỏ qua khi tra cứu
+            vi_tri += len(dong)
+    muc_moi = np.array(muc_moi, dtype=KIEU_CHI_MUC_LOG)
+    with open(ten_file_chi_muc, "ab") as f:
+        muc_moi.tofile(f)
+    return np.concatenate([chi_muc, muc_moi])
+
+
+def _doc_chi_muc_log(ten_file_log: str) -> np.ndarray:
+    """Chỉ mục đã đồng bộ của file log (rỗng nếu chưa có log)."""
+    with _KHOA_LOG:
+        return _dong_bo_chi_muc_log(ten_file_log)
+
+
+def _doc_ban_ghi_log(ten_file_log: str, cac_muc: np.ndarray) -> List[Dict]:
+    """Đọc các bản ghi theo mục chỉ mục (seek thẳng tới từng bản ghi)."""
+    cac_ban_ghi = []
+    with open(ten_file_log, "rb") as f:
+        for vi_tri, do_dai in zip(cac_muc["vi_tri"].tolist(), cac_muc["do_dai"].tolist()):
+            f.seek(vi_tri)
+            cac_ban_ghi.append(json.loads(f.read(do_dai)))
+    return cac_ban_ghi
+
+
+def _doc_lan_chay_log(ten_file_log: str, chi_muc: np.ndarray, vi_tri_lan_chay: np.ndarray) -> List[Dict]:
+    """
+    Đọc các lần chạy (theo vị trí trong chỉ mục) kèm kết quả gửi của từng người nhận.
+
+    Bản ghi người nhận được ghi liền ngay sau bản ghi lần chạy, nên mỗi lần chạy chỉ cần
+    đọc một đoạn liên tục của file log.
+    """
+    la_lan_chay = np.flatnonzero(chi_muc["loai"] == _MA_LOAI_LOG[LOG_LAN_CHAY])
+    cac_lan_chay = []
+    with open(ten_file_log, "rb") as f:
+        for i in vi_tri_lan_chay.tolist():
+            tiep_theo = la_lan_chay[np.searchsorted(la_lan_chay, i, side="right"):]
+            j = int(tiep_theo[0]) if len(tiep_theo) else len(chi_muc)
+            bat_dau = int(chi_muc["vi_tri"][i])
+            f.seek(bat_dau)
+            cac_dong = f.read(int(chi_muc["vi_tri"][j - 1]) + int(chi_muc["do_dai"][j - 1]) - bat_dau).splitlines()
+            lan_chay = json.loads(cac_dong[0])
+            lan_chay["ket_qua"] = {}
+            for dong in cac_dong[1:]:
+                try:
+                    ban_ghi = json.loads(dong)
+                except ValueError:
+                    continue
+                if ban_ghi.get("lan_chay") == lan_chay.get("lan_chay"):
+                    lan_chay["ket_qua"][ban_ghi["email"]] = ban_ghi["trang_thai"]
+            cac_lan_chay.append(lan_chay)
+    return cac_lan_chay
+
+
+def doc_log_gan_nhat(so_luong: int = 20, ten_file_log: str = DEFAULT_EVENT_LOG_FILE) -> List[Dict]:
+    """
+    Đọc so_luong lần chạy gần nhất (mới nhất trước), mỗi lần chạy kèm 'ket_qua' {email: trạng thái}.
+    """
+    chi_muc = _doc_chi_muc_log(ten_file_log)
+    la_lan_chay = np.flatnonzero(chi_muc["loai"] == _MA_LOAI_LOG[LOG_LAN_CHAY])
+    return _doc_lan_chay_log(ten_file_log, chi_muc, la_lan_chay[::-1][:so_luong])
+
+
+def doc_log_theo_ngay(ngay: date, ten_file_log: str = DEFAULT_EVENT_LOG_FILE) -> List[Dict]:
+    """Đọc các lần chạy được ghi trong ngày (theo thời gian ghi log), cũ nhất trước."""
+    chi_muc = _doc_chi_muc_log(ten_file_log)
+    khop = (chi_muc["loai"] == _MA_LOAI_LOG[LOG_LAN_CHAY]) & (chi_muc["ngay"] == int(ngay.strftime("%Y%m%d")))
+    return _doc_lan_chay_log(ten_file_log, chi_muc, np.flatnonzero(khop))
+
+
+def doc_log_theo_nguoi_nhan(email: str, ten_file_log: str = DEFAULT_EVENT_LOG_FILE) -> List[Dict]:
+    """Đọc mọi bản ghi gửi tới một địa chỉ email, cũ nhất trước."""
+    chi_muc = _doc_chi_muc_log(ten_file_log)
+    khop = (chi_muc["loai"] == _MA_LOAI_LOG[LOG_NGUOI_NHAN]) & (chi_muc["nguoi_nhan"] == _bam_nguoi_nhan(email))
+    email = email.strip().lower()
+    # Kiểm tra lại địa chỉ để loại trường hợp trùng mã băm
+    return [ban_ghi for ban_ghi in _doc_ban_ghi_log(ten_file_log, chi_muc[khop]) if ban_ghi["email"].strip().lower() == email]
+
+
+def doc_log_nguoc(
+    so_lan_chay: int = 10,
+    vi_tri_ket_thuc: Optional[int] = None,
+    ten_file_log: str = DEFAULT_EVENT_LOG_FILE
+) -> Tuple[List[Dict], int]:
+    """
+    Đọc ngược file log từ cuối theo từng khối LOG_BLOCK_SIZE byte để lấy các lần chạy mới nhất.
+
+    Chỉ đọc đủ phần cuối file cho so_lan_chay lần chạy, nên thời gian không phụ thuộc vào
+    độ dài lịch sử; không cần chỉ mục.
+
+    Args:
+        so_lan_chay: Số lần chạy cần lấy.
+        vi_tri_ket_thuc: Chỉ đọc phần log trước vị trí này (giá trị trả về của lần gọi
+            trước, để lấy trang cũ hơn); None để đọc từ cuối file.
+        ten_file_log: File log JSONL.
+
+    Returns:
+        (các lần chạy mới nhất trước, mỗi lần chạy kèm 'ket_qua' {email: trạng thái};
+         vị trí để đọc trang tiếp theo, 0 nếu đã hết log).
+    """
+    if not os.path.exists(ten_file_log):
+        _doc_chi_muc_log(ten_file_log) # Tạo log (chuyển log văn bản cũ nếu có)
+
+    cac_lan_chay: List[Dict] = []
+    nguoi_nhan_theo_lan_chay: Dict[str, List[Tuple[str, str]]] = {}
+    with open(ten_file_log, "rb") as f:
+        vi_tri = f.seek(0, os.SEEK_END) if vi_tri_ket_thuc is None else vi_tri_ket_thuc
+        phan_du = b"" # Phần đầu khối vừa đọc, có thể là dòng chưa trọn
+        while vi_tri > 0:
+            do_dai = min(LOG_BLOCK_SIZE, vi_tri)
+            vi_tri -= do_dai
+            f.seek(vi_tri)
+            cac_dong = (f.read(do_dai) + phan_du).split(b"\n")
+            # Vị trí bắt đầu của từng dòng trong file
+            cac_vi_tri = np.cumsum([vi_tri] + [len(dong) + 1 for dong in cac_dong[:-1]]).tolist()
+            if vi_tri > 0:
+                phan_du = cac_dong[0]
+                cac_dong, cac_vi_tri = cac_dong[1:], cac_vi_tri[1:]
+            for dong, bat_dau in zip(reversed(cac_dong), reversed(cac_vi_tri)):
+                if not dong.strip():
+                    continue
+                try:
+                    ban_ghi = json.loads(dong)
+                except ValueError:
+                    continue # Dòng hỏng hoặc đang ghi dở
+                if ban_ghi.get("loai") == LOG_NGUOI_NHAN:
+                    nguoi_nhan_theo_lan_chay.setdefault(ban_ghi.get("lan_chay"), []).append(
+                        (ban_ghi["email"], ban_ghi["trang_thai"])
+                    )
+                elif ban_ghi.get("loai") == LOG_LAN_CHAY:
+                    ban_ghi["ket_qua"] = dict(reversed(nguoi_nhan_theo_lan_chay.pop(ban_ghi.get("lan_chay"), [])))
+                    cac_lan_chay.append(ban_ghi)
+                    if len(cac_lan_chay) >= so_lan_chay:
+                        return cac_lan_chay, bat_dau
+    return cac_lan_chay, 0
+
+
+def _ngay_vi_pham(lan_chay: Dict) -> Optional[str]:
+    """Ngày vi phạm (YYYY-MM-DD) của một bản ghi lần chạy, suy ra từ ngày kiểm tra và thời gian ghi log."""
+    if lan_chay.get("ngay_vi_pham"):
+        return lan_chay["ngay_vi_pham"]
+    ngay_kiem_tra = lan_chay.get("ngay_kiem_tra")
+    try:
+        ngay_ghi = datetime.strptime(lan_chay.get("thoi_gian", "")[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+    ngay = ngay_kiem_tra_gan_nhat(ngay_kiem_tra, ngay_ghi) if isinstance(ngay_kiem_tra, int) else None
+    return ngay.isoformat() if ngay else None
+
+
+def _mo_bo_dem(ten_file: str) -> sqlite3.Connection:
+    """Mở (và tạo nếu chưa có) file SQLite lưu bộ đếm vi phạm."""
+    ket_noi = sqlite3.connect(ten_file, timeout=30, isolation_level=None)
+    ket_noi.execute("PRAGMA journal_mode=WAL")
+    ket_noi.execute("CREATE TABLE IF NOT EXISTS vi_tri (id INTEGER PRIMARY KEY CHECK (id = 0), gia_tri INTEGER NOT NULL)")
+    ket_noi.execute(
+        """CREATE TABLE IF NOT EXISTS vi_pham (
+            ten TEXT NOT NULL,
+            loai TEXT NOT NULL,
+            ngay TEXT NOT NULL,
+            PRIMARY KEY (ten, loai, ngay)
+        ) WITHOUT ROWID"""
+    )
+    return ket_noi
+
+
+class BoDemViPham:
+    """
+    Số lần vi phạm của từng thành viên theo loại vi phạm, tổng hợp từ log sự kiện.
+
+    Mỗi vi phạm được tính theo (thành viên, loại, ngày vi phạm), nên gửi lại email cho
+    cùng một ngày không làm tăng số lần. Bộ đếm lưu vị trí đã đọc trong log và chỉ đọc
+    các bản ghi mới ở lần cập nhật sau; khi lưu, chỉ các vi phạm mới được ghi thêm.
+    """
+
+    __slots__ = ("vi_tri", "_ngay_theo_ten", "_moi")
+
+    def __init__(self, vi_tri: int = 0, ngay_theo_ten: Optional[Dict[str, Dict[str, Set[str]]]] = None) -> None:
+        self.vi_tri = vi_tri
+        # {tên đã chuẩn hóa: {loại vi phạm: {ngày YYYY-MM-DD, ...}}}
+        self._ngay_theo_ten: Dict[str, Dict[str, Set[str]]] = ngay_theo_ten or {}
+        # Các vi phạm (tên, loại, ngày) chưa được lưu
+        self._moi: List[Tuple[str, str, str]] = []
+
+    def cap_nhat(self, cac_lan_chay: List[Dict]) -> None:
+        """Cộng các lần chạy mới vào bộ đếm."""
+        vi_pham: List[Tuple[str, str, str]] = []
+        for lan_chay in cac_lan_chay:
+            if lan_chay.get("vi_pham"):
+                # Lần chạy tổng hợp: mỗi vi phạm có ngày riêng
+                vi_pham.extend((ten, loai, ngay) for ten, loai, ngay in lan_chay["vi_pham"] if ngay)
+                continue
+            ngay = _ngay_vi_pham(lan_chay)
+            if not ngay:
+                continue
+            vi_pham.extend((ten, VIOLATION_LATE, ngay) for ten in lan_chay.get("di_muon") or [])
+            vi_pham.extend((ten, VIOLATION_ABSENT, ngay) for ten in lan_chay.get("vang") or [])
+        if not vi_pham:
+            return
+        cac_khoa = _chuan_hoa_ten(pd.Series([ten for ten, _, _ in vi_pham], dtype=object)).tolist()
+        for khoa, (_, loai, ngay) in zip(cac_khoa, vi_pham):
+            cac_ngay = self._ngay_theo_ten.setdefault(khoa, {}).setdefault(loai, set())
+            if ngay not in cac_ngay:
+                cac_ngay.add(ngay)
+                self._moi.append((khoa, loai, ngay))
+
+    def cac_ngay(self, cac_ten: List[str], loai: str) -> Dict[str, Set[str]]:
+        """Các ngày (YYYY-MM-DD) đã ghi nhận vi phạm loại này của từng người."""
+        if not cac_ten:
+            return {}
+        cac_khoa = _chuan_hoa_ten(pd.Series(list(cac_ten), dtype=object)).tolist()
+        return {ten: self._ngay_theo_ten.get(khoa, {}).get(loai, set()) for ten, khoa in zip(cac_ten, cac_khoa)}
+
+    def so_lan(self, cac_ten: List[str], loai: str, ngay_hien_tai: Optional[date] = None) -> Dict[str, int]:
+        """
+        Số lần vi phạm loại này của từng người, tính cả lần hiện tại (ngày ngay_hien_tai,
+        mặc định hôm nay) dù đã có trong log hay chưa.
+        """
+        hien_tai = (ngay_hien_tai or date.today()).isoformat()
+        return {
+            ten: len(cac_ngay) - (hien_tai in cac_ngay) + 1
+            for ten, cac_ngay in self.cac_ngay(cac_ten, loai).items()
+        }
+
+    def luu(self, ten_file: str, lam_lai: bool = False) -> None:
+        """Ghi các vi phạm mới và vị trí đã đọc; lam_lai xóa dữ liệu cũ trong file trước."""
+        ket_noi = _mo_bo_dem(ten_file)
+        try:
+            with ket_noi:
+                ket_noi.execute("BEGIN IMMEDIATE")
+                if lam_lai:
+                    ket_noi.execute("DELETE FROM vi_pham")
+                ket_noi.executemany("INSERT OR IGNORE INTO vi_pham (ten, loai, ngay) VALUES (?, ?, ?)", self._moi)
+                ket_noi.execute(
+                    "INSERT INTO vi_tri (id, gia_tri) VALUES (0, ?) ON CONFLICT (id) DO UPDATE SET gia_tri = excluded.gia_tri",
+                    (self.vi_tri,),
+                )
+        finally:
+            ket_noi.close()
+        self._moi = []
+
+    @classmethod
+    def tu_file(cls, ten_file: str) -> "BoDemViPham":
+        if not os.path.exists(ten_file):
+            return cls()
+        try:
+            ket_noi = _mo_bo_dem(ten_file)
+            try:
+                hang = ket_noi.execute("SELECT gia_tri FROM vi_tri WHERE id = 0").fetchone()
+                ngay_theo_ten: Dict[str, Dict[str, Set[str]]] = {}
+                for ten, loai, ngay in ket_noi.execute("SELECT ten, loai, ngay FROM vi_pham"):
+                    ngay_theo_ten.setdefault(ten, {}).setdefault(loai, set()).add(ngay)
+            finally:
+                ket_noi.close()
+        except sqlite3.Error:
+            return cls()
+        return cls(hang[0], ngay_theo_ten) if hang else cls()
+
+
+_BO_DEM_THEO_FILE: Dict[str, BoDemViPham] = {}
+
+
+def tai_bo_dem_vi_pham(ten_file_log: str = DEFAULT_EVENT_LOG_FILE) -> BoDemViPham:
+    """
+    Bộ đếm vi phạm của file log, cập nhật với các bản ghi mới kể từ lần trước.
+
+    Trạng thái được lưu trong SQLite ten_file_log + ".counts.db"; mỗi lần gọi chỉ đọc phần
+    log được ghi thêm và chỉ ghi các vi phạm mới. Nếu log bị thay thế (ngắn hơn vị trí đã
+    đọc), bộ đếm được tính lại từ đầu.
+    """
+    ten_file_dem = ten_file_log + ".counts.db"
+    duong_dan = os.path.abspath(ten_file_log)
+    with _KHOA_LOG:
+        if not os.path.exists(ten_file_log):
+            _dong_bo_chi_muc_log(ten_file_log) # Tạo log (chuyển log văn bản cũ nếu có)
+        bo_dem = _BO_DEM_THEO_FILE.get(duong_dan) or BoDemViPham.tu_file(ten_file_dem)
+        kich_thuoc = os.path.getsize(ten_file_log)
+        lam_lai = bo_dem.vi_tri > kich_thuoc
+        if lam_lai:
+            bo_dem = BoDemViPham()
+        if bo_dem.vi_tri < kich_thuoc or lam_lai:
+            cac_lan_chay = []
+            with open(ten_file_log, "rb") as f:
+                f.seek(bo_dem.vi_tri)
+                for dong in f:
+                    if not dong.endswith(b"\n"):
+                        break # Bản ghi đang ghi dở
+                    bo_dem.vi_tri += len(dong)
+                    try:
+                        ban_ghi = json.loads(dong)
+                    except ValueError:
+                        continue
+                    if ban_ghi.get("loai") == LOG_LAN_CHAY:
+                        cac_lan_chay.append(ban_ghi)
+            bo_dem.cap_nhat(cac_lan_chay)
+            bo_dem.luu(ten_file_dem, lam_lai)
+        _BO_DEM_THEO_FILE[duong_dan] = bo_dem
+    return bo_dem
+
+
 def luu_log(
     ngay_kiem_tra: int,
     gio_so_sanh: str,
@@ -371,50 +3456,78 @@ def luu_log(
     danh_sach_vang: List[str],
     ket_qua_gui: Dict[str, str],
     tieu_de: str = EMAIL_SUBJECT,
-    ten_file_log: str = "email_logs.txt"
+    ten_file_log: str = DEFAULT_EVENT_LOG_FILE,
+    vi_pham_theo_ten: Optional[Dict[str, List[Tuple[str, Optional[date]]]]] = None
 ) -> None:
     """
     Lưu thông tin log về quá trình gửi email.
 
+    Ghi một bản ghi JSON cho lần chạy và một bản ghi cho mỗi người nhận vào file log
+    JSONL, đồng thời cập nhật chỉ mục đi kèm (ten_file_log + ".idx").
+
     Args:
         ngay_kiem_tra: Ngày được kiểm tra
         gio_so_sanh: Giờ so sánh để đánh giá đi muộn
         danh_sach_di_muon: Danh sách người đi muộn
         danh_sach_vang: Danh sách người vắng
         ket_qua_gui: Kết quả gửi email
-        ten_file_log: Tên file log (mặc định: email_logs.txt)
+        ten_file_log: Tên file log (mặc định: email_logs.jsonl)
+        vi_pham_theo_ten: Chi tiết vi phạm theo ngày của lần gửi tổng hợp (tao_email_tong_hop),
+            lưu vào bản ghi để đếm số lần vi phạm đúng theo từng ngày.
     """
-    thoi_gian_hien_tai = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    thanh_cong = sum(1 for status in ket_qua_gui.values() if status == "Thành công")
-    that_bai = len(ket_qua_gui) - thanh_cong
+    bay_gio = datetime.now()
+    thoi_gian_hien_tai = bay_gio.strftime("%Y-%m-%d %H:%M:%S")
+    lan_chay = bay_gio.strftime("%Y%m%d-%H%M%S-%f")
+
+    thanh_cong = sum(1 for status in ket_qua_gui.values() if status == TRANG_THAI_THANH_CONG)
+    bo_qua = sum(1 for status in ket_qua_gui.values() if status == TRANG_THAI_DA_GUI_TRUOC)
+    that_bai = len(ket_qua_gui) - thanh_cong - bo_qua
+
+    cac_ban_ghi = [{
+        "loai": LOG_LAN_CHAY,
+        "lan_chay": lan_chay,
+        "thoi_gian": thoi_gian_hien_tai,
+        "ngay_kiem_tra": ngay_kiem_tra,
+        "ngay_vi_pham": None,
+        "gio_so_sanh": gio_so_sanh,
+        "tieu_de": tieu_de,
+        "di_muon": list(danh_sach_di_muon),
+        "vang": list(danh_sach_vang),
+        "thanh_cong": thanh_cong,
+        "that_bai": that_bai,
+        "bo_qua": bo_qua,
+    }]
+    cac_ban_ghi[0]["ngay_vi_pham"] = _ngay_vi_pham(cac_ban_ghi[0])
+    if vi_pham_theo_ten:
+        cac_ban_ghi[0]["vi_pham"] = [
+            [ten, loai, ngay.isoformat() if ngay else None]
+            for ten, cac_vi_pham in vi_pham_theo_ten.items() for loai, ngay in cac_vi_pham
+        ]
+    cac_ban_ghi.extend(
+        {"loai": LOG_NGUOI_NHAN, "lan_chay": lan_chay, "thoi_gian": thoi_gian_hien_tai, "email": email, "trang_thai": trang_thai}
+        for email, trang_thai in ket_qua_gui.items()
+    )
 
     try:
-        with open(ten_file_log, "a", encoding="utf-8") as f:
-            f.write(f"\n{'='*50}\n")
-            f.write(f"Thời gian ghi log: {thoi_gian_hien_tai}\n")
-            f.write(f"Ngày kiểm tra: {ngay_kiem_tra}\n")
-            f.write(f"Giờ so sánh: {gio_so_sanh}\n")
-            f.write(f"Tiêu đề email: {tieu_de}\n\n")
-            
-            f.write("DANH SÁCH VI PHẠM:\n")
-            if danh_sach_di_muon:
-                f.write(f"Đi muộn ({len(danh_sach_di_muon)}):\n")
-                for ten in danh_sach_di_muon:
-                    f.write(f"- {ten}\n")
-            
-            if danh_sach_vang:
-                f.write(f"\nVắng mặt ({len(danh_sach_vang)}):\n")
-                for ten in danh_sach_vang:
-                    f.write(f"- {ten}\n")
-            
-            f.write("\nKẾT QUẢ GỬI EMAIL:\n")
-            for email, trang_thai in ket_qua_gui.items():
-                f.write(f"- {email}: {trang_thai}\n")
-            
-            f.write(f"\nTổng kết: Thành công: {thanh_cong}, Thất bại: {that_bai}\n")
-            f.write(f"{'='*50}\n")
-            
+        with _KHOA_LOG:
+            _dong_bo_chi_muc_log(ten_file_log)
+            muc_moi = []
+            with open(ten_file_log, "ab+") as f:
+                vi_tri = f.seek(0, os.SEEK_END)
+                if vi_tri:
+                    # Kết thúc dòng ghi dở (nếu có) để bản ghi mới không bị dính vào
+                    f.seek(vi_tri - 1)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                        vi_tri += 1
+                for ban_ghi in cac_ban_ghi:
+                    dong = (json.dumps(ban_ghi, ensure_ascii=False) + "\n").encode("utf-8")
+                    f.write(dong)
+                    muc_moi.append(_muc_chi_muc(ban_ghi, vi_tri, len(dong)))
+                    vi_tri += len(dong)
+            with open(ten_file_log + ".idx", "ab") as f:
+                np.array(muc_moi, dtype=KIEU_CHI_MUC_LOG).tofile(f)
+
         print(f"\nĐã lưu log thành công vào file {ten_file_log}")
     except Exception as e:
         print(f"Lỗi khi lưu log: {str(e)}")
@@ -459,7 +3572,9 @@ def main():
     print(f"Danh sách vắng ban đầu ({len(danh_sach_vang_ban_dau)}): {danh_sach_vang_ban_dau}")
 
     print("\n--- Loại bỏ người nghỉ phép khỏi danh sách vắng ---")
-    danh_sach_vang_sau_loc = loai_bo_nguoi_nghi_phep(danh_sach_vang_ban_dau)
+    danh_sach_vang_sau_loc = loai_bo_nguoi_nghi_phep(
+        danh_sach_vang_ban_dau, ngay=ngay_kiem_tra_gan_nhat(ngay_can_kiem_tra)
+    )
     nguoi_bi_loai = len(danh_sach_vang_ban_dau) - len(danh_sach_vang_sau_loc)
     if nguoi_bi_loai > 0:
         print(f"Đã loại bỏ {nguoi_bi_loai} người nghỉ phép.")
@@ -469,31 +3584,30 @@ def main():
         print("\nKhông có ai đi muộn hoặc vắng cần gửi email. Kết thúc.")
         return
 
-    print("\n--- Tạo nội dung email ---")
-    emails_can_gui = tao_noi_dung_email(danh_sach_vang_sau_loc, danh_sach_di_muon)
-
-    if not emails_can_gui:
-        print("Không tạo được nội dung email nào (có thể do lỗi file hoặc không tìm thấy email).")
-        return
-
-    # In ra để kiểm tra (tùy chọn)
-    # print("\nNội dung email sẽ gửi:")
-    # for email, noi_dung in emails_can_gui.items():
-    #     print(f"\nTo: {email}")
-    #     print("--- Start Content ---")
-    #     print(noi_dung)
-    #     print("--- End Content ---")
-    #     print("-" * 50)
-
     # Xác nhận trước khi gửi (tùy chọn)
-    confirm = input(f"\nTìm thấy {len(emails_can_gui)} email cần gửi. Bạn có muốn gửi không? (y/n): ").lower()
+    so_vi_pham = len(danh_sach_di_muon) + len(danh_sach_vang_sau_loc)
+    confirm = input(f"\nTìm thấy {so_vi_pham} vi phạm cần gửi email. Bạn có muốn gửi không? (y/n): ").lower()
     if confirm != 'y':
         print("Đã hủy gửi email.")
         return
 
-    # Gửi email
-    print("\n--- Bắt đầu gửi email ---")
-    ket_qua_gui = gui_email(emails_can_gui, tieu_de)
+    # Tạo và gửi email theo từng đợt qua hộp thư đi: bộ nhớ chỉ giữ một đợt và nếu bị
+    # gián đoạn, chạy lại không gửi trùng các email đã gửi
+    print("\n--- Bắt đầu tạo và gửi email ---")
+    ngay_vi_pham = ngay_kiem_tra_gan_nhat(ngay_can_kiem_tra)
+    ket_qua_gui = gui_qua_hop_thu_di(
+        tao_noi_dung_email_dong(
+            vi_pham_ngay_dong(ngay_can_kiem_tra, gio_vao_so_sanh, ngay=ngay_vi_pham),
+            ten_file_log=DEFAULT_EVENT_LOG_FILE,
+            ngay_vi_pham=ngay_vi_pham,
+            ten_file_so_cai=DEFAULT_LEDGER_FILE
+        ),
+        tieu_de,
+        ten_file_so_cai=DEFAULT_LEDGER_FILE
+    )
+
+    if not ket_qua_gui:
+        print("Không có email nào được gửi (đã gửi trước đó, lỗi file hoặc không tìm thấy email).")
 
     # In kết quả
     print("\n--- Kết quả gửi email ---")
@@ -501,9 +3615,9 @@ def main():
     that_bai_count = 0
     for email, trang_thai in ket_qua_gui.items():
         print(f"{email}: {trang_thai}")
-        if trang_thai == "Thành công":
+        if trang_thai == TRANG_THAI_THANH_CONG:
             thanh_cong_count += 1
-        else:
+        elif trang_thai != TRANG_THAI_DA_GUI_TRUOC:
             that_bai_count +=1
     print(f"\nTổng kết: Gửi thành công {thanh_cong_count} email, thất bại {that_bai_count} email.")
 
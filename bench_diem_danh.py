@@ -0,0 +1,406 @@
+"""
+Đo hiệu năng đọc và xử lý bảng điểm danh với các file Excel tổng hợp.
+
+File điểm danh được sinh theo đúng bố cục danh_gia_di_muon_vang đọc: hàng
+HEADER_ROW_INDEX ghi số ngày (mỗi ngày 4 cột: trạng thái, In, Out, Hours), mỗi thành
+viên chiếm ROW_INCREMENT hàng bắt đầu từ DATA_START_ROW_INDEX, tên ở cột
+NAME_COLUMN_INDEX. Ô giờ vào được trộn lẫn như file thật: chuỗi 'HH:MM' (có khi thừa
+khoảng trắng), datetime.time, ô trống, 'N/A' và các giá trị không hợp lệ ('18h30',
+'25:10', số thực...). Kèm theo là file nghỉ phép và danh bạ email tương ứng.
+
+Mỗi cấu hình (số thành viên x số ngày trong tháng) đo riêng từng bước:
+    doc        _doc_excel_streaming: đọc và phân tích file .xlsx (không qua cache)
+    danh_gia   tao_ma_tran_diem_danh + danh_gia_di_muon_vang (dữ liệu đã đọc sẵn)
+    nghi_phep  đọc file nghỉ phép, loc_ma_tran_nghi_phep và loai_bo_nguoi_nghi_phep
+    tao_email  tao_noi_dung_email cho các vi phạm của một ngày
+
+Kết quả được ghi thêm vào file JSON lines (mặc định bench_diem_danh.jsonl) và so với
+lần đo trước cùng cấu hình; bước nào chậm hơn quá ngưỡng được báo và lệnh trả về mã 1.
+
+Ví dụ:
+    python bench_diem_danh.py
+    python bench_diem_danh.py --so-thanh-vien 50 1000 20000 --so-ngay 28 29 30 31
+    python bench_diem_danh.py --so-thanh-vien 5000 --lap 5 --nguong 0.1
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import zipfile
+from datetime import date, datetime, time, timedelta
+from statistics import median
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from openpyxl.utils import get_column_letter
+
+import attendance_checker as ac
+
+DEFAULT_MEMBER_COUNTS = [50, 1000, 5000, 20000]
+DEFAULT_DAY_COUNTS = [28, 31]
+DEFAULT_RESULTS_FILE = "bench_diem_danh.jsonl"
+DEFAULT_DATA_DIR = "bench_data" # Generated workbooks, reused while the generator parameters stay the same
+DEFAULT_REPEATS = 3
+DEFAULT_REGRESSION_THRESHOLD = 0.2 # Report a stage as slower when its median grows by more than this fraction
+DEFAULT_MESSY_RATIO = 0.02 # Share of 'In' cells holding malformed values
+REGRESSION_MIN_SECONDS = 0.005 # Ignore slowdowns smaller than this (timer noise on tiny inputs)
+BENCH_SEED = 2025
+BENCH_CHECK_TIME = "18:30"
+BENCH_CHECK_DAY = 15
+CAC_BUOC = ("doc", "danh_gia", "nghi_phep", "tao_email")
+
+# Tháng có đúng số ngày cần đo (năm 2024 nhuận cho tháng 2 có 29 ngày)
+THANG_THEO_SO_NGAY = {28: date(2025, 2, 1), 29: date(2024, 2, 1), 30: date(2025, 4, 1), 31: date(2025, 3, 1)}
+COT_MOI_NGAY = 4 # Trạng thái, In, Out, Hours
+GIO_KHONG_HOP_LE = ("18h30", "25:10", "18:75", "?", "--", "18.30", "quên chấm công", 0.77)
+THU_TRONG_TUAN = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# Các phần cố định của một file .xlsx một sheet; style 1 là định dạng giờ h:mm:ss (numFmtId 21)
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_NS = "http://schemas.openxmlformats.org"
+XLSX_PARTS = {
+    "[Content_Types].xml": _XML + f'<Types xmlns="{_NS}/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>',
+    "_rels/.rels": _XML + f'<Relationships xmlns="{_NS}/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{_NS}/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    "xl/workbook.xml": _XML + f'<workbook xmlns="{_NS}/spreadsheetml/2006/main" xmlns:r="{_NS}/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Timesheet" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    "xl/_rels/workbook.xml.rels": _XML + f'<Relationships xmlns="{_NS}/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{_NS}/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{_NS}/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>'
+        f'<Relationship Id="rId3" Type="{_NS}/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>',
+    "xl/styles.xml": _XML + f'<styleSheet xmlns="{_NS}/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="21" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>',
+}
+
+
+def _gio_vao_ngau_nhien(rng: random.Random, ty_le_loi: float) -> object:
+    """Một ô 'In' ngẫu nhiên với tỉ lệ các dạng giá trị gần giống file thật."""
+    x = rng.random()
+    if x < ty_le_loi:
+        return rng.choice(GIO_KHONG_HOP_LE)
+    x = (x - ty_le_loi) / (1 - ty_le_loi)
+    if x < 0.15:
+        return None # Vắng
+    if x < 0.17:
+        return "N/A" # Đọc như ô trống
+    phut = rng.randint(17 * 60 + 30, 19 * 60 + 30)
+    if x < 0.30:
+        return time(phut // 60, phut % 60, rng.choice((0, 0, 0, 42)))
+    gio = f"{phut // 60:02d}:{phut % 60:02d}"
+    return f" {gio} " if x < 0.35 else gio
+
+
+def _ghi_xlsx(duong_dan: str, cac_hang: Iterable[List[object]]) -> None:
+    """
+    Ghi một sheet .xlsx theo luồng, chuỗi nằm trong bảng sharedStrings như file Excel thật.
+
+    (Chế độ write_only của openpyxl ghi chuỗi inline, đọc lại chậm hơn nhiều so với file
+    xuất từ Excel nên sẽ làm lệch kết quả đo bước đọc.) Ô datetime.time được ghi dạng
+    phân số của ngày với định dạng giờ, để openpyxl đọc lại thành datetime.time.
+    """
+    chuoi: Dict[str, int] = {}
+    ten_cot: List[str] = []
+    with zipfile.ZipFile(duong_dan, "w", zipfile.ZIP_DEFLATED) as z:
+        for ten, noi_dung in XLSX_PARTS.items():
+            z.writestr(ten, noi_dung)
+        with z.open("xl/worksheets/sheet1.xml", "w") as f:
+            f.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            for so_hang, hang in enumerate(cac_hang, start=1):
+                while len(ten_cot) < len(hang):
+                    ten_cot.append(get_column_letter(len(ten_cot) + 1))
+                o = []
+                for cot, gia_tri in enumerate(hang):
+                    if gia_tri is None:
+                        continue
+                    vi_tri = f"{ten_cot[cot]}{so_hang}"
+                    if isinstance(gia_tri, str):
+                        o.append(f'<c r="{vi_tri}" t="s"><v>{chuoi.setdefault(gia_tri, len(chuoi))}</v></c>')
+                    elif isinstance(gia_tri, time):
+                        phan_ngay = (gia_tri.hour * 3600 + gia_tri.minute * 60 + gia_tri.second) / 86400
+                        o.append(f'<c r="{vi_tri}" s="1"><v>{phan_ngay!r}</v></c>')
+                    else:
+                        o.append(f'<c r="{vi_tri}"><v>{gia_tri!r}</v></c>')
+                f.write(f'<row r="{so_hang}">{"".join(o)}</row>'.encode("utf-8"))
+            f.write(b"</sheetData></worksheet>")
+        with z.open("xl/sharedStrings.xml", "w") as f:
+            f.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<sst xmlns='
+                    f'"http://schemas.openxmlformats.org/spreadsheetml/2006/main" uniqueCount="{len(chuoi)}">'.encode())
+            for gia_tri in chuoi:
+                f.write(f'<si><t xml:space="preserve">{escape(gia_tri)}</t></si>'.encode("utf-8"))
+            f.write(b"</sst>")
+
+
+def _cac_hang_diem_danh(so_thanh_vien: int, thang: date, so_ngay: int, ty_le_loi: float) -> Iterator[List[object]]:
+    """Các hàng của file điểm danh, theo bố cục của file xuất từ máy chấm công."""
+    rng = random.Random(BENCH_SEED)
+    ky = f"{thang:%d/%m/%Y} To {thang + timedelta(days=so_ngay - 1):%d/%m/%Y}"
+    so_cot = 2 + COT_MOI_NGAY * so_ngay
+    yield ["EzWork"] + ["ESL TIMESHEET"] * (so_cot - 1)
+    yield ["EzWork"] + ["ESL TIMESHEET"] * (so_cot - 1)
+    yield ["EzWork"] + [ky] * (so_cot - 1)
+    for hang in range(3, ac.DATA_START_ROW_INDEX):
+        if hang == ac.HEADER_ROW_INDEX:
+            yield ["Fullname", "Shift name"] + [n for n in range(1, so_ngay + 1) for _ in range(COT_MOI_NGAY)]
+        elif hang == ac.HEADER_ROW_INDEX + 1:
+            yield ["Fullname", "Shift name"] + [
+                THU_TRONG_TUAN[(thang + timedelta(days=n)).weekday()] for n in range(so_ngay) for _ in range(COT_MOI_NGAY)
+            ]
+        else:
+            yield ["Fullname", "Shift name"] + [None, "In", "Out", "Hours"] * so_ngay
+
+    for i in range(so_thanh_vien):
+        hang_chinh: List[object] = [ten_thanh_vien(i), "Cả ngày"]
+        for _ in range(so_ngay):
+            gio_vao = _gio_vao_ngau_nhien(rng, ty_le_loi)
+            if gio_vao is None:
+                hang_chinh += [None, None, None, None]
+            else:
+                hang_chinh += ["X", gio_vao, "20:00", 1.5]
+        yield hang_chinh
+        for _ in range(ac.ROW_INCREMENT - 1):
+            yield [ten_thanh_vien(i), "AH/CL/LE"] + ["-", "-", "-", None] * so_ngay
+
+
+def tao_file_diem_danh(duong_dan: str, so_thanh_vien: int, thang: date, so_ngay: int, ty_le_loi: float) -> None:
+    """Sinh file điểm danh .xlsx có so_thanh_vien thành viên cho so_ngay ngày đầu của thang."""
+    _ghi_xlsx(duong_dan, _cac_hang_diem_danh(so_thanh_vien, thang, so_ngay, ty_le_loi))
+
+
+def ten_thanh_vien(i: int) -> str:
+    return f"Thành Viên {i:05d}"
+
+
+def tao_file_phu(thu_muc: str, so_thanh_vien: int, thang: date, so_ngay: int) -> Tuple[str, str]:
+    """Sinh file nghỉ phép (khoảng 5% thành viên) và danh bạ email; trả về (file nghỉ phép, file email)."""
+    rng = random.Random(BENCH_SEED + 1)
+    file_nghi_phep = os.path.join(thu_muc, f"leave_{so_thanh_vien}_{so_ngay}.txt")
+    with open(file_nghi_phep, "w", encoding="utf-8") as f:
+        for i in rng.sample(range(so_thanh_vien), max(1, so_thanh_vien // 20)):
+            # Viết tên khác hoa thường / thừa khoảng trắng để đi qua bước chuẩn hóa tên
+            ten = ten_thanh_vien(i).upper() if i % 2 else f" {ten_thanh_vien(i)}"
+            tu_ngay = thang + timedelta(days=rng.randrange(so_ngay))
+            kieu = rng.random()
+            if kieu < 0.1:
+                f.write(f"{ten}\n")
+            elif kieu < 0.5:
+                f.write(f"{ten}, {tu_ngay:%Y-%m-%d}\n")
+            else:
+                den_ngay = tu_ngay + timedelta(days=rng.randint(1, 5))
+                f.write(f"{ten}, {tu_ngay:%d/%m/%Y}, {den_ngay:%d/%m/%Y}, Việc gia đình\n")
+    file_email = os.path.join(thu_muc, f"emails_{so_thanh_vien}.csv")
+    with open(file_email, "w", encoding="utf-8") as f:
+        f.write("ten,email\n")
+        for i in range(so_thanh_vien):
+            f.write(f"{ten_thanh_vien(i)},thanh.vien{i}@example.com\n")
+    return file_nghi_phep, file_email
+
+
+def _do_thoi_gian(ham: Callable[[], object], so_lan: int) -> List[float]:
+    """Chạy ham so_lan lần, trả về thời gian (giây) của từng lần."""
+    cac_lan = []
+    for _ in range(so_lan):
+        bat_dau = perf_counter()
+        ham()
+        cac_lan.append(perf_counter() - bat_dau)
+    return cac_lan
+
+
+def _phien_ban_ma_nguon() -> Optional[str]:
+    """Commit git hiện tại (kèm '+' nếu có thay đổi chưa commit), để đối chiếu kết quả."""
+    thu_muc = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=thu_muc,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        thay_doi = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=thu_muc,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+" if thay_doi else "")
+
+
+def do_mot_cau_hinh(so_thanh_vien: int, so_ngay: int, tham_so: argparse.Namespace) -> Dict[str, object]:
+    """Sinh (hoặc dùng lại) dữ liệu cho một cấu hình và đo từng bước."""
+    thang = THANG_THEO_SO_NGAY[so_ngay]
+    ngay_kiem_tra = thang.replace(day=BENCH_CHECK_DAY)
+    os.makedirs(tham_so.thu_muc_du_lieu, exist_ok=True)
+    file_excel = os.path.join(
+        tham_so.thu_muc_du_lieu, f"diem_danh_{so_thanh_vien}_{so_ngay}_{tham_so.ty_le_loi:g}.xlsx"
+    )
+    if not os.path.exists(file_excel):
+        bat_dau = perf_counter()
+        tao_file_diem_danh(file_excel, so_thanh_vien, thang, so_ngay, tham_so.ty_le_loi)
+        print(f"Đã sinh {file_excel} ({perf_counter() - bat_dau:.1f} giây)", file=sys.stderr)
+    file_nghi_phep, file_email = tao_file_phu(tham_so.thu_muc_du_lieu, so_thanh_vien, thang, so_ngay)
+    file_mau = os.path.join(os.path.dirname(os.path.abspath(__file__)), ac.DEFAULT_EMAIL_TEMPLATE_FILE)
+    so_lan = tham_so.lap
+
+    thoi_gian: Dict[str, List[float]] = {}
+    ket_qua_doc: Dict = {}
+
+    def doc() -> None:
+        du_lieu, loi = ac._doc_excel_streaming(file_excel)
+        if loi:
+            raise RuntimeError(loi)
+        ket_qua_doc["du_lieu"] = du_lieu
+
+    thoi_gian["doc"] = _do_thoi_gian(doc, so_lan)
+
+    # Cache điểm danh trên đĩa (DEFAULT_CACHE_DIR) nằm trong thư mục tạm
+    thu_muc_cu = os.getcwd()
+    with tempfile.TemporaryDirectory() as thu_muc_tam, open(os.devnull, "w", encoding="utf-8") as bo_qua:
+        file_excel, file_nghi_phep, file_email = (
+            os.path.abspath(os.path.join(thu_muc_cu, f)) for f in (file_excel, file_nghi_phep, file_email)
+        )
+        os.chdir(thu_muc_tam)
+        try:
+            with contextlib.redirect_stdout(bo_qua):
+                ma_tran, loi = ac.tao_ma_tran_diem_danh(BENCH_CHECK_TIME, file_excel) # Đọc sẵn vào cache
+                if loi:
+                    raise RuntimeError(loi)
+                ket_qua_ngay: Dict[str, List[str]] = {}
+
+                def danh_gia() -> None:
+                    ac.tao_ma_tran_diem_danh(BENCH_CHECK_TIME, file_excel)
+                    ket_qua_ngay.update(ac.danh_gia_di_muon_vang(BENCH_CHECK_DAY, BENCH_CHECK_TIME, file_excel))
+
+                def nghi_phep() -> None:
+                    ac._KHO_NGHI_PHEP_THEO_FILE.clear() # Tính cả bước đọc file nghỉ phép
+                    ac.loc_ma_tran_nghi_phep(ma_tran, file_nghi_phep, thang)
+                    ket_qua_ngay["vang_sau_loc"] = ac.loai_bo_nguoi_nghi_phep(
+                        ket_qua_ngay["vang"], file_nghi_phep, ngay=ngay_kiem_tra
+                    )
+
+                emails: Dict[str, str] = {}
+
+                def tao_email() -> None:
+                    emails.clear()
+                    emails.update(ac.tao_noi_dung_email(
+                        ket_qua_ngay["vang_sau_loc"], ket_qua_ngay["di_muon"], file_email, file_mau,
+                        ten_file_log=None, ngay_vi_pham=ngay_kiem_tra, ten_file_so_cai=None,
+                    ))
+
+                thoi_gian["danh_gia"] = _do_thoi_gian(danh_gia, so_lan)
+                thoi_gian["nghi_phep"] = _do_thoi_gian(nghi_phep, so_lan)
+                thoi_gian["tao_email"] = _do_thoi_gian(tao_email, so_lan)
+        finally:
+            os.chdir(thu_muc_cu)
+
+    du_lieu = ket_qua_doc["du_lieu"]
+    return {
+        "thoi_diem": datetime.now().isoformat(timespec="seconds"),
+        "phien_ban": _phien_ban_ma_nguon(),
+        "so_thanh_vien": so_thanh_vien,
+        "so_ngay": so_ngay,
+        "ty_le_loi": tham_so.ty_le_loi,
+        "lap": so_lan,
+        # Số liệu kiểm tra: đổi bất thường nghĩa là kết quả phân tích đã thay đổi, không chỉ tốc độ
+        "thanh_vien_doc_duoc": len(du_lieu["ten"]),
+        "o_loi": len(du_lieu["o_loi"]),
+        "vang": len(ket_qua_ngay["vang"]),
+        "vang_sau_loc": len(ket_qua_ngay["vang_sau_loc"]),
+        "di_muon": len(ket_qua_ngay["di_muon"]),
+        "email": len(emails),
+        "trung_vi_s": {buoc: round(median(thoi_gian[buoc]), 6) for buoc in CAC_BUOC},
+        "nhanh_nhat_s": {buoc: round(min(thoi_gian[buoc]), 6) for buoc in CAC_BUOC},
+    }
+
+
+def _lan_do_truoc(ten_file_ket_qua: str) -> Dict[Tuple, Dict[str, object]]:
+    """Lần đo gần nhất của mỗi cấu hình (so_thanh_vien, so_ngay, ty_le_loi) trong file kết quả."""
+    truoc: Dict[Tuple, Dict[str, object]] = {}
+    try:
+        with open(ten_file_ket_qua, "r", encoding="utf-8") as f:
+            for dong in f:
+                try:
+                    ban_ghi = json.loads(dong)
+                    truoc[(ban_ghi["so_thanh_vien"], ban_ghi["so_ngay"], ban_ghi["ty_le_loi"])] = ban_ghi
+                except (ValueError, KeyError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return truoc
+
+
+def so_sanh_lan_truoc(
+    ket_qua: Dict[str, object],
+    truoc: Optional[Dict[str, object]],
+    nguong: float = DEFAULT_REGRESSION_THRESHOLD
+) -> List[str]:
+    """Các bước có trung vị chậm hơn lần đo trước quá nguong (và quá REGRESSION_MIN_SECONDS)."""
+    if not truoc:
+        return []
+    cham_hon = []
+    for buoc in CAC_BUOC:
+        cu = truoc.get("trung_vi_s", {}).get(buoc)
+        moi = ket_qua["trung_vi_s"][buoc]
+        if cu and moi - cu > REGRESSION_MIN_SECONDS and moi > cu * (1 + nguong):
+            cham_hon.append(f"{buoc}: {cu * 1000:.1f} ms -> {moi * 1000:.1f} ms (+{(moi / cu - 1) * 100:.0f}%)")
+    return cham_hon
+
+
+def _doc_tham_so(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Đo hiệu năng đọc và xử lý bảng điểm danh.")
+    parser.add_argument("--so-thanh-vien", type=int, nargs="+", default=DEFAULT_MEMBER_COUNTS)
+    parser.add_argument("--so-ngay", type=int, nargs="+", default=DEFAULT_DAY_COUNTS,
+                        choices=sorted(THANG_THEO_SO_NGAY))
+    parser.add_argument("--ty-le-loi", type=float, default=DEFAULT_MESSY_RATIO,
+                        help="Tỉ lệ ô 'In' chứa giá trị không hợp lệ.")
+    parser.add_argument("--lap", type=int, default=DEFAULT_REPEATS, help="Số lần đo mỗi bước (lấy trung vị).")
+    parser.add_argument("--thu-muc-du-lieu", default=DEFAULT_DATA_DIR, help="Nơi lưu các file tổng hợp đã sinh.")
+    parser.add_argument("--ket-qua", default=DEFAULT_RESULTS_FILE, help="File JSON lines lưu kết quả.")
+    parser.add_argument("--nguong", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="Mức chậm hơn lần đo trước (tỉ lệ) bị coi là suy giảm.")
+    parser.add_argument("--khong-luu", action="store_true", help="Chỉ so sánh, không ghi kết quả.")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    tham_so = _doc_tham_so(argv)
+    truoc = _lan_do_truoc(tham_so.ket_qua)
+    suy_giam: List[str] = []
+
+    print(f"{'thành viên':>10} {'ngày':>4} " + " ".join(f"{buoc + ' ms':>13}" for buoc in CAC_BUOC))
+    for so_thanh_vien in tham_so.so_thanh_vien:
+        for so_ngay in tham_so.so_ngay:
+            ket_qua = do_mot_cau_hinh(so_thanh_vien, so_ngay, tham_so)
+            print(f"{so_thanh_vien:>10} {so_ngay:>4} "
+                  + " ".join(f"{ket_qua['trung_vi_s'][buoc] * 1000:>13.1f}" for buoc in CAC_BUOC), flush=True)
+            for dong in so_sanh_lan_truoc(ket_qua, truoc.get((so_thanh_vien, so_ngay, tham_so.ty_le_loi)), tham_so.nguong):
+                suy_giam.append(f"{so_thanh_vien} thành viên x {so_ngay} ngày - {dong}")
+            if not tham_so.khong_luu:
+                with open(tham_so.ket_qua, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(ket_qua, ensure_ascii=False) + "\n")
+
+    if suy_giam:
+        print("\nChậm hơn lần đo trước:")
+        for dong in suy_giam:
+            print(f"  {dong}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""
+Đo tải gửi email đầu-cuối với máy chủ SMTP giả lập chạy trong cùng tiến trình.
+
+Mỗi lần đo tạo một lô email tổng hợp (nội dung điền từ Mau_Email.txt) rồi gửi qua
+gui_email / gui_email_dong / gui_email_dong_bo tới MayChuSmtpGia. Máy chủ giả lập nói
+đúng giao thức SMTP (EHLO, AUTH, MAIL, RCPT, DATA) nhưng không giữ nội dung thư, và có
+thể thêm độ trễ, trả lời 451 để giả lập bị giới hạn tốc độ, hoặc ngắt kết nối sau mỗi
+N thư. Mỗi kích thước lô chạy trong một tiến trình con riêng để RSS đỉnh không bị lẫn
+giữa các lần đo.
+
+Kết quả: số email/giây, độ trễ p50/p99 của mỗi lần gửi một email (một phiên
+MAIL/RCPT/DATA) và RSS đỉnh.
+
+Ví dụ:
+    python bench_gui_email.py
+    python bench_gui_email.py --so-luong 100 1000 10000 50000 --do-tre 0.005 --ti-le-451 0.01
+    python bench_gui_email.py --che-do dong_bo --ngat-moi 500 --luu bench_gui_email.jsonl
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from time import monotonic, sleep
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import attendance_checker as ac
+
+DEFAULT_BATCH_SIZES = [100, 1000, 10000, 50000]
+CAC_CHE_DO = ("pool", "dong", "dong_bo") # gui_email, gui_email_dong, gui_email_dong_bo
+BENCH_SENDER = "bench@example.com"
+BENCH_DOMAIN = "example.com"
+
+
+class _PhienSmtpGia(socketserver.StreamRequestHandler):
+    """Một phiên SMTP với MayChuSmtpGia."""
+
+    def _tra_loi(self, dong: bytes) -> None:
+        self.wfile.write(dong + b"\r\n")
+
+    def handle(self) -> None:
+        may_chu: "MayChuSmtpGia" = self.server
+        self._tra_loi(b"220 bench ESMTP")
+        while True:
+            dong = self.rfile.readline()
+            if not dong:
+                return
+            lenh = dong[:4].upper()
+            if lenh in (b"EHLO", b"HELO"):
+                self.wfile.write(b"250-bench\r\n250-AUTH PLAIN LOGIN\r\n250 SIZE 52428800\r\n")
+            elif lenh == b"AUTH":
+                self._tra_loi(b"235 2.7.0 Authentication successful")
+            elif lenh == b"MAIL":
+                if may_chu.ti_le_451 and random.random() < may_chu.ti_le_451:
+                    may_chu.dem("so_451")
+                    self._tra_loi(b"451 4.7.1 Try again later")
+                else:
+                    self._tra_loi(b"250 2.1.0 OK")
+            elif lenh == b"DATA":
+                self._tra_loi(b"354 End data with <CR><LF>.<CR><LF>")
+                so_byte = 0
+                while True:
+                    dong = self.rfile.readline()
+                    if dong in (b".\r\n", b""):
+                        break
+                    so_byte += len(dong)
+                if not dong:
+                    return
+                so_thu = may_chu.dem("so_thu", so_byte)
+                if may_chu.do_tre:
+                    sleep(may_chu.do_tre)
+                if may_chu.ngat_moi and so_thu % may_chu.ngat_moi == 0:
+                    # Ngắt trước khi xác nhận: phía gửi phải gửi lại thư này
+                    may_chu.dem("so_lan_ngat")
+                    return
+                self._tra_loi(b"250 2.0.0 Queued")
+            elif lenh == b"QUIT":
+                self._tra_loi(b"221 2.0.0 Bye")
+                return
+            else: # RCPT, RSET, NOOP
+                self._tra_loi(b"250 2.0.0 OK")
+
+
+class MayChuSmtpGia(socketserver.ThreadingTCPServer):
+    """
+    Máy chủ SMTP giả lập chạy trên 127.0.0.1 (cổng ngẫu nhiên) trong một thread nền.
+
+    Args:
+        do_tre: Số giây chờ sau khi nhận xong mỗi thư, trước khi trả lời 250.
+        ti_le_451: Xác suất trả lời 451 cho lệnh MAIL (giả lập bị giới hạn tốc độ).
+        ngat_moi: Ngắt kết nối (không trả lời) sau mỗi ngat_moi thư nhận được (0: không ngắt).
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, do_tre: float = 0.0, ti_le_451: float = 0.0, ngat_moi: int = 0) -> None:
+        super().__init__(("127.0.0.1", 0), _PhienSmtpGia)
+        self.do_tre = do_tre
+        self.ti_le_451 = ti_le_451
+        self.ngat_moi = ngat_moi
+        self.thong_ke = {"so_thu": 0, "so_byte": 0, "so_451": 0, "so_lan_ngat": 0}
+        self._khoa = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def cong(self) -> int:
+        return self.server_address[1]
+
+    def dem(self, ten: str, so_byte: int = 0) -> int:
+        """Tăng bộ đếm ten (và tổng số byte nhận); trả về giá trị mới của bộ đếm."""
+        with self._khoa:
+            self.thong_ke[ten] += 1
+            self.thong_ke["so_byte"] += so_byte
+            return self.thong_ke[ten]
+
+
+def tao_lo_email(so_luong: int) -> Iterator[Tuple[str, str]]:
+    """Sinh so_luong cặp (email, nội dung) với nội dung điền từ mẫu email của dự án."""
+    try:
+        mau = ac.tai_mau_email(ac.DEFAULT_EMAIL_TEMPLATE_FILE)
+    except OSError:
+        mau = ac.bien_dich_mau_email(f"Chào {ac.PLACEHOLDER_NAME},\n\nLỗi vi phạm: {ac.PLACEHOLDER_REASON}\n")
+    for i in range(so_luong):
+        yield f"thanh.vien{i}@{BENCH_DOMAIN}", mau.dien({
+            ac.PLACEHOLDER_NAME: f"Thành viên {i}",
+            ac.PLACEHOLDER_REASON: ac.VIOLATION_LATE if i % 3 else ac.VIOLATION_ABSENT,
+            ac.PLACEHOLDER_COUNT: str(i % 4 + 1),
+            ac.PLACEHOLDER_FINE: f"{(i % 4 + 1) * 20000:,}",
+            ac.PLACEHOLDER_DEADLINE: "30/04/2025",
+        })
+
+
+def _phan_vi_ms(cac_gia_tri: List[float], phan_vi: float) -> Optional[float]:
+    return round(float(np.percentile(cac_gia_tri, phan_vi)) * 1000, 2) if cac_gia_tri else None
+
+
+def do_mot_lan(so_luong: int, tham_so: argparse.Namespace) -> Dict[str, object]:
+    """Gửi một lô so_luong email tới máy chủ giả lập và trả về số liệu đo."""
+    may_chu = MayChuSmtpGia(tham_so.do_tre, tham_so.ti_le_451, tham_so.ngat_moi)
+    os.environ.update({
+        "EMAIL_TRANSPORT": ac.KENH_SMTP,
+        "EMAIL_ADDRESS": BENCH_SENDER,
+        "EMAIL_PASSWORD": "bench",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(may_chu.cong),
+        "SMTP_STARTTLS": "0",
+        "SMTP_POOL_SIZE": str(tham_so.pool),
+        "EMAIL_DAILY_QUOTA": "0",
+        "EMAIL_MINUTE_QUOTA": "0",
+        "EMAIL_ATTACHMENTS": "",
+    })
+    for i in range(2, ac.SMTP_MAX_ACCOUNTS + 1):
+        os.environ.pop(f"EMAIL_ADDRESS_{i}", None) # Chỉ đo với một tài khoản gửi
+    if tham_so.toc_do_toi_da > 0:
+        ac.SMTP_MAX_RATE = tham_so.toc_do_toi_da
+        os.environ["SMTP_RATE_LIMIT"] = str(min(ac.SMTP_DEFAULT_RATE, tham_so.toc_do_toi_da))
+    else:
+        # Bỏ điều tiết tốc độ để đo giới hạn của chính luồng gửi
+        ac.SMTP_MAX_RATE = float("inf")
+        os.environ["SMTP_RATE_LIMIT"] = "1e9"
+
+    # Đo thời gian của từng lần gửi thành công; lần bị 451 / mất kết nối chỉ được đếm
+    do_tre_gui: List[float] = []
+    so_lan_loi = [0]
+    gui_mot_email_goc = ac._gui_mot_email
+
+    def gui_mot_email_co_do(server, nha_may, email_nhan, noi_dung):
+        bat_dau = monotonic()
+        try:
+            ket_qua = gui_mot_email_goc(server, nha_may, email_nhan, noi_dung)
+        except Exception:
+            so_lan_loi[0] += 1
+            raise
+        do_tre_gui.append(monotonic() - bat_dau)
+        return ket_qua
+
+    ac._gui_mot_email = gui_mot_email_co_do
+    lo_email = dict(tao_lo_email(so_luong)) if tham_so.che_do != "dong" else None
+
+    # Sổ cái và file hạn mức nằm trong thư mục tạm để các lần đo không ảnh hưởng nhau
+    thu_muc_cu = os.getcwd()
+    with tempfile.TemporaryDirectory() as thu_muc_tam, open(os.devnull, "w", encoding="utf-8") as bo_qua:
+        os.chdir(thu_muc_tam)
+        try:
+            with contextlib.redirect_stdout(bo_qua):
+                bat_dau = monotonic()
+                if tham_so.che_do == "pool":
+                    ket_qua = ac.gui_email(lo_email, ten_file_so_cai=None)
+                elif tham_so.che_do == "dong":
+                    ket_qua = ac.gui_email_dong(tao_lo_email(so_luong), ten_file_so_cai=None)
+                else:
+                    ket_qua = ac.gui_email_dong_bo(lo_email, ten_file_so_cai=None)
+                thoi_gian = monotonic() - bat_dau
+        finally:
+            os.chdir(thu_muc_cu)
+            ac._gui_mot_email = gui_mot_email_goc
+    may_chu.shutdown()
+    may_chu.server_close()
+
+    so_thanh_cong = sum(1 for trang_thai in ket_qua.values() if trang_thai == "Thành công")
+    return {
+        "thoi_diem": datetime.now().isoformat(timespec="seconds"),
+        "che_do": tham_so.che_do,
+        "so_luong": so_luong,
+        "pool": tham_so.pool,
+        "do_tre": tham_so.do_tre,
+        "ti_le_451": tham_so.ti_le_451,
+        "ngat_moi": tham_so.ngat_moi,
+        "thanh_cong": so_thanh_cong,
+        "loi": len(ket_qua) - so_thanh_cong,
+        "lan_gui_loi": so_lan_loi[0],
+        "thoi_gian_s": round(thoi_gian, 3),
+        "email_moi_giay": round(so_thanh_cong / thoi_gian, 1) if thoi_gian > 0 else None,
+        "p50_ms": _phan_vi_ms(do_tre_gui, 50),
+        "p99_ms": _phan_vi_ms(do_tre_gui, 99),
+        # ru_maxrss tính bằng KB trên Linux
+        "rss_dinh_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "may_chu": dict(may_chu.thong_ke),
+    }
+
+
+def _in_ket_qua(ket_qua: Dict[str, object]) -> None:
+    print(
+        f"{ket_qua['che_do']:>8} {ket_qua['so_luong']:>7} {ket_qua['thanh_cong']:>7} {ket_qua['loi']:>5} "
+        f"{ket_qua['thoi_gian_s']:>9} {ket_qua['email_moi_giay'] or '-':>9} "
+        f"{ket_qua['p50_ms'] or '-':>8} {ket_qua['p99_ms'] or '-':>8} {ket_qua['rss_dinh_mb']:>8}",
+        flush=True,
+    )
+
+
+def _doc_tham_so(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Đo tải gửi email với máy chủ SMTP giả lập.")
+    parser.add_argument("--so-luong", type=int, nargs="+", default=DEFAULT_BATCH_SIZES,
+                        help="Các kích thước lô email cần đo.")
+    parser.add_argument("--che-do", choices=CAC_CHE_DO, default="pool",
+                        help="pool: gui_email, dong: gui_email_dong, dong_bo: gui_email_dong_bo.")
+    parser.add_argument("--pool", type=int, default=ac.SMTP_DEFAULT_POOL_SIZE, help="SMTP_POOL_SIZE.")
+    parser.add_argument("--do-tre", type=float, default=0.0, help="Giây máy chủ chờ trước khi xác nhận mỗi thư.")
+    parser.add_argument("--ti-le-451", type=float, default=0.0, help="Xác suất trả lời 451 cho mỗi thư.")
+    parser.add_argument("--ngat-moi", type=int, default=0, help="Ngắt kết nối sau mỗi N thư (0: không ngắt).")
+    parser.add_argument("--toc-do-toi-da", type=float, default=0.0,
+                        help=f"SMTP_MAX_RATE khi đo (0: bỏ điều tiết; thực tế: {ac.SMTP_MAX_RATE}).")
+    parser.add_argument("--luu", help="Ghi thêm kết quả (mỗi dòng một JSON) vào file này.")
+    parser.add_argument("--mot-lan", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    tham_so = _doc_tham_so(argv)
+    if tham_so.mot_lan:
+        # Tiến trình con: đo đúng một kích thước lô và in kết quả dạng JSON
+        print(json.dumps(do_mot_lan(tham_so.so_luong[0], tham_so), ensure_ascii=False))
+        return
+
+    print(f"{'chế độ':>8} {'số lượng':>7} {'t.công':>7} {'lỗi':>5} {'giây':>9} {'email/s':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>8}")
+    tham_so_con = list(argv if argv is not None else sys.argv[1:])
+    for so_luong in tham_so.so_luong:
+        lenh = [sys.executable, os.path.abspath(__file__), *tham_so_con, "--mot-lan", "--so-luong", str(so_luong)]
+        tien_trinh = subprocess.run(lenh, capture_output=True, text=True, encoding="utf-8")
+        if tien_trinh.returncode != 0:
+            print(f"Lỗi khi đo lô {so_luong} email:\n{tien_trinh.stderr}", file=sys.stderr)
+            continue
+        ket_qua = json.loads(tien_trinh.stdout.strip().splitlines()[-1])
+        _in_ket_qua(ket_qua)
+        if tham_so.luu:
+            with open(tham_so.luu, "a", encoding="utf-8") as f:
+                f.write(json.dumps(ket_qua, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()